@@ -3,22 +3,75 @@
 # Written by Thomas H. Kolbe (thomas.kolbe@tum.de), Chair of Geoinformatics, 
 # School of Engineering and Design, Technical University of Munich
 #
-# Version 0.9.1, Last change: 2026-02-19
+# Version 0.10.0, Last change: 2026-10-18
 #
 # This version supports multi-appearance/multi-texturing:
 # - Multiple materials can be assigned to different faces of a geometry
 # - Each surface gets a unique ID for targeted appearance mapping
 # - Supports per-face colors from IFC (IfcIndexedColourMap, IfcMaterialConstituentSet)
 # - Generates one Appearance element per CityGML feature with multiple X3DMaterial children
+#
+# Version 0.10.0 adds:
+# - Geometry kernel fallback chains, tessellation tolerances and mesh decimation
+# - A parallel conversion pipeline, an in-memory API and a local conversion service
+# - Output variants, split output, envelopes with a spatial index, element filters and an inventory
+# - Out-of-core conversion, merging of several IFC files, checkpoints and compressed input/output
+# - CityJSON, GeoPackage, Parquet and glTF output and the transformation into a target CRS
 
 import ifcopenshell
 import ifcopenshell.geom
 import ifcopenshell.util.element
+import ifcopenshell.util.placement
+import ifcopenshell.util.unit
 import uuid
+import copy
 import numpy as np
 import os
+import re
+import io
+import sys
+import json
+import gzip
+import zipfile
+import pickle
+import stat
+import struct
+import shutil
+import heapq
+import mmap
+import time
+import signal
+import contextlib
+import multiprocessing
+import queue
+import socketserver
+import sqlite3
+import tempfile
+import threading
 import argparse
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from xml.sax.saxutils import escape as xml_escape
 from lxml import etree
+try:
+    # Optional: zstd compressed output (see CompressedOutput)
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    # Optional: Parquet output (see ParquetWriter)
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    # Optional: CRS definitions of the GeoParquet metadata (see get_geoparquet_metadata())
+    import pyproj
+except ImportError:
+    pyproj = None
 
 # --- Namespaces for CityGML 3.0 ---
 NSMAP = {
@@ -43,11 +96,2452 @@ SOLID_REPRESENTATION_TYPES = {
     "BoundingBox"   # Simplified solid box
 }
 
+# Geometry kernels (IfcOpenShell geometry libraries) that can be selected with --geometry-kernel.
+# Which of them are actually available depends on how IfcOpenShell was built.
+# - opencascade: the IfcOpenShell default, robust boolean operations (opening subtraction)
+# - cgal: exact arithmetic, robust but usually slower than OpenCASCADE
+# - cgal-simple: CGAL without boolean operations, very fast (openings are not subtracted)
+# - manifold: fast boolean operations on (manifold) meshes
+# - hybrid-cgal-simple-opencascade: CGAL-simple for plain geometry, OpenCASCADE for booleans
+GEOMETRY_KERNELS = [
+    "opencascade",
+    "cgal",
+    "cgal-simple",
+    "manifold",
+    "hybrid-cgal-simple-opencascade"
+]
+DEFAULT_GEOMETRY_KERNEL = "opencascade"
+
+# Size-adaptive tessellation (--adaptive-deflection):
+# The linear deflection of an element is its bounding box diagonal multiplied by the factor of its
+# IFC class, rounded down to a power-of-two multiple of ADAPTIVE_MIN_LINEAR_DEFLECTION and capped at
+# ADAPTIVE_MAX_LINEAR_DEFLECTION (levels 0.001, 0.002, ..., 0.064 and 0.1 from 0.128 on). Classes
+# with many small curved parts (railings, furniture, proxies) get coarser tolerances than structural parts.
+ADAPTIVE_DEFLECTION_FACTORS = {
+    "IfcColumn": 0.005,
+    "IfcBeam": 0.005,
+    "IfcMember": 0.005,
+    "IfcRailing": 0.02,
+    "IfcCovering": 0.01,
+    "IfcBuildingElementProxy": 0.02,
+    "IfcFurnishingElement": 0.02,
+    "IfcFurniture": 0.02,
+    "IfcSystemFurnitureElement": 0.02,
+    "IfcDoor": 0.01,
+    "IfcWindow": 0.01
+}
+ADAPTIVE_DEFAULT_DEFLECTION_FACTOR = 0.005
+ADAPTIVE_MIN_LINEAR_DEFLECTION = 0.001
+ADAPTIVE_MAX_LINEAR_DEFLECTION = 0.1
+
+# Mesh decimation (--max-triangles, --max-triangles-per-class):
+# Maximum geometric error (in metres) introduced by the decimation, unless set with --decimation-error
+DEFAULT_DECIMATION_ERROR = 0.05
+# Number of bisection steps when searching the clustering cell size that meets a triangle budget
+DECIMATION_SEARCH_STEPS = 16
+
+# Conversion pipeline (--workers):
+# Maximum number of features in flight per worker (submitted to tessellation but not yet written)
+PIPELINE_JOBS_PER_WORKER = 4
+# Look-ahead per worker of the cost-aware scheduling: of the next jobs in document order (at most
+# this many per worker) the most expensive ones are dispatched first
+PIPELINE_SCHEDULE_WINDOW = 16
+# Maximum number of serialized fragments waiting for the writer thread
+PIPELINE_QUEUE_SIZE = 64
+
+# Compressed output (--compress or the extension of the output): extension and default level of
+# each compression
+OUTPUT_COMPRESSIONS = {'gzip': ".gz", 'zstd': ".zst"}
+COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+# Magic numbers of compressed IFC input (.ifc.gz, .ifczip)
+GZIP_MAGIC = b"\x1f\x8b"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# Output formats (--output-format or the extension of the output): CityGML 3.0, CityJSON 2.0,
+# CityJSON Text Sequence (one CityJSONFeature per Building and line), GeoPackage (SQLite database,
+# see DatabaseWriter), Parquet tables (see ParquetWriter) and binary glTF (see GltfWriter) with their
+# default extensions
+OUTPUT_FORMATS = {'citygml': ".gml", 'cityjson': ".city.json", 'cityjsonseq': ".city.jsonl", 'gpkg': ".gpkg", 'parquet': ".parquet", 'glb': ".glb"}
+# Output formats written by their writer to a file path instead of a stream (not compressed)
+PATH_OUTPUT_FORMATS = ('gpkg', 'parquet')
+# Output formats encoded as DatabaseFeatures (rows of the city objects)
+DATABASE_OUTPUT_FORMATS = ('gpkg', 'parquet', 'glb')
+CITYJSON_VERSION = "2.0"
+# Quantization of the CityJSON vertices (same precision as the posLists of the CityGML output)
+CITYJSON_SCALE = 0.001
+# CityJSON city object type (and feature type of the GeoPackage output) per FeatureJob kind
+CITYJSON_OBJECT_TYPES = {'wall': "BuildingConstructiveElement", 'constructive': "BuildingConstructiveElement", 'dummy': "BuildingConstructiveElement",
+                         'installation': "BuildingInstallation", 'room': "BuildingRoom", 'furniture': "BuildingFurniture"}
+# EPSG code in a srsName (EPSG:25832, urn:ogc:def:crs:EPSG::25832, .../def/crs/EPSG/0/25832)
+EPSG_CODE_PATTERN = re.compile(r"EPSG(?::+(?:\d+(?:\.\d+)*:)?|/\d+/)(\d+)$")
+# Compound CRS of a horizontal and a vertical EPSG code in a srsName (EPSG:25832+7837, see --target-crs)
+EPSG_COMPOUND_PATTERN = re.compile(r"^EPSG:(\d+)\+(\d+)$")
+
+# GeoPackage output (see DatabaseWriter): city objects per transaction of the bulk load, application
+# id ('GPKG') and version (1.3) of the database file
+DATABASE_BATCH_SIZE = 1000
+GEOPACKAGE_APPLICATION_ID = 0x47504B47
+GEOPACKAGE_VERSION = 10300
+# Geometry blob: header (magic, version, flags = little endian with xyz envelope, srs_id, envelope
+# minx, maxx, miny, maxy, minz, maxz), then a WKB MultiPolygon Z (ISO type 1006) of triangles, each a
+# Polygon Z (type 1003) with one ring of four points
+GEOPACKAGE_HEADER = struct.Struct("<2sBBi6d")
+GEOPACKAGE_HEADER_FLAGS = 0b101
+WKB_MULTIPOLYGON_Z = struct.Struct("<BII")
+WKB_TRIANGLE_DTYPE = np.dtype([('byte_order', 'u1'), ('type', '<u4'), ('rings', '<u4'), ('points', '<u4'), ('coordinates', '<f8', (12,))])
+
+# Parquet output (see ParquetWriter): rows per record batch, file of the property table next to the
+# feature table (<name>_properties.parquet) and GeoParquet version of the geometry metadata
+PARQUET_BATCH_SIZE = 10000
+PARQUET_PROPERTIES_SUFFIX = "_properties.parquet"
+GEOPARQUET_VERSION = "1.1.0"
+
+# Binary glTF output (see GltfWriter): file header (magic, version, length), chunk header (length,
+# type) and chunk types, component types of the accessors, targets of the buffer views and colour of
+# the faces without material
+GLB_HEADER = struct.Struct("<4sII")
+GLB_CHUNK_HEADER = struct.Struct("<II")
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+GLTF_FLOAT = 5126
+GLTF_UNSIGNED_INT = 5125
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+GLTF_DEFAULT_MATERIAL = (0.8, 0.8, 0.8, 0.0)
+
+# Checkpoints (--checkpoint-dir, --resume, see Checkpoint): seconds between the commits of the
+# journal of converted features, and the file names in the work directory
+CHECKPOINT_INTERVAL = 30.0
+CHECKPOINT_JOURNAL = "features.journal"
+CHECKPOINT_STATE = "checkpoint.json"
+
+# Options that only affect the serialization of the features: they may differ between the
+# outputs of one run (see CityGMLGenerator.derive() and write_variants())
+VARIANT_OPTIONS = ('no_references', 'no_properties', 'no_generic_attribute_sets', 'pset_names_as_prefixes', 'no_storeys', 'no_appearances', 'shared_materials', 'envelopes', 'output_format', 'parquet_geometry')
+
+# Generator attributes that change the converted features besides the element selection (which is
+# checked per feature): a checkpoint is only resumed with the same values
+CHECKPOINT_OPTIONS = VARIANT_OPTIONS + ('reorient_shells', 'georef_oktoberfest', 'target_crs', 'xoffset', 'yoffset', 'zoffset', 'geometry_kernels', 'kernel_timeout', 'linear_deflection', 'angular_deflection',
+                                        'adaptive_deflection', 'max_triangles', 'max_triangles_per_class', 'decimation_error', 'filename', 'split', 'tile_size')
+
+# Split output (see OutputPartition): modes and default tile size (in units of the output CRS)
+SPLIT_MODES = ("building", "storey", "tile")
+DEFAULT_TILE_SIZE = 100.0
+
+# Envelopes (--envelopes): the envelopes of the Buildings and the CityModel are only known after their
+# features are converted. They are written as blank corners of this width (characters), marked with
+# ENVELOPE_PLACEHOLDER until written, and filled in when the document is complete. If the envelope
+# stays unknown (no geometry), the whole gml:boundedBy element is blanked instead.
+ENVELOPE_CORNER_WIDTH = 72
+ENVELOPE_PLACEHOLDER = "ENVELOPE_PLACEHOLDER"
+ENVELOPE_PLACEHOLDER_PATTERN = re.compile(ENVELOPE_PLACEHOLDER.encode() + rb":([^:<]*):(lower|upper) *")
+ENVELOPE_BOUNDED_BY_PATTERN = re.compile(rb"<gml:boundedBy>(?:(?!</gml:boundedBy>).)*?" + ENVELOPE_PLACEHOLDER.encode() + rb":([^:<]*):lower.*?</gml:boundedBy>", re.S)
+# Envelope key of the CityModel (the Buildings use their gml:id)
+CITY_MODEL_ENVELOPE_KEY = "CityModel"
+
+# Spatial index sidecar (--spatial-index, see write_spatial_index()): file signature and number of
+# children per node of the packed Hilbert R-tree
+SPATIAL_INDEX_MAGIC = b"CGMLHRT1"
+SPATIAL_INDEX_NODE_SIZE = 16
+SPATIAL_INDEX_HEADER = struct.Struct("<8sIIQ")
+SPATIAL_INDEX_ITEM_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u8'), ('id_offset', '<u8'), ('id_length', '<u8')])
+
+# Cost model of the conversion (--inventory, see CostSignals.estimate()): (seconds, output bytes) per
+# element plus the cost of its representation type (the most expensive one of its Body
+# representations), of each further geometric item, face of a face-based item (Brep, face set) and
+# opening. Calibrated on the FZK Haus sample (one core, OpenCASCADE kernel, about 700 bytes of
+# output per triangle); the representation types that do not occur in it are rough estimates.
+COST_MODEL = {
+    'element': (0.0005, 2000),
+    'representation_types': {
+        'SweptSolid': (0.0006, 8400),
+        'Clipping': (0.23, 280000),
+        'Brep': (0.002, 0),
+        'Tessellation': (0.001, 0),
+        'SurfaceModel': (0.002, 0),
+        'AdvancedSweptSolid': (0.02, 40000),
+        'AdvancedBrep': (0.05, 100000),
+        'CSG': (0.1, 140000),
+        'BoundingBox': (0.0005, 8400),
+        'other': (0.01, 20000),
+    },
+    'item': (0.001, 0),
+    'face': (0.00015, 1900),
+    'opening': (0.0115, 17000),
+    # Start-up (imports) and reading of the IFC file (per MB)
+    'startup': (0.3, 0),
+    'model_per_mb': (0.02, 0),
+}
+
+# Out-of-core conversion (--out-of-core, see convert_out_of_core()): the IFC file is split into one
+# sub-model per building or storey without loading it (see StepIndex)
+OUT_OF_CORE_MODES = ("building", "storey")
+# Entity instance of the DATA section ('#12=IFCWALL(...);', strings may contain ';' and ')'),
+# entity references and strings in its attributes
+STEP_INSTANCE_PATTERN = re.compile(rb"#(\d+)\s*=\s*(\w+)\s*\(((?:[^';]+|'[^']*')*)\)\s*;")
+STEP_REFERENCE_PATTERN = re.compile(rb"#(\d+)")
+STEP_STRING_PATTERN = re.compile(rb"'[^']*'")
+STEP_ATTRIBUTE_TOKEN_PATTERN = re.compile(rb"'[^']*'|[(),]")
+# Block size for copying runs of instances into a sub-model
+STEP_COPY_CHUNK_SIZE = 1 << 24
+STEP_SCHEMA_PATTERN = re.compile(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']+)'")
+# Relationships that take their related objects into a sub-model if the relating object belongs
+# to it (decomposition, containment, openings and their fillings): (relating, related attribute)
+STEP_DECOMPOSITION_RELATIONSHIPS = {
+    'IfcRelAggregates': ('RelatingObject', 'RelatedObjects'),
+    'IfcRelNests': ('RelatingObject', 'RelatedObjects'),
+    'IfcRelContainedInSpatialStructure': ('RelatingStructure', 'RelatedElements'),
+    'IfcRelVoidsElement': ('RelatingBuildingElement', 'RelatedOpeningElement'),
+    'IfcRelProjectsElement': ('RelatingElement', 'RelatedFeatureElement'),
+    'IfcRelFillsElement': ('RelatingOpeningElement', 'RelatedBuildingElement'),
+}
+# Resource entities that are only found through inverse attributes: they belong to the sub-models
+# that contain the instance referenced by the given attribute (styles of geometric items and
+# materials, georeferencing of the representation context)
+STEP_ATTACHED_ENTITIES = {
+    'IfcStyledItem': 'Item',
+    'IfcMaterialDefinitionRepresentation': 'RepresentedMaterial',
+    'IfcCoordinateOperation': 'SourceCRS',
+}
+# Feature properties of a Building in schema order (merging of sub-model documents)
+BUILDING_FEATURE_PROPERTIES = ("buildingConstructiveElement", "buildingInstallation", "buildingRoom", "buildingFurniture", "buildingSubdivision")
+
+# --- Conversion service (serve mode) ---
+SERVICE_DEFAULT_HOST = "127.0.0.1"
+SERVICE_DEFAULT_PORT = 8080
+# The output of a conversion is sent from the worker process to the service in messages of about this size
+SERVICE_MESSAGE_SIZE = 1 << 16
+# Number of finished jobs the latency metrics are computed from
+SERVICE_LATENCY_WINDOW = 1000
+# Interval (seconds) in which idle service workers check whether the service is still running
+SERVICE_WORKER_POLL_INTERVAL = 1.0
+
+
+def _cluster_mesh(vertices, faces, cell_size):
+    """
+    Snaps the vertices of a triangle mesh to a regular grid with the given cell size.
+    Returns (cluster_ids, kept_faces) where cluster_ids maps each vertex to its grid cell and
+    kept_faces is the index array of the faces that do not collapse and are not duplicated.
+    """
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    # Encode the 3D cell index as one integer key (much faster to unique than rows)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, cluster_ids = np.unique(keys, return_inverse=True)
+    cluster_ids = cluster_ids.reshape(-1)
+    clustered = cluster_ids[faces]
+    non_degenerate = (clustered[:, 0] != clustered[:, 1]) & (clustered[:, 1] != clustered[:, 2]) & (clustered[:, 0] != clustered[:, 2])
+    candidates = np.nonzero(non_degenerate)[0]
+    # Remove faces that collapse onto the same three clusters (keep the first one)
+    corners = np.sort(clustered[candidates], axis=1)
+    cluster_count = int(cluster_ids.max()) + 1
+    if cluster_count < 2000000:
+        face_keys = (corners[:, 0] * cluster_count + corners[:, 1]) * cluster_count + corners[:, 2]
+        _, first = np.unique(face_keys, return_index=True)
+    else:
+        # Keys would overflow int64
+        _, first = np.unique(corners, axis=0, return_index=True)
+    return cluster_ids, np.sort(candidates[first])
+
+
+def decimate_mesh(vertices, faces, material_ids, max_triangles, max_error=DEFAULT_DECIMATION_ERROR):
+    """
+    Reduces a triangle mesh to at most max_triangles faces by quadric-based vertex clustering
+    (Lindstrom 2000): vertices are clustered on a regular grid and each cluster is replaced by the
+    position minimising the quadric error of its adjacent faces. The cell size is found by bisection
+    and never exceeds the cell whose diagonal equals max_error, so the error bound takes precedence
+    over the triangle budget. Faces keep their material index.
+
+    Args:
+        vertices: (N, 3) float array
+        faces: (M, 3) integer array of vertex indices
+        material_ids: (M,) integer array with the material index of each face
+        max_triangles: triangle budget for the mesh
+        max_error: maximum geometric error (cell diagonal)
+
+    Returns:
+        tuple: (vertices, faces, material_ids) of the decimated mesh (the input arrays if no decimation was possible)
+    """
+    if len(faces) <= max_triangles or len(vertices) < 4:
+        return vertices, faces, material_ids
+
+    max_cell = max_error / np.sqrt(3.0)
+    extent = float(np.max(vertices.max(axis=0) - vertices.min(axis=0)))
+    if extent <= 0.0:
+        return vertices, faces, material_ids
+
+    # Bisection of the cell size: smallest cell size that meets the budget (within the error bound)
+    low, high = extent * 1e-6, min(max_cell, extent)
+    best = None
+    cluster_ids, kept = _cluster_mesh(vertices, faces, high)
+    if len(kept) <= max_triangles:
+        best = (cluster_ids, kept)
+        for _ in range(DECIMATION_SEARCH_STEPS):
+            middle = (low + high) / 2.0
+            cluster_ids, kept = _cluster_mesh(vertices, faces, middle)
+            if len(kept) <= max_triangles:
+                best = (cluster_ids, kept)
+                high = middle
+            else:
+                low = middle
+    else:
+        # Budget not reachable within the error bound: use the largest permitted cell size
+        best = (cluster_ids, kept)
+
+    cluster_ids, kept = best
+    if len(kept) >= len(faces):
+        return vertices, faces, material_ids
+
+    # Fundamental error quadrics of the faces (area weighted), accumulated per cluster
+    corners = vertices[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    valid = areas > 0
+    unit_normals = np.zeros_like(normals)
+    unit_normals[valid] = normals[valid] / areas[valid, None]
+    planes = np.hstack([unit_normals, -np.einsum('ij,ij->i', unit_normals, corners[:, 0])[:, None]])
+    face_quadrics = (areas[:, None, None] * 0.5) * planes[:, :, None] * planes[:, None, :]
+
+    cluster_count = int(cluster_ids.max()) + 1
+    quadrics = np.zeros((cluster_count, 4, 4))
+    for corner in range(3):
+        np.add.at(quadrics, cluster_ids[faces[:, corner]], face_quadrics)
+
+    # Cluster mean as fallback for singular quadrics (flat or degenerate regions)
+    counts = np.bincount(cluster_ids, minlength=cluster_count).astype(float)
+    means = np.zeros((cluster_count, 3))
+    for axis in range(3):
+        means[:, axis] = np.bincount(cluster_ids, weights=vertices[:, axis], minlength=cluster_count) / np.maximum(counts, 1.0)
+
+    positions = means.copy()
+    a = quadrics[:, :3, :3]
+    b = -quadrics[:, :3, 3]
+    solvable = np.abs(np.linalg.det(a)) > 1e-12
+    if np.any(solvable):
+        solved = np.linalg.solve(a[solvable], b[solvable][:, :, None])[:, :, 0]
+        # Reject solutions that would move a cluster further than the error bound
+        close = np.linalg.norm(solved - means[solvable], axis=1) <= max_error
+        indices = np.nonzero(solvable)[0][close]
+        positions[indices] = solved[close]
+
+    # Compact the vertex array to the clusters that are referenced by the kept faces
+    new_faces = cluster_ids[faces[kept]]
+    used, remapped = np.unique(new_faces, return_inverse=True)
+    return positions[used], remapped.reshape(-1, 3).astype(faces.dtype), material_ids[kept]
+
+
+class GeometryRecord:
+    """
+    Compact intermediate geometry of one element, held in contiguous numpy arrays:
+    - vertices: (N, 3) float64 array of georeferenced vertex coordinates
+    - faces: (M, 3) int32 array of vertex indices (triangles)
+    - material_ids: (M,) int16 array with the index into materials per face (-1 = no material)
+    - materials: small material table, list of (r, g, b, transparency) tuples (None if the material has no colour)
+    Surface ids are not stored per face; the gml:id of face i is '<surface_id_prefix>_<i>'.
+    """
+    __slots__ = ('vertices', 'faces', 'material_ids', 'materials', 'surface_id_prefix')
+
+    def __init__(self, vertices, faces, material_ids, materials):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float64).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+        self.material_ids = np.ascontiguousarray(material_ids, dtype=np.int16)
+        self.materials = materials
+        self.surface_id_prefix = f"UUID_{uuid.uuid4()}"
+
+    def __len__(self):
+        """Number of faces (triangles)."""
+        return len(self.faces)
+
+    def surface_id(self, face_index):
+        """Returns the gml:id of the polygon for a face."""
+        return f"{self.surface_id_prefix}_{face_index}"
+
+    def envelope(self):
+        """Returns the bounding box of the vertices as (lower corner, upper corner) arrays."""
+        return self.vertices.min(axis=0), self.vertices.max(axis=0)
+
+    def ring_coordinates(self):
+        """Returns the closed rings of all faces as (M, 12) array (first vertex repeated at the end)."""
+        return self.vertices[self.faces[:, [0, 1, 2, 0]]].reshape(-1, 12)
+
+    def faces_by_material(self):
+        """
+        Groups the faces by material colour and transparency (rounded to 6 digits, so materials with the
+        same values are merged) using one np.unique call over the per-face material ids.
+        Returns a list of ((r, g, b, transparency), face_indices) with face_indices as int array,
+        ordered by the first face using the material. Faces without material are omitted.
+        """
+        if not self.materials or len(self.faces) == 0:
+            return []
+
+        # Map each entry of the material table to the index of its (rounded) key; -1 = no colour
+        keys = []
+        key_index = {}
+        canonical = np.full(len(self.materials) + 1, -1, dtype=np.int32)
+        for mat_idx, mat in enumerate(self.materials):
+            if mat is None:
+                continue
+            key = (round(mat[0], 6), round(mat[1], 6), round(mat[2], 6), round(mat[3], 6))
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            canonical[mat_idx] = key_index[key]
+
+        # Index -1 (no material) maps to the last entry of canonical, which is -1 as well
+        face_keys = canonical[self.material_ids]
+        valid_faces = np.nonzero(face_keys >= 0)[0]
+        if len(valid_faces) == 0:
+            return []
+
+        unique_keys, first, inverse = np.unique(face_keys[valid_faces], return_index=True, return_inverse=True)
+        # Faces sorted by group (stable, so each group keeps ascending face order)
+        grouped = valid_faces[np.argsort(inverse.reshape(-1), kind='stable')]
+        groups = np.split(grouped, np.cumsum(np.bincount(inverse.reshape(-1)))[:-1])
+        order = np.argsort(first)
+        return [(keys[unique_keys[group]], groups[group]) for group in order]
+
+    def surface_id_targets(self, face_indices):
+        """Returns the app:target values ('#<surface id>') for an array of face indices."""
+        prefix = f"#{self.surface_id_prefix}_"
+        return [prefix + str(face_idx) for face_idx in face_indices.tolist()]
+
+
+# Format string for the posList of a closed triangle ring (4 points with 3 coordinates)
+POS_LIST_FORMAT = " ".join(["%.3f"] * 12)
+
+
+def format_pos_lists(rings):
+    """
+    Formats an (M, 12) array of closed triangle rings as posList strings (3 decimals, the same text as
+    POS_LIST_FORMAT). The characters of all coordinates are computed from their integer millimetres
+    in one character array and decoded at once, so no Python object is created per coordinate; only
+    the (rare) values within the rounding error of a tie are rounded by the string formatting.
+    """
+    rings = np.asarray(rings, dtype=np.float64)
+    if rings.size == 0:
+        return []
+    if not np.isfinite(rings).all():
+        return [POS_LIST_FORMAT % tuple(ring) for ring in rings.tolist()]
+    values = rings.ravel()
+    scaled = values * 1000.0
+    millimetres = np.rint(np.abs(scaled)).astype(np.int64)
+    ties = np.flatnonzero(np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= np.abs(scaled) * 4e-16 + 1e-9)
+    if len(ties):
+        millimetres[ties] = [int(("%.3f" % abs(value)).replace(".", "")) for value in values[ties].tolist()]
+    integers, fractions = np.divmod(millimetres, 1000)
+
+    # One row per coordinate: sign and integer digits right-aligned in width + 1 columns, the point,
+    # three decimals and the separator (a newline after the last coordinate of a ring); 0 = unused
+    width = len(str(int(integers.max())))
+    digits = np.ones(len(values), dtype=np.int64)
+    for power in range(1, width):
+        digits += integers >= 10 ** power
+    chars = np.zeros((len(values), width + 6), dtype=np.uint8)
+    for power in range(width):
+        chars[:, width - power] = np.where(power < digits, 48 + (integers // 10 ** power) % 10, 0)
+    negative = np.flatnonzero(np.signbit(values))
+    chars[negative, width - digits[negative]] = ord("-")
+    chars[:, width + 1] = ord(".")
+    for power in range(3):
+        chars[:, width + 4 - power] = 48 + (fractions // 10 ** power) % 10
+    chars[:, width + 5] = ord(" ")
+    chars.reshape(len(rings), -1)[:, -1] = ord("\n")
+    return chars[chars != 0].tobytes().decode("ascii").split("\n")[:-1]
+
+
+def get_records_envelope(records):
+    """Returns the envelope (minx, miny, minz, maxx, maxy, maxz) of the GeometryRecords of a job ({STEP id: record or None}), None without geometry."""
+    envelopes = [record.envelope() for record in records.values() if record]
+    if not envelopes:
+        return None
+    lower = np.min([envelope[0] for envelope in envelopes], axis=0)
+    upper = np.max([envelope[1] for envelope in envelopes], axis=0)
+    return tuple(float(c) for c in np.concatenate([lower, upper]))
+
+
+def merge_envelopes(envelope, other):
+    """Returns the union of two envelopes (minx, miny, minz, maxx, maxy, maxz); either may be None."""
+    if envelope is None:
+        return other
+    if other is None:
+        return envelope
+    return tuple(min(a, b) for a, b in zip(envelope[:3], other[:3])) + tuple(max(a, b) for a, b in zip(envelope[3:], other[3:]))
+
+
+def format_corner(coordinates):
+    """Formats the coordinates of an envelope corner (3 decimals, like the posLists)."""
+    return " ".join(f"{c:.3f}" for c in coordinates)
+
+
+def insert_bounded_by(feature, envelope, srs_name):
+    """
+    Inserts gml:boundedBy/gml:Envelope into a feature element (after gml:description and gml:name).
+    envelope is (minx, miny, minz, maxx, maxy, maxz) or, for an envelope that is not known yet, its
+    key (str): the corners are then written as placeholders (see extract_envelope_placeholders()).
+    Returns the gml:boundedBy element.
+    """
+    if isinstance(envelope, str):
+        lower = f"{ENVELOPE_PLACEHOLDER}:{envelope}:lower".ljust(ENVELOPE_CORNER_WIDTH)
+        upper = f"{ENVELOPE_PLACEHOLDER}:{envelope}:upper".ljust(ENVELOPE_CORNER_WIDTH)
+    else:
+        lower, upper = format_corner(envelope[:3]), format_corner(envelope[3:])
+    leading_tags = {f"{{{NSMAP['gml']}}}description", f"{{{NSMAP['gml']}}}name"}
+    position = 0
+    while position < len(feature) and feature[position].tag in leading_tags:
+        position += 1
+    bounded_by = etree.Element(f"{{{NSMAP['gml']}}}boundedBy")
+    gml_envelope = etree.SubElement(bounded_by, f"{{{NSMAP['gml']}}}Envelope", attrib={"srsName": srs_name, "srsDimension": "3"})
+    etree.SubElement(gml_envelope, f"{{{NSMAP['gml']}}}lowerCorner").text = lower
+    etree.SubElement(gml_envelope, f"{{{NSMAP['gml']}}}upperCorner").text = upper
+    feature.insert(position, bounded_by)
+    return bounded_by
+
+
+def insert_appearance_property(feature, appearance_property):
+    """
+    Inserts a core:appearance property into a feature element: after gml:description, gml:name,
+    gml:boundedBy, core:externalReference and any core:appearance, before the generic attributes.
+    """
+    leading_tags = {f"{{{NSMAP['gml']}}}description", f"{{{NSMAP['gml']}}}name", f"{{{NSMAP['gml']}}}boundedBy", f"{{{NSMAP['core']}}}externalReference", f"{{{NSMAP['core']}}}appearance"}
+    position = 0
+    while position < len(feature) and feature[position].tag in leading_tags:
+        position += 1
+    feature.insert(position, appearance_property)
+
+
+def encode_lod3_geometry(record, geometry_id, is_solid, srs_name, level):
+    """
+    Template-based encoder for the geometry of a GeometryRecord: returns the same bytes as
+    CityGMLGenerator._add_lod3_geometry() serialized with pretty printing at the given level, without
+    creating an element per triangle. The first line is not indented and there is no final newline
+    (the encoded geometry replaces a placeholder element, see expand_geometry_placeholders()).
+    """
+    def indent(depth):
+        return "  " * (level + depth)
+
+    attributes = f'gml:id="{xml_escape(geometry_id, XML_ATTRIBUTE_ENTITIES)}" srsName="{xml_escape(srs_name, XML_ATTRIBUTE_ENTITIES)}" srsDimension="3"'
+    if is_solid:
+        head = ["<core:lod3Solid>", f"{indent(1)}<gml:Solid {attributes}>", f"{indent(2)}<gml:exterior>", f"{indent(3)}<gml:Shell>"]
+        tail = [f"{indent(3)}</gml:Shell>", f"{indent(2)}</gml:exterior>", f"{indent(1)}</gml:Solid>", f"{indent(0)}</core:lod3Solid>"]
+    else:
+        head = ["<core:lod3MultiSurface>", f"{indent(1)}<gml:MultiSurface {attributes}>"]
+        tail = [f"{indent(1)}</gml:MultiSurface>", f"{indent(0)}</core:lod3MultiSurface>"]
+    depth = len(head)
+
+    # One template per surface member with the face index (for the polygon id) and the posList
+    prefix = xml_escape(record.surface_id_prefix, XML_ATTRIBUTE_ENTITIES).replace("%", "%%")
+    member_template = "\n".join([
+        f"{indent(depth)}<gml:surfaceMember>",
+        f'{indent(depth + 1)}<gml:Polygon gml:id="{prefix}_%d">',
+        f"{indent(depth + 2)}<gml:exterior>",
+        f"{indent(depth + 3)}<gml:LinearRing>",
+        f"{indent(depth + 4)}<gml:posList>%s</gml:posList>",
+        f"{indent(depth + 3)}</gml:LinearRing>",
+        f"{indent(depth + 2)}</gml:exterior>",
+        f"{indent(depth + 1)}</gml:Polygon>",
+        f"{indent(depth)}</gml:surfaceMember>",
+    ])
+    members = [member_template % (face_idx, pos_list) for face_idx, pos_list in enumerate(format_pos_lists(record.ring_coordinates()))]
+    return "\n".join(head + members + tail).encode("utf-8")
+
+
+def expand_geometry_placeholders(fragment, geometries, srs_name):
+    """
+    Replaces the geometry placeholder elements of a serialized fragment by the template-encoded
+    geometries. geometries is the list of (record, geometry id, is_solid) collected by
+    CityGMLGenerator._add_lod3_geometry(); placeholder i is <GEOMETRY_PLACEHOLDER_i/>.
+    """
+    parts = []
+    position = 0
+    for index, (record, geometry_id, is_solid) in enumerate(geometries):
+        token = f"<{GEOMETRY_PLACEHOLDER}_{index}/>".encode()
+        start = fragment.index(token, position)
+        # The indentation of the placeholder gives the level of the geometry property
+        level = (start - fragment.rindex(b"\n", 0, start) - 1) // 2
+        parts.append(fragment[position:start])
+        parts.append(encode_lod3_geometry(record, geometry_id, is_solid, srs_name, level))
+        position = start + len(token)
+    parts.append(fragment[position:])
+    return b"".join(parts)
+
+
+class DetachedMaterial:
+    """Picklable copy of an IfcOpenShell style (diffuse colour and transparency)."""
+    def __init__(self, diffuse, transparency):
+        self.diffuse = diffuse
+        self.transparency = transparency
+
+
+class DetachedGeometry:
+    """Picklable copy of a triangulated IfcOpenShell geometry (as returned by a worker process)."""
+    def __init__(self, verts, faces, material_ids, materials):
+        self.verts = verts
+        self.faces = faces
+        self.material_ids = material_ids
+        self.materials = materials
+
+
+class DetachedShape:
+    """Picklable stand-in for the shape returned by ifcopenshell.geom.create_shape()."""
+    def __init__(self, geometry):
+        self.geometry = geometry
+
+
+# --- Streaming output ---
+# XML declaration as written by lxml for the whole document
+XML_DECLARATION = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+# Indentation level of the feature properties (e.g. bldg:buildingConstructiveElement):
+# core:CityModel > core:cityObjectMember > bldg:Building > property
+FEATURE_PROPERTY_LEVEL = 3
+# Namespace declarations in the start tag of a serialized fragment (declared once on core:CityModel)
+NAMESPACE_DECLARATION_PATTERN = re.compile(rb'\s+xmlns(?::[\w.-]+)?="[^"]*"')
+# Placeholder child used to split an element into start and end part
+FRAGMENT_PLACEHOLDER = "FRAGMENT_PLACEHOLDER"
+# Placeholder elements for geometries that are encoded with templates (see encode_lod3_geometry())
+GEOMETRY_PLACEHOLDER = "GEOMETRY_PLACEHOLDER"
+# Entities for escaping attribute values in template-encoded XML
+XML_ATTRIBUTE_ENTITIES = {'"': "&quot;"}
+
+
+def serialize_fragment(element, level, keep_namespaces=False):
+    """
+    Serializes a standalone element as pretty printed UTF-8 bytes, indented as if it was a
+    descendant at the given level of the document (same layout as lxml's pretty_print).
+    The namespace declarations are removed from the start tag unless keep_namespaces is set.
+    """
+    element.tail = None
+    etree.indent(element, space="  ", level=level)
+    fragment = etree.tostring(element, encoding="UTF-8")
+    if not keep_namespaces:
+        start_tag_end = fragment.index(b">")
+        fragment = NAMESPACE_DECLARATION_PATTERN.sub(b"", fragment[:start_tag_end]) + fragment[start_tag_end:]
+    return b"  " * level + fragment + b"\n"
+
+
+def serialize_open_close(element, level, keep_namespaces=False, container=None):
+    """
+    Serializes an element with its current children as (start part, end part), so that further
+    children of container (default: the element itself) can be written in between as serialized
+    fragments.
+    """
+    container = element if container is None else container
+    placeholder = etree.SubElement(container, FRAGMENT_PLACEHOLDER)
+    try:
+        fragment = serialize_fragment(element, level, keep_namespaces)
+    finally:
+        container.remove(placeholder)
+    start, end = fragment.split(f"<{FRAGMENT_PLACEHOLDER}/>".encode())
+    return start.rstrip(b" "), end.lstrip(b"\n")
+
+
+class AnnotatedFragment(bytes):
+    """
+    Serialized fragment with information for the writer (see CityGMLGenerator.write_variants()):
+    - feature: (gml:id, envelope) of the feature in the fragment (for the spatial index)
+    - placeholders: envelope corners to be filled in when the document is complete, as
+      (offset in the fragment, width, envelope key, 'lower', 'upper' or 'boundedBy')
+    """
+    feature = None
+    placeholders = ()
+
+    @classmethod
+    def create(cls, data, feature=None, placeholders=()):
+        fragment = cls(data)
+        fragment.feature = feature
+        fragment.placeholders = placeholders
+        return fragment
+
+
+def extract_envelope_placeholders(fragment):
+    """
+    Blanks the envelope placeholders written by insert_bounded_by() in a serialized fragment.
+    Returns an AnnotatedFragment with their positions (the corners are filled in by the writer) and
+    those of the gml:boundedBy elements around them ('boundedBy', blanked if the envelope stays unknown).
+    """
+    placeholders = [(match.start(), match.end() - match.start(), match.group(1).decode(), 'boundedBy') for match in ENVELOPE_BOUNDED_BY_PATTERN.finditer(fragment)]
+
+    def blank(match):
+        placeholders.append((match.start(), match.end() - match.start(), match.group(1).decode(), match.group(2).decode()))
+        return b" " * (match.end() - match.start())
+
+    return AnnotatedFragment.create(ENVELOPE_PLACEHOLDER_PATTERN.sub(blank, fragment), placeholders=placeholders)
+
+
+def fill_envelope_placeholders(stream, placeholders, envelopes, base=0):
+    """
+    Writes the envelope corners into a seekable stream at the positions of the placeholders
+    (offsets relative to base). The gml:boundedBy elements of unknown envelopes (e.g. a Building
+    without geometry) are overwritten with blanks, as an envelope without corners is invalid.
+    """
+    end = stream.tell()
+    for offset, width, key, corner in placeholders:
+        envelope = envelopes.get(key)
+        if (envelope is None) != (corner == 'boundedBy'):
+            continue
+        if envelope is None:
+            stream.seek(base + offset)
+            stream.write(b" " * width)
+            continue
+        text = format_corner(envelope[:3] if corner == 'lower' else envelope[3:]).encode()
+        if len(text) > width:
+            raise ValueError(f"envelope corner '{text.decode()}' exceeds {width} characters")
+        stream.seek(base + offset)
+        stream.write(text)
+    stream.seek(end)
+
+
+class TessellationStats:
+    """
+    Geometry statistics of a conversion: the kernel used per element, the number of elements per
+    kernel (plus failures), triangles per IFC class and per linear deflection, and the decimation
+    statistics. Collected per feature by the pipeline stages and merged in document order.
+    """
+    def __init__(self):
+        # Maps STEP id of the IFC element -> kernel name ('failed' if all kernels failed), see kernel_report_path
+        self.element_kernels = {}
+        self.kernel_counts = {}
+        self.triangle_counts = {}
+        self.deflection_triangle_counts = {}
+        # Number of decimated elements, triangles before and after
+        self.decimation = {'elements': 0, 'before': 0, 'after': 0}
+
+    def merge(self, other):
+        """Adds the statistics of another TessellationStats object."""
+        self.element_kernels.update(other.element_kernels)
+        for counts, other_counts in ((self.kernel_counts, other.kernel_counts),
+                                     (self.triangle_counts, other.triangle_counts),
+                                     (self.deflection_triangle_counts, other.deflection_triangle_counts),
+                                     (self.decimation, other.decimation)):
+            for key, count in other_counts.items():
+                counts[key] = counts.get(key, 0) + count
+
+
+class FeatureJob:
+    """
+    One CityGML feature to be converted by the pipeline (see CityGMLGenerator._run_pipeline()):
+    - kind: 'wall', 'constructive', 'installation', 'room', 'furniture' or 'dummy'
+      (dummy BuildingConstructiveElement for unrelated doors/windows)
+    - ifc_type: IFC class, written as bldg:class
+    - step_id: STEP id of the IFC element (None for dummy elements)
+    - fillings: STEP ids of the doors/windows written as con:filling
+    - name: gml:name of dummy elements
+    - storey_key: GlobalId of the storey of a dummy element ('__UNMAPPED__' without storey)
+    Jobs refer to the IFC model by STEP ids only, so they can be sent to worker processes.
+    """
+    __slots__ = ('kind', 'ifc_type', 'step_id', 'fillings', 'name', 'storey_key')
+
+    def __init__(self, kind, ifc_type, step_id=None, fillings=(), name=None, storey_key=None):
+        self.kind = kind
+        self.ifc_type = ifc_type
+        self.step_id = step_id
+        self.fillings = list(fillings)
+        self.name = name
+        self.storey_key = storey_key
+
+    def key(self):
+        """Returns a tuple that identifies the job in the planned job sequence (see Checkpoint)."""
+        return (self.kind, self.ifc_type, self.step_id, tuple(self.fillings), self.storey_key)
+
+
+def simulate_makespan(durations, workers):
+    """
+    Returns the makespan of jobs with the given durations (in dispatch order) on a number of
+    workers, each job taken by the worker that becomes idle first (greedy list scheduling).
+    """
+    idle_at = [0.0] * min(workers, len(durations))
+    for duration in durations:
+        heapq.heapreplace(idle_at, idle_at[0] + duration)
+    return max(idle_at, default=0.0)
+
+
+class ScheduleStats:
+    """
+    Measured conversion time per FeatureJob (key: GlobalId of the element, see CityGMLGenerator._get_timing_key())
+    and the report of the cost-aware scheduling (see CityGMLGenerator._run_pipeline()): the makespans
+    of the pipeline segments simulated with the measured durations for the dispatch order used and
+    for the document order (i.e. without scheduling), summed over the segments.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.jobs = 0
+        self.busy_seconds = 0.0
+        self.makespan = 0.0
+        self.makespan_document_order = 0.0
+
+    def add_segment(self, durations, dispatch_order, workers):
+        """Adds a pipeline segment: job durations in document order and the order in which they were dispatched."""
+        self.jobs += len(durations)
+        self.busy_seconds += sum(durations)
+        self.makespan += simulate_makespan([durations[index] for index in dispatch_order], workers)
+        self.makespan_document_order += simulate_makespan(durations, workers)
+
+
+class CostSignals:
+    """
+    Cheap signals for the conversion cost of an element (see CityGMLGenerator.get_cost_signals()):
+    representation types of its Body representations, number of geometric items, of faces of
+    face-based items (Breps, face sets), of IfcMappedItems and of openings (HasOpenings).
+    """
+    __slots__ = ('representation_types', 'items', 'faces', 'mapped_items', 'openings')
+
+    def __init__(self):
+        self.representation_types = set()
+        self.items = 0
+        self.faces = 0
+        self.mapped_items = 0
+        self.openings = 0
+
+    def estimate(self, cost_model=None):
+        """Returns the estimated (seconds, output bytes) of the element with a cost model (default: COST_MODEL)."""
+        model = cost_model or COST_MODEL
+        representation_costs = [model['representation_types'].get(rtype, model['representation_types']['other']) for rtype in self.representation_types]
+        if not representation_costs:
+            # Without Body geometry only the metadata of the feature (e.g. a wall without geometry)
+            return model['element'][0], model['element'][1]
+        seconds = model['element'][0] + max(cost[0] for cost in representation_costs)
+        size = model['element'][1] + max(cost[1] for cost in representation_costs)
+        for count, (item_seconds, item_bytes) in ((self.items - 1, model['item']), (self.faces, model['face']), (self.openings, model['opening'])):
+            seconds += max(count, 0) * item_seconds
+            size += max(count, 0) * item_bytes
+        return seconds, size
+
+
+class FeatureResult:
+    """
+    Output of the pipeline for one FeatureJob: the serialized feature property (None if the feature
+    is dropped for lack of geometry) and the bookkeeping that is merged in document order.
+    """
+    __slots__ = ('fragment', 'gml_id', 'exported', 'material_count', 'progress', 'stats', 'shared_material_targets', 'envelope', 'seconds')
+
+    def __init__(self, stats):
+        self.fragment = None
+        # Conversion time of the job (tessellation and encoding of all variants)
+        self.seconds = 0.0
+        self.gml_id = None
+        self.exported = False
+        # Bounding box of the geometries of the feature (incl. fillings) as (minx, miny, minz, maxx, maxy, maxz), None without geometry or if dropped
+        self.envelope = None
+        self.material_count = 0
+        # Progress characters printed for this feature ('.' for the feature, D/W for doors/windows)
+        self.progress = ""
+        self.stats = stats
+        # List of (material key, target) for shared materials, see _add_shared_material_targets()
+        self.shared_material_targets = []
+
+
+def get_output_compression(path):
+    """Returns the compression of an output file by its extension ('gzip' for .gz, 'zstd' for .zst) or None."""
+    name = os.fspath(path).lower()
+    for compression, extension in OUTPUT_COMPRESSIONS.items():
+        if name.endswith(extension):
+            return compression
+    return None
+
+
+def strip_output_extension(name):
+    """Returns a file name without its compression extension (see OUTPUT_COMPRESSIONS) and the CityGML extension."""
+    compression = get_output_compression(name)
+    if compression is not None:
+        name = name[:-len(OUTPUT_COMPRESSIONS[compression])]
+    return os.path.splitext(name)[0]
+
+
+class CompressedOutput:
+    """
+    Binary output file that is compressed while it is written: gzip, or zstd (with the optional
+    zstandard package, compressed in all cores). The uncompressed document is never written to disk.
+    The stream is not seekable, so the envelopes (see write_variants()) are filled in in a temporary
+    file first.
+    """
+    def __init__(self, path, compression, level=None):
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        if compression not in OUTPUT_COMPRESSIONS:
+            raise ValueError(f"unknown compression '{compression}' (available: {', '.join(OUTPUT_COMPRESSIONS)})")
+        level = level if level is not None else COMPRESSION_LEVELS[compression]
+        self.file = open(path, "wb")
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.file, mode="wb", compresslevel=level)
+        else:
+            self.stream = zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(self.file, closefd=False)
+
+    def write(self, data):
+        self.stream.write(data)
+        return len(data)
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        """Writes the end of the compressed stream and closes the file."""
+        if self.file.closed:
+            return
+        try:
+            self.stream.close()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(path):
+    """Opens an output file for writing: compressed according to its extension (see get_output_compression()) or as plain file."""
+    compression = get_output_compression(path)
+    if compression is None:
+        return open(path, "wb")
+    return CompressedOutput(path, compression)
+
+
+def is_compressed_ifc(path):
+    """Returns True if an IFC file is gzip compressed or an IFC-ZIP archive (by its magic number)."""
+    with open(path, "rb") as stream:
+        magic = stream.read(4)
+    return magic[:2] == GZIP_MAGIC or magic == ZIP_MAGIC
+
+
+def read_compressed_ifc(source):
+    """
+    Returns the content of a gzip compressed IFC file (.ifc.gz) or of the IFC file in an IFC-ZIP
+    archive (.ifczip) as bytes, read in memory without extracting it to a temporary file. source is
+    a path or the content of a file; the compression is recognized by the magic number.
+    Returns None if the source is not compressed.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        if data[:2] == GZIP_MAGIC:
+            return gzip.decompress(data)
+        if data[:4] == ZIP_MAGIC:
+            source = io.BytesIO(data)
+        else:
+            return None
+    else:
+        with open(source, "rb") as stream:
+            magic = stream.read(4)
+        if magic[:2] == GZIP_MAGIC:
+            with gzip.open(source, "rb") as stream:
+                return stream.read()
+        if magic != ZIP_MAGIC:
+            return None
+    with zipfile.ZipFile(source) as archive:
+        for name in archive.namelist():
+            if name.lower().endswith(".ifc"):
+                return archive.read(name)
+    raise ValueError("no .ifc file found in the IFC-ZIP archive")
+
+
+class FragmentWriter:
+    """
+    Writes byte fragments to a binary stream in a background thread, so that disk I/O overlaps
+    with tessellation and encoding. The queue is bounded to limit the memory held by fragments
+    that are not yet written. Without background thread the fragments are written immediately.
+    """
+    def __init__(self, stream, background=True, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stream = stream
+        self.error = None
+        self.thread = None
+        if background:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def write(self, data):
+        """Queues bytes for writing (blocks while the queue is full)."""
+        if self.thread is None:
+            self.stream.write(data)
+            return
+        if self.error:
+            raise self.error
+        self.queue.put(data)
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    self.stream.write(data)
+                except Exception as e:
+                    self.error = e
+
+    def close(self):
+        """Writes the remaining fragments and stops the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+def get_output_format(path):
+    """Returns the output format of a path by its extension (.json: CityJSON, .jsonl: CityJSONSeq, .gpkg: GeoPackage, .parquet: Parquet, .glb: binary glTF, otherwise CityGML; compression extensions are ignored)."""
+    name = os.path.basename(path or "").lower()
+    compression = get_output_compression(name)
+    if compression is not None:
+        name = name[:-len(OUTPUT_COMPRESSIONS[compression])]
+    if name.endswith(".jsonl"):
+        return 'cityjsonseq'
+    if name.endswith(".json"):
+        return 'cityjson'
+    if name.endswith(".gpkg"):
+        return 'gpkg'
+    if name.endswith(".parquet"):
+        return 'parquet'
+    if name.endswith(".glb"):
+        return 'glb'
+    return 'citygml'
+
+
+def get_epsg_code(srs_name):
+    """Returns the EPSG code of a srsName, None for local coordinates (EPSG:0) or unknown names."""
+    match = EPSG_CODE_PATTERN.search(srs_name or "")
+    if match is None or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1))
+
+
+def get_cityjson_reference_system(srs_name):
+    """Returns the CityJSON referenceSystem URL of a srsName (a crs-compound URL for EPSG:h+v), None for local coordinates (EPSG:0) or unknown names."""
+    match = EPSG_COMPOUND_PATTERN.match(srs_name or "")
+    if match:
+        return "https://www.opengis.net/def/crs-compound?" + "&".join(f"{index}=https://www.opengis.net/def/crs/EPSG/0/{code}" for index, code in enumerate(match.groups(), 1))
+    code = get_epsg_code(srs_name)
+    return f"https://www.opengis.net/def/crs/EPSG/0/{code}" if code is not None else None
+
+
+def to_json_value(value):
+    """Returns an IFC property value as JSON value (strings for entities and non-finite numbers)."""
+    if isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if np.isfinite(value) else str(value)
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(item) for item in value]
+    return str(value)
+
+
+def encode_json(value):
+    """Returns the compact JSON text of a value (no whitespace, non-ASCII characters kept)."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_cityjson_geometry(geometry_type, records, translate, materials=None, surfaces=None):
+    """
+    Encodes GeometryRecords as LoD 3 CityJSON geometry ('Solid' with one shell or 'MultiSurface',
+    one surface per triangle). The vertices are quantized to CITYJSON_SCALE relative to translate and
+    deduplicated; triangles that collapse by the quantization are dropped.
+    materials is the material table of the city object ((r, g, b, transparency) keys, extended here),
+    None without appearances. surfaces is the semantic surface object of each record (e.g. the
+    Door/Window of a filling) or None.
+    Returns a dict with the arrays ('type', 'vertices', 'faces', 'material_ids', 'semantics'), None if no triangle is left.
+    """
+    vertices, faces, material_ids = [], [], []
+    offset = 0
+    for record in records:
+        vertices.append(record.vertices)
+        faces.append(record.faces + offset)
+        offset += len(record.vertices)
+        if materials is not None:
+            # Index of each entry of the record's material table in the object's table; the last entry (-1) is for faces without material
+            local = np.full(len(record.materials or []) + 1, -1, dtype=np.int32)
+            for mat_idx, mat in enumerate(record.materials or []):
+                if mat is None:
+                    continue
+                key = (round(mat[0], 6), round(mat[1], 6), round(mat[2], 6), round(mat[3], 6))
+                if key not in materials:
+                    materials.append(key)
+                local[mat_idx] = materials.index(key)
+            material_ids.append(local[record.material_ids])
+    if not offset:
+        return None
+
+    quantized = np.rint((np.concatenate(vertices) - translate) / CITYJSON_SCALE).astype(np.int64)
+    unique, inverse = np.unique(quantized, axis=0, return_inverse=True)
+    faces = inverse.reshape(-1)[np.concatenate(faces)]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    if not keep.any():
+        return None
+
+    geometry = {'type': geometry_type, 'vertices': unique, 'faces': np.ascontiguousarray(faces[keep], dtype=np.int32), 'material_ids': None, 'semantics': None}
+    if materials is not None:
+        face_materials = np.concatenate(material_ids)[keep]
+        if (face_materials >= 0).any():
+            geometry['material_ids'] = face_materials
+    if surfaces is not None:
+        values = np.concatenate([np.full(len(record.faces), index, dtype=np.int32) for index, record in enumerate(records)])
+        geometry['semantics'] = (surfaces, values[keep])
+    return geometry
+
+
+class CityJSONObject:
+    """
+    A city object of the CityJSON output as encoded by the pipeline: the object (type, attributes),
+    its geometries (see encode_cityjson_geometry(), vertex indices refer to the quantized vertices of
+    each geometry) and its material table. The parents (Building, BuildingStorey) are set when it is
+    merged in document order; the CityJSONWriter merges the vertices and materials into those of the
+    document and adds the children of the Buildings and BuildingStoreys.
+    step_id is the STEP id of the IFC element (None for dummy elements).
+    """
+    __slots__ = ('object_id', 'city_object', 'geometries', 'materials', 'step_id', 'storey_key', 'parents')
+
+    def __init__(self, object_id, object_type, step_id=None, storey_key=None):
+        self.object_id = object_id
+        self.city_object = {"type": object_type, "attributes": {}}
+        self.geometries = []
+        self.materials = []
+        self.step_id = step_id
+        self.storey_key = storey_key
+        self.parents = []
+
+
+# Format strings of a triangle surface (one ring) in the boundaries and of a vertex of the CityJSON output
+CITYJSON_SURFACE_FORMAT = "[[%d,%d,%d]]"
+CITYJSON_VERTEX_FORMAT = "[%d,%d,%d]"
+
+
+class CityJSONWriter:
+    """
+    Writes the CityJSONObjects of a conversion to a binary stream as CityJSON 2.0 document or as
+    CityJSON Text Sequence (CityJSONSeq: a CityJSON line with the transform and the metadata, then one
+    CityJSONFeature line per Building with its children).
+    The objects are written as they arrive (children before their Building, which ends a building);
+    only the vertex array and the materials are kept until the end of the document (CityJSONFeature):
+    the vertices of all objects are merged into one array of integers (quantized to CITYJSON_SCALE,
+    see the transform) with each vertex written once, the materials are merged by colour and transparency.
+    """
+    def __init__(self, stream, translate, metadata, sequence=False, background=True):
+        self.writer = FragmentWriter(stream, background)
+        self.translate = np.asarray(translate, dtype=np.float64)
+        self.metadata = metadata
+        self.sequence = sequence
+        header = {"type": "CityJSON", "version": CITYJSON_VERSION, "transform": {"scale": [CITYJSON_SCALE] * 3, "translate": [round(c, 3) for c in translate]}}
+        if sequence:
+            header.update(CityObjects={}, vertices=[], metadata=metadata)
+            self._write(encode_json(header) + "\n")
+        else:
+            self._write(encode_json(header)[:-1] + ',"CityObjects":{')
+        # Children per parent id (collected from the parents of the written objects)
+        self.children = {}
+        self.feature_id = None
+        self.lower = None
+        self.upper = None
+        self._reset()
+
+    def _write(self, text):
+        self.writer.write(text.encode("utf-8"))
+
+    def _reset(self):
+        # Vertex (x, y, z) -> index, new vertices per object, materials
+        self.vertex_index = {}
+        self.vertex_chunks = []
+        self.material_index = {}
+        self.materials = []
+        self.first_object = True
+
+    def write(self, item):
+        """Writes a CityJSONObject (or a list of them); an object without parents (Building) completes its building."""
+        if isinstance(item, list):
+            for city_object in item:
+                self.write(city_object)
+            return
+        if self.sequence:
+            feature_id = item.parents[0] if item.parents else item.object_id
+            if feature_id != self.feature_id:
+                self._end_feature()
+                self._write(f'{{"type":"CityJSONFeature","id":{encode_json(feature_id)},"CityObjects":{{')
+                self.feature_id = feature_id
+        for parent in item.parents:
+            self.children.setdefault(parent, []).append(item.object_id)
+        self._write_object(item)
+        if self.sequence and not item.parents:
+            self._end_feature()
+
+    def _add_vertices(self, vertices):
+        """Returns the indices of (K, 3) quantized vertices in the vertex array (new vertices are appended)."""
+        index = self.vertex_index
+        start = len(index)
+        indices = np.fromiter((index.setdefault(key, len(index)) for key in zip(*vertices.T.tolist())), dtype=np.int64, count=len(vertices))
+        new = vertices[indices >= start]
+        if len(new):
+            self.vertex_chunks.append(new)
+            lower, upper = new.min(axis=0), new.max(axis=0)
+            self.lower = lower if self.lower is None else np.minimum(self.lower, lower)
+            self.upper = upper if self.upper is None else np.maximum(self.upper, upper)
+        return indices
+
+    def _encode_geometry(self, geometry, material_map):
+        indices = self._add_vertices(geometry['vertices'])
+        surfaces = ",".join(map(CITYJSON_SURFACE_FORMAT.__mod__, map(tuple, indices[geometry['faces']].tolist())))
+        solid = geometry['type'] == "Solid"
+        text = f'{{"type":"{geometry["type"]}","lod":"3","boundaries":{"[[" + surfaces + "]]" if solid else "[" + surfaces + "]"}'
+
+        def values(array):
+            # One value per surface (nested per shell for a Solid)
+            encoded = encode_json(array)
+            return f"[{encoded}]" if solid else encoded
+
+        if geometry['semantics'] is not None:
+            semantic_surfaces, semantic_values = geometry['semantics']
+            text += f',"semantics":{{"surfaces":{encode_json(semantic_surfaces)},"values":{values(semantic_values.tolist())}}}'
+        if geometry['material_ids'] is not None:
+            mapped = material_map[geometry['material_ids']].tolist()
+            if len(set(mapped)) == 1 and mapped[0] >= 0:
+                text += f',"material":{{"RGB":{{"value":{mapped[0]}}}}}'
+            else:
+                text += f',"material":{{"RGB":{{"values":{values([m if m >= 0 else None for m in mapped])}}}}}'
+        return text + "}"
+
+    def _write_object(self, item):
+        city_object = dict(item.city_object)
+        if item.parents:
+            city_object["parents"] = item.parents
+        children = self.children.pop(item.object_id, None)
+        if children:
+            city_object["children"] = children
+        text = encode_json(city_object)
+        if item.geometries:
+            # Index of each material of the object in the materials of the document; the last entry (-1) is for faces without material
+            material_map = np.full(len(item.materials) + 1, -1, dtype=np.int64)
+            for mat_idx, key in enumerate(item.materials):
+                if key not in self.material_index:
+                    self.material_index[key] = len(self.materials)
+                    self.materials.append(key)
+                material_map[mat_idx] = self.material_index[key]
+            text = text[:-1] + ',"geometry":[' + ",".join(self._encode_geometry(geometry, material_map) for geometry in item.geometries) + "]}"
+        self._write(("" if self.first_object else ",") + encode_json(item.object_id) + ":" + text)
+        self.first_object = False
+
+    def _write_vertices_and_appearance(self):
+        self._write('},"vertices":[')
+        first = True
+        for chunk in self.vertex_chunks:
+            self._write(("" if first else ",") + ",".join(map(CITYJSON_VERTEX_FORMAT.__mod__, map(tuple, chunk.tolist()))))
+            first = False
+        self._write("]")
+        if self.materials:
+            materials = []
+            for mat_idx, (r, g, b, transparency) in enumerate(self.materials):
+                material = {"name": f"MAT_{mat_idx}", "diffuseColor": [r, g, b]}
+                if transparency > 0:
+                    material["transparency"] = transparency
+                materials.append(material)
+            self._write(f',"appearance":{{"materials":{encode_json(materials)}}}')
+
+    def _end_feature(self):
+        if self.feature_id is None:
+            return
+        self._write_vertices_and_appearance()
+        self._write("}\n")
+        self.feature_id = None
+        self._reset()
+
+    def close(self):
+        """Completes the document (vertices, appearance and metadata with the extent) and stops the writer thread."""
+        try:
+            if self.sequence:
+                self._end_feature()
+            else:
+                self._write_vertices_and_appearance()
+                metadata = dict(self.metadata)
+                if self.lower is not None:
+                    extent = np.concatenate([self.lower, self.upper]) * CITYJSON_SCALE + np.concatenate([self.translate, self.translate])
+                    metadata["geographicalExtent"] = [round(float(c), 3) for c in extent]
+                self._write(f',"metadata":{encode_json(metadata)}}}\n')
+        finally:
+            self.writer.close()
+
+
+def get_generic_attribute_value(value):
+    """Returns the type ('string', 'int' or 'double', as the generic attributes of the CityGML output) and the value of a property value."""
+    # Booleans are integers (CityGML has no boolean generic type)
+    if isinstance(value, bool):
+        return 'int', 1 if value else 0
+    if isinstance(value, float):
+        return 'double', value
+    if isinstance(value, int):
+        return 'int', value
+    return 'string', str(value)
+
+
+def encode_geopackage_geometry(record, srs_id):
+    """
+    Encodes the triangles of a GeometryRecord as GeoPackage geometry blob: the header with the 3D
+    envelope, then a WKB MultiPolygon Z with one polygon per triangle (coordinates rounded to 3
+    decimals like the posLists of the CityGML output). The polygons are filled into a structured
+    numpy array (see WKB_TRIANGLE_DTYPE), so no Python object is created per triangle.
+    Returns (blob, envelope as (minx, miny, minz, maxx, maxy, maxz)).
+    """
+    rings = np.round(record.ring_coordinates(), 3)
+    polygons = np.empty(len(rings), dtype=WKB_TRIANGLE_DTYPE)
+    polygons['byte_order'] = 1
+    polygons['type'] = 1003
+    polygons['rings'] = 1
+    polygons['points'] = 4
+    polygons['coordinates'] = rings
+    points = rings.reshape(-1, 3)
+    lower, upper = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+    header = GEOPACKAGE_HEADER.pack(b"GP", 0, GEOPACKAGE_HEADER_FLAGS, srs_id, lower[0], upper[0], lower[1], upper[1], lower[2], upper[2])
+    return header + WKB_MULTIPOLYGON_Z.pack(1, 1006, len(rings)) + polygons.tobytes(), tuple(lower + upper)
+
+
+class DatabaseFeature:
+    """
+    A city object of the GeoPackage, Parquet and glTF outputs as encoded by the pipeline: the rows of
+    the object and of its doors/windows in the city_objects table (see DATABASE_SCHEMA) as lists [gml_id,
+    parent_id, feature_type, ifc_class, ifc_guid, name, description, information_system, geometry_type,
+    geom (the mesh buffers of encode_gltf_mesh() for glTF), envelope, triangle count], their generic attributes as (object gml_id, attribute set, name,
+    data type, string, int and double value) and their appearances as (object gml_id, (r, g, b,
+    transparency), JSON array of the 1-based numbers of the polygons with the material).
+    The parents (Building, BuildingStoreys) are set when it is merged in document order, like those of
+    a CityJSONObject; the writers store the first as parent_id of the object and the others as its
+    BuildingStoreys.
+    """
+    __slots__ = ('object_id', 'step_id', 'storey_key', 'parents', 'rows', 'attributes', 'appearances')
+
+    def __init__(self, object_id, step_id=None, storey_key=None):
+        self.object_id = object_id
+        self.step_id = step_id
+        self.storey_key = storey_key
+        self.parents = []
+        self.rows = []
+        self.attributes = []
+        self.appearances = []
+
+
+# Tables of the GeoPackage output: the GeoPackage metadata tables, the city objects (feature table
+# with the LoD 3 geometry) and the attribute tables of the hierarchy, generic attributes and appearances
+DATABASE_SCHEMA = """
+CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL, description TEXT);
+CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, scope TEXT NOT NULL,
+    CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+CREATE TABLE city_objects (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, gml_id TEXT NOT NULL, parent_id TEXT, feature_type TEXT NOT NULL, ifc_class TEXT,
+    ifc_guid TEXT, name TEXT, description TEXT, information_system TEXT, geometry_type TEXT, geom MULTIPOLYGON);
+CREATE TABLE storey_members (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, storey_id TEXT NOT NULL, object_id TEXT NOT NULL);
+CREATE TABLE generic_attributes (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, object_id TEXT NOT NULL, attribute_set TEXT, name TEXT NOT NULL, data_type TEXT NOT NULL,
+    string_value TEXT, int_value INTEGER, double_value REAL);
+CREATE TABLE materials (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, diffuse_r REAL NOT NULL, diffuse_g REAL NOT NULL, diffuse_b REAL NOT NULL, transparency REAL NOT NULL);
+CREATE TABLE appearances (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, object_id TEXT NOT NULL, theme TEXT NOT NULL, material_id INTEGER NOT NULL, surfaces TEXT NOT NULL);
+"""
+
+# Indexes of the GeoPackage output (created after the load)
+DATABASE_INDEXES = """
+CREATE UNIQUE INDEX idx_city_objects_gml_id ON city_objects (gml_id);
+CREATE INDEX idx_city_objects_parent_id ON city_objects (parent_id);
+CREATE INDEX idx_city_objects_ifc_guid ON city_objects (ifc_guid);
+CREATE INDEX idx_storey_members_storey_id ON storey_members (storey_id);
+CREATE INDEX idx_storey_members_object_id ON storey_members (object_id);
+CREATE INDEX idx_generic_attributes_object_id ON generic_attributes (object_id);
+CREATE INDEX idx_appearances_object_id ON appearances (object_id);
+"""
+
+# R-tree spatial index of the city_objects geometries (GeoPackage extension gpkg_rtree_index): the
+# triggers keep it up to date when the table is edited later (they use the ST_ functions provided by
+# GeoPackage readers such as GDAL)
+DATABASE_RTREE = """
+CREATE VIRTUAL TABLE rtree_city_objects_geom USING rtree(id, minx, maxx, miny, maxy);
+CREATE TRIGGER rtree_city_objects_geom_insert AFTER INSERT ON city_objects WHEN (NEW.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN INSERT OR REPLACE INTO rtree_city_objects_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_city_objects_geom_update1 AFTER UPDATE OF geom ON city_objects WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN INSERT OR REPLACE INTO rtree_city_objects_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_city_objects_geom_update2 AFTER UPDATE OF geom ON city_objects WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_city_objects_geom WHERE id = OLD.fid; END;
+CREATE TRIGGER rtree_city_objects_geom_update3 AFTER UPDATE ON city_objects WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_city_objects_geom WHERE id = OLD.fid;
+INSERT OR REPLACE INTO rtree_city_objects_geom VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)); END;
+CREATE TRIGGER rtree_city_objects_geom_update4 AFTER UPDATE ON city_objects WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom))
+BEGIN DELETE FROM rtree_city_objects_geom WHERE id IN (OLD.fid, NEW.fid); END;
+CREATE TRIGGER rtree_city_objects_geom_delete AFTER DELETE ON city_objects WHEN OLD.geom NOT NULL
+BEGIN DELETE FROM rtree_city_objects_geom WHERE id = OLD.fid; END;
+"""
+
+# Spatial reference systems every GeoPackage contains (undefined cartesian and geographic, WGS 84)
+GEOPACKAGE_SPATIAL_REF_SYS = [
+    ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", "undefined cartesian coordinate reference system"),
+    ("Undefined geographic SRS", 0, "NONE", 0, "undefined", "undefined geographic coordinate reference system"),
+    ("WGS 84 geodetic", 4326, "EPSG", 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],'
+     'PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]',
+     "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid"),
+]
+
+
+class DatabaseWriter:
+    """
+    Writes the DatabaseFeatures of a conversion into a GeoPackage: an SQLite database that GIS
+    software reads directly and that can be copied into PostGIS in bulk (e.g. ogr2ogr -f PostgreSQL).
+    The rows are inserted with prepared statements (executemany) in one transaction per batch_size
+    city objects, without rollback journal; the indexes and the R-tree of the geometries are created
+    after the load. Only the material table and the envelopes of the geometries are kept until the end.
+    srs_id is the EPSG code of the coordinates (-1 for local coordinates).
+    """
+    def __init__(self, path, srs_id, srs_name, description="", batch_size=DATABASE_BATCH_SIZE):
+        if not isinstance(path, (str, os.PathLike)):
+            raise ValueError("the GeoPackage output needs a file path (a database is not written to a stream)")
+        if os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        self.batch_size = batch_size
+        self.srs_id = srs_id
+        self.connection.execute(f"PRAGMA application_id = {GEOPACKAGE_APPLICATION_ID}")
+        self.connection.execute(f"PRAGMA user_version = {GEOPACKAGE_VERSION}")
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.executescript(DATABASE_SCHEMA)
+        spatial_ref_sys = list(GEOPACKAGE_SPATIAL_REF_SYS)
+        if srs_id not in (-1, 0, 4326):
+            spatial_ref_sys.append((srs_name, srs_id, "EPSG", srs_id, "undefined", None))
+        self.connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", spatial_ref_sys)
+        self.connection.executemany("INSERT INTO gpkg_contents (table_name, data_type, identifier, description, srs_id) VALUES (?, ?, ?, ?, ?)", [
+            ("city_objects", "features", "city_objects", description, srs_id),
+            ("storey_members", "attributes", "storey_members", "BuildingStorey of the city objects", None),
+            ("generic_attributes", "attributes", "generic_attributes", "Generic attributes of the city objects", None),
+            ("materials", "attributes", "materials", "X3D materials of the appearances", None),
+            ("appearances", "attributes", "appearances", "Materials of the polygons of the city objects", None),
+        ])
+        self.connection.execute("INSERT INTO gpkg_geometry_columns VALUES ('city_objects', 'geom', 'MULTIPOLYGON', ?, 1, 0)", (srs_id,))
+        self.connection.commit()
+        self.fid = 0
+        self.material_index = {}
+        self.extent = None
+        # R-tree entries (fid, minx, maxx, miny, maxy), inserted after the load
+        self.rtree_rows = []
+        self._reset()
+
+    def _reset(self):
+        self.pending = 0
+        self.object_rows = []
+        self.storey_rows = []
+        self.attribute_rows = []
+        self.material_rows = []
+        self.appearance_rows = []
+
+    def write(self, item):
+        """Adds the rows of a DatabaseFeature (or a list of them) to the current batch."""
+        if isinstance(item, list):
+            for feature in item:
+                self.write(feature)
+            return
+        item.rows[0][1] = item.parents[0] if item.parents else None
+        self.storey_rows.extend((storey_id, item.object_id) for storey_id in item.parents[1:])
+        for row in item.rows:
+            self.fid += 1
+            envelope = row[-2]
+            if envelope is not None:
+                self.rtree_rows.append((self.fid, envelope[0], envelope[3], envelope[1], envelope[4]))
+                self.extent = merge_envelopes(self.extent, envelope)
+            self.object_rows.append([self.fid] + row[:-2])
+        self.attribute_rows.extend(item.attributes)
+        for object_id, key, surfaces in item.appearances:
+            material_id = self.material_index.get(key)
+            if material_id is None:
+                material_id = self.material_index[key] = len(self.material_index) + 1
+                self.material_rows.append((material_id,) + key)
+            self.appearance_rows.append((object_id, "RGB", material_id, surfaces))
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        """Inserts the rows of the current batch in one transaction."""
+        execute = self.connection.executemany
+        execute("INSERT INTO city_objects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.object_rows)
+        execute("INSERT INTO storey_members (storey_id, object_id) VALUES (?, ?)", self.storey_rows)
+        execute("INSERT INTO generic_attributes (object_id, attribute_set, name, data_type, string_value, int_value, double_value) VALUES (?, ?, ?, ?, ?, ?, ?)", self.attribute_rows)
+        execute("INSERT INTO materials VALUES (?, ?, ?, ?, ?)", self.material_rows)
+        execute("INSERT INTO appearances (object_id, theme, material_id, surfaces) VALUES (?, ?, ?, ?)", self.appearance_rows)
+        self.connection.commit()
+        self._reset()
+
+    def close(self):
+        """Inserts the last batch, creates the indexes and the R-tree, records the extent and closes the database."""
+        try:
+            self._flush()
+            self.connection.executescript(DATABASE_INDEXES)
+            try:
+                self.connection.executescript(DATABASE_RTREE)
+            except sqlite3.OperationalError:
+                # (SQLite without the R*Tree module)
+                pass
+            else:
+                self.connection.executemany("INSERT INTO rtree_city_objects_geom VALUES (?, ?, ?, ?, ?)", self.rtree_rows)
+                self.connection.execute("INSERT INTO gpkg_extensions VALUES ('city_objects', 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')")
+            if self.extent is not None:
+                self.connection.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = 'city_objects'",
+                                        (self.extent[0], self.extent[1], self.extent[3], self.extent[4]))
+            self.connection.commit()
+            self.connection.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            self.connection.close()
+
+
+def get_parquet_properties_path(path):
+    """Returns the path of the property table of a Parquet output (<name>_properties.parquet next to <name>.parquet)."""
+    path = os.fspath(path)
+    return (path[:-len(".parquet")] if path.lower().endswith(".parquet") else path) + PARQUET_PROPERTIES_SUFFIX
+
+
+def get_geoparquet_metadata(srs_name):
+    """
+    Returns the GeoParquet metadata of the geometry column of the Parquet output (WKB MultiPolygon Z).
+    The CRS is the PROJJSON definition of the EPSG code of srsName if pyproj is installed; it is null
+    (unknown) for local coordinates and without pyproj.
+    """
+    code = get_epsg_code(srs_name)
+    crs = None
+    if code is not None and pyproj is not None:
+        try:
+            crs = pyproj.CRS.from_epsg(code).to_json_dict()
+        except pyproj.exceptions.CRSError:
+            pass
+    return {"version": GEOPARQUET_VERSION, "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["MultiPolygon Z"], "crs": crs}}}
+
+
+class ParquetWriter:
+    """
+    Writes the DatabaseFeatures of a conversion as Parquet tables for analysis (e.g. with DuckDB,
+    pandas or Spark): the city objects with one row each at path (gml:id, parent, GlobalId, IFC class,
+    feature type, name, GlobalId and name of the Building and BuildingStorey, bounding box, number of
+    triangles and, with geometry, the geometry as WKB with GeoParquet metadata) and the generic
+    attributes in long format with one row per property and its typed value (<name>_properties.parquet).
+    The rows are written in record batches of batch_size rows while the conversion runs; only the city
+    objects of the current building are kept until its Building arrives (which completes their
+    Building and BuildingStorey columns).
+    """
+    def __init__(self, path, geometry=False, srs_name=None, batch_size=PARQUET_BATCH_SIZE):
+        if pyarrow is None:
+            raise ValueError("Parquet output needs the pyarrow package (pip install pyarrow)")
+        if not isinstance(path, (str, os.PathLike)):
+            raise ValueError("the Parquet output needs a file path (the properties are written to a second file)")
+        self.geometry = geometry
+        self.batch_size = batch_size
+        string, double = pyarrow.string(), pyarrow.float64()
+        fields = [(name, string) for name in ("gml_id", "parent_id", "guid", "ifc_class", "feature_type", "name", "building_guid", "building_name", "storey_guid", "storey_name")]
+        fields += [("bbox", pyarrow.struct([(name, double) for name in ("xmin", "ymin", "zmin", "xmax", "ymax", "zmax")])), ("triangle_count", pyarrow.int32())]
+        metadata = {"srs_name": srs_name or ""}
+        if geometry:
+            fields.append(("geometry", pyarrow.binary()))
+            metadata["geo"] = encode_json(get_geoparquet_metadata(srs_name))
+        self.feature_schema = pyarrow.schema(fields, metadata=metadata)
+        self.property_schema = pyarrow.schema([("gml_id", string), ("guid", string), ("property_set", string), ("name", string), ("data_type", string),
+                                               ("string_value", string), ("int_value", pyarrow.int64()), ("double_value", double)])
+        self.feature_writer = pyarrow.parquet.ParquetWriter(path, self.feature_schema)
+        self.property_writer = pyarrow.parquet.ParquetWriter(get_parquet_properties_path(path), self.property_schema)
+        self.building_items = []
+        self.feature_rows = []
+        self.property_rows = []
+
+    def write(self, item):
+        """Adds the rows of a DatabaseFeature (or a list of them); a DatabaseFeature without parents (Building) completes its building."""
+        if isinstance(item, list):
+            for feature in item:
+                self.write(feature)
+            return
+        item.rows[0][1] = item.parents[0] if item.parents else None
+        guids = {row[0]: row[4] for row in item.rows}
+        self.property_rows.extend((row[0], guids.get(row[0])) + row[1:] for row in item.attributes)
+        if len(self.property_rows) >= self.batch_size:
+            self._write_batch(self.property_writer, self.property_schema, self.property_rows)
+        self.building_items.append(item)
+        if not item.parents:
+            self._end_building()
+
+    def _end_building(self):
+        """Adds the rows of the city objects of a building with the GlobalId and name of their Building and BuildingStorey."""
+        labels = {item.object_id: (item.rows[0][4], item.rows[0][5]) for item in self.building_items if item.rows[0][2] in ("Building", "BuildingStorey")}
+        for item in self.building_items:
+            if not item.parents:
+                building, storeys = item.object_id, []
+            elif item.rows[0][2] == "BuildingStorey":
+                building, storeys = item.parents[0], [item.object_id]
+            else:
+                building, storeys = item.parents[0], item.parents[1:]
+            parent_labels = labels.get(building, (None, None)) + (labels.get(storeys[0], (None, None)) if storeys else (None, None))
+            for gml_id, parent_id, feature_type, ifc_class, guid, name, _, _, _, geom, envelope, triangle_count in item.rows:
+                bbox = dict(zip(("xmin", "ymin", "zmin", "xmax", "ymax", "zmax"), envelope)) if envelope is not None else None
+                row = (gml_id, parent_id, guid, ifc_class, feature_type, name) + parent_labels + (bbox, triangle_count)
+                if self.geometry:
+                    # (the WKB follows the header of the GeoPackage geometry blob)
+                    row += (geom[GEOPACKAGE_HEADER.size:] if geom is not None else None,)
+                self.feature_rows.append(row)
+        self.building_items = []
+        if len(self.feature_rows) >= self.batch_size:
+            self._write_batch(self.feature_writer, self.feature_schema, self.feature_rows)
+
+    @staticmethod
+    def _write_batch(writer, schema, rows):
+        """Writes rows (tuples in the order of the schema) as one record batch and empties the list."""
+        if not rows:
+            return
+        columns = [pyarrow.array(column, type=field.type) for column, field in zip(zip(*rows), schema)]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(columns, schema=schema))
+        rows.clear()
+
+    def close(self):
+        """Writes the remaining rows and closes both files."""
+        try:
+            if self.building_items:
+                self._end_building()
+            self._write_batch(self.feature_writer, self.feature_schema, self.feature_rows)
+            self._write_batch(self.property_writer, self.property_schema, self.property_rows)
+        finally:
+            self.feature_writer.close()
+            self.property_writer.close()
+
+
+def encode_gltf_mesh(record, origin, materials=True):
+    """
+    Encodes the triangles of a GeometryRecord as the buffers of a glTF mesh: the vertex positions
+    relative to origin as float32 in the Y-up axes of glTF (x, z, -y) and the vertex indices as uint32
+    per material group (see faces_by_material(); the faces without material form a last group with key
+    None, all faces are one group without materials). The buffers are the bytes of numpy arrays, no
+    Python object is created per vertex or face.
+    Returns (positions, lower corner, upper corner, [(key, indices, number of indices)]).
+    """
+    relative = record.vertices - origin
+    positions = np.empty(relative.shape, dtype="<f4")
+    positions[:, 0] = relative[:, 0]
+    positions[:, 1] = relative[:, 2]
+    positions[:, 2] = -relative[:, 1]
+    groups = record.faces_by_material() if materials else []
+    without_material = np.ones(len(record.faces), dtype=bool)
+    for _, face_indices in groups:
+        without_material[face_indices] = False
+    if without_material.any():
+        groups.append((None, np.nonzero(without_material)[0]))
+    faces = record.faces.astype("<u4")
+    return (positions.tobytes(), positions.min(axis=0).tolist(), positions.max(axis=0).tolist(),
+            [(key, faces[face_indices].tobytes(), 3 * len(face_indices)) for key, face_indices in groups])
+
+
+class GltfWriter:
+    """
+    Writes the DatabaseFeatures of a conversion to a binary stream as binary glTF 2.0 (.glb) for web
+    viewers: a node per Building with its BuildingStoreys as child nodes, the city objects below their
+    (first) BuildingStorey or Building and the doors/windows below their element. Each city object has
+    a mesh with one primitive per material (sharing the vertex positions, see encode_gltf_mesh()) and
+    its gml:id, GlobalId, IFC class and feature type in the extras of its node.
+    The positions are relative to origin (the georeferenced origin of the model, stored with srsName in
+    the extras of the scene). The buffers are spooled to a temporary file as they arrive; only the
+    JSON of the nodes, meshes and accessors is kept and written before them at the end.
+    """
+    def __init__(self, stream, origin, srs_name):
+        self.stream = stream
+        self.buffer = tempfile.TemporaryFile()
+        self.length = 0
+        self.scene = {"nodes": [], "extras": {"srsName": srs_name or "", "origin": [round(float(c), 3) for c in origin]}}
+        self.nodes = []
+        self.meshes = []
+        self.accessors = []
+        self.buffer_views = []
+        self.materials = []
+        self.material_index = {}
+        # Child nodes per parent id (collected from the parents of the written objects)
+        self.children = {}
+
+    def write(self, item):
+        """Adds the nodes of a DatabaseFeature (or a list of them); a DatabaseFeature without parents (Building) is added to the scene."""
+        if isinstance(item, list):
+            for feature in item:
+                self.write(feature)
+            return
+        # (the first row is the city object, the others are its doors/windows)
+        node_index = len(self.nodes)
+        for gml_id, _, feature_type, ifc_class, guid, name, _, _, _, geom, _, _ in item.rows:
+            node = {"name": name or gml_id, "extras": {key: value for key, value in (("gml_id", gml_id), ("guid", guid), ("ifc_class", ifc_class), ("feature_type", feature_type)) if value is not None}}
+            if geom is not None:
+                node["mesh"] = self._add_mesh(geom)
+            self.nodes.append(node)
+        if len(item.rows) > 1:
+            self.nodes[node_index]["children"] = list(range(node_index + 1, len(self.nodes)))
+        children = self.children.pop(item.object_id, None)
+        if children:
+            self.nodes[node_index].setdefault("children", []).extend(children)
+        if not item.parents:
+            self.scene["nodes"].append(node_index)
+        else:
+            # Elements go below their first BuildingStorey, BuildingStoreys and elements without one below the Building
+            self.children.setdefault(item.parents[1] if len(item.parents) > 1 else item.parents[0], []).append(node_index)
+
+    def _add_view(self, data, target):
+        """Appends data to the buffer (all data are 4-byte values, so it stays aligned) and returns the index of its buffer view."""
+        self.buffer_views.append({"buffer": 0, "byteOffset": self.length, "byteLength": len(data), "target": target})
+        self.buffer.write(data)
+        self.length += len(data)
+        return len(self.buffer_views) - 1
+
+    def _add_accessor(self, accessor):
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def _add_mesh(self, geom):
+        """Adds the mesh of the buffers of encode_gltf_mesh() and returns its index."""
+        positions, lower, upper, groups = geom
+        position = self._add_accessor({"bufferView": self._add_view(positions, GLTF_ARRAY_BUFFER), "componentType": GLTF_FLOAT, "count": len(positions) // 12,
+                                       "type": "VEC3", "min": lower, "max": upper})
+        primitives = [{"attributes": {"POSITION": position},
+                       "indices": self._add_accessor({"bufferView": self._add_view(indices, GLTF_ELEMENT_ARRAY_BUFFER), "componentType": GLTF_UNSIGNED_INT, "count": count, "type": "SCALAR"}),
+                       "material": self._get_material(key)} for key, indices, count in groups]
+        self.meshes.append({"primitives": primitives})
+        return len(self.meshes) - 1
+
+    def _get_material(self, key):
+        """Returns the index of the material of a (r, g, b, transparency) key (merged by colour and transparency; None: GLTF_DEFAULT_MATERIAL)."""
+        key = key or GLTF_DEFAULT_MATERIAL
+        index = self.material_index.get(key)
+        if index is None:
+            r, g, b, transparency = key
+            # (IFC surfaces are not reliably oriented, so the materials are double-sided)
+            material = {"pbrMetallicRoughness": {"baseColorFactor": [r, g, b, round(1.0 - transparency, 6)], "metallicFactor": 0.0, "roughnessFactor": 1.0}, "doubleSided": True}
+            if transparency > 0:
+                material["alphaMode"] = "BLEND"
+            index = self.material_index[key] = len(self.materials)
+            self.materials.append(material)
+        return index
+
+    def close(self):
+        """Writes the file: header, JSON chunk and the buffer as BIN chunk."""
+        try:
+            # (objects whose parent was never written stay visible in the scene)
+            for children in self.children.values():
+                self.scene["nodes"].extend(children)
+            scene = self.scene if self.scene["nodes"] else {"extras": self.scene["extras"]}
+            gltf = {"asset": {"version": "2.0", "generator": "ifc2citygml"}, "scene": 0, "scenes": [scene]}
+            # (glTF does not allow empty arrays)
+            for name, values in (("nodes", self.nodes), ("meshes", self.meshes), ("materials", self.materials), ("accessors", self.accessors), ("bufferViews", self.buffer_views)):
+                if values:
+                    gltf[name] = values
+            if self.length:
+                gltf["buffers"] = [{"byteLength": self.length}]
+            document = encode_json(gltf).encode("utf-8")
+            document += b" " * (-len(document) % 4)
+            length = GLB_HEADER.size + GLB_CHUNK_HEADER.size + len(document) + (GLB_CHUNK_HEADER.size + self.length if self.length else 0)
+            self.stream.write(GLB_HEADER.pack(b"glTF", 2, length) + GLB_CHUNK_HEADER.pack(len(document), GLB_CHUNK_JSON) + document)
+            if self.length:
+                self.stream.write(GLB_CHUNK_HEADER.pack(self.length, GLB_CHUNK_BIN))
+                self.buffer.seek(0)
+                shutil.copyfileobj(self.buffer, self.stream, 1 << 20)
+        finally:
+            self.buffer.close()
+
+
+class ConversionContext:
+    """
+    Per-run state of a conversion (one call of CityGMLGenerator.generate(), write() or iter_fragments()).
+    Keeping it out of the generator allows several conversions of the same generator (and model)
+    to run concurrently, e.g. from a thread pool.
+    """
+    def __init__(self):
+        # Track gml:id values for each exported element so we can create xlinks
+        # Maps IFC element -> gml:id string
+        self.element_gml_ids = {}
+        # Track which elements of the current building were actually exported (not removed later)
+        # This is a set of IFC elements that have valid geometry and are in the output
+        self.exported_elements = set()
+        # Geometry statistics: kernel per element, elements per kernel (plus failures), triangles per
+        # IFC class and per linear deflection, decimation (for the summary at the end)
+        self.stats = TessellationStats()
+        # Targets of the shared materials (see shared_materials) for the current scope
+        # Maps (r, g, b, transparency) -> list of targets, each either '#<geometry id>' or
+        # (surface_id_prefix, face_indices) of a GeometryRecord (expanded when written)
+        self.shared_material_targets = {}
+        # Number of converted IfcBuilding objects
+        self.building_count = 0
+        # Envelopes of the converted Buildings and the CityModel
+        # Maps gml:id of the Building (or CITY_MODEL_ENVELOPE_KEY) -> (minx, miny, minz, maxx, maxy, maxz)
+        self.envelopes = {}
+        # Position of each feature with geometry in the written document (with spatial_index)
+        # List of (gml:id, envelope, byte offset, byte length), see write_spatial_index()
+        self.feature_offsets = []
+        # Conversion times of the jobs and scheduling report
+        self.schedule = ScheduleStats()
+        # Checkpoint of the run (with checkpoint_dir), see Checkpoint
+        self.checkpoint = None
+
+
+class Checkpoint:
+    """
+    Checkpoint of a conversion in a work directory (see checkpoint_dir of CityGMLGenerator): the
+    results of the converted features (the FeatureResults of all output variants: fragments, gml:ids,
+    export state, appearance counts, shared material targets, envelopes, statistics) are appended
+    to a journal in document order. The journal is committed every CHECKPOINT_INTERVAL seconds:
+    flushed to disk and its length recorded in the state file, which is replaced atomically.
+    A resumed run replays the committed results instead of converting these features again; the
+    bookkeeping of the context (element_gml_ids, exported_elements, appearance counters, ...) is
+    rebuilt from them, so the output is the same as that of an uninterrupted run. The job of each
+    result is checked against the planned job, and the state file records the input file and the
+    options (CHECKPOINT_OPTIONS), so a checkpoint is not resumed for another model.
+    """
+    def __init__(self, directory, signature, resume=False, interval=CHECKPOINT_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.signature = json.loads(json.dumps(signature))
+        self.interval = interval
+        self.state_path = os.path.join(directory, CHECKPOINT_STATE)
+        self.journal_path = os.path.join(directory, CHECKPOINT_JOURNAL)
+        # Committed length of the journal and number of features in it
+        self.length = 0
+        self.count = 0
+        self.reader = None
+        self.restorable = 0
+        if resume and os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as stream:
+                state = json.load(stream)
+            if state.get("signature") != self.signature:
+                raise ValueError(f"the checkpoint in {directory} was written for another input file or with other options")
+            self.length = state["length"]
+            self.count = self.restorable = state["features"]
+            self.reader = open(self.journal_path, "rb")
+            print(f"Resuming from checkpoint {directory}: {self.count} features converted before")
+        elif resume:
+            print(f"No checkpoint in {directory}, converting from the start")
+        self.journal = open(self.journal_path, "r+b" if self.length else "wb")
+        self.journal.truncate(self.length)
+        self.journal.seek(self.length)
+        self.committed_at = time.monotonic()
+
+    def restore(self, job):
+        """Returns the FeatureResults of the next job from the journal (None once all committed results are replayed)."""
+        if not self.restorable:
+            return None
+        key, results = pickle.load(self.reader)
+        if key != job.key():
+            raise ValueError(f"the checkpoint in {self.directory} does not match the model (expected {key[1]} #{key[2]}, got {job.ifc_type} #{job.step_id})")
+        self.restorable -= 1
+        if not self.restorable:
+            self.reader.close()
+            self.reader = None
+        return results
+
+    def add(self, job, results):
+        """Appends the FeatureResults of a converted job to the journal (committed every interval seconds)."""
+        pickle.dump((job.key(), results), self.journal, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+        if time.monotonic() - self.committed_at >= self.interval:
+            self.commit()
+
+    def commit(self):
+        """Writes the journal to disk and records its length in the state file."""
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.length = self.journal.tell()
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as stream:
+            json.dump({"signature": self.signature, "length": self.length, "features": self.count}, stream, indent=1)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary, self.state_path)
+        self.committed_at = time.monotonic()
+
+    def close(self):
+        """Commits and closes the journal."""
+        if self.journal.closed:
+            return
+        self.commit()
+        self.journal.close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def remove(self):
+        """Removes the checkpoint files (after the output was written completely)."""
+        self.close()
+        for path in (self.journal_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        with contextlib.suppress(OSError):
+            os.rmdir(self.directory)
+
+
+class OutputVariant:
+    """
+    One output of a conversion run: the generator with the serialization options of the output
+    (see CityGMLGenerator.derive()), its ConversionContext and the state of the current building
+    (number of appearances/materials, dummy BCE gml:id per storey, spool file for shared materials).
+    """
+    __slots__ = ('generator', 'context', 'building_state', 'spool', 'partition')
+
+    def __init__(self, generator, context=None, partition=None):
+        self.generator = generator
+        self.context = context if context is not None else ConversionContext()
+        self.building_state = None
+        self.spool = None
+        # OutputPartition if the output is split into several files
+        self.partition = partition
+
+
+class OutputPart:
+    """
+    One file of a split output: the spooled features per building (sections, in conversion order),
+    the manifest entries of its features, its extent and the shared materials at CityModel level.
+    """
+    __slots__ = ('file_name', 'sections', 'extent', 'shared_material_targets')
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        # Maps building number -> PartSection
+        self.sections = {}
+        self.extent = None
+        self.shared_material_targets = {}
+
+
+class PartSection:
+    """The part of one building in an OutputPart: spool ranges of its features, their manifest entries and extent."""
+    __slots__ = ('building', 'ranges', 'features', 'extent', 'shared_material_targets')
+
+    def __init__(self, building):
+        self.building = building
+        self.ranges = []
+        self.features = []
+        self.extent = None
+        self.shared_material_targets = {}
+
+
+class OutputPartition:
+    """
+    Distributes the features of a conversion over several CityGML files (split option): one file
+    per building, per storey (elements assigned by _get_storey_elements(), '..._nostorey' for the
+    others) or per XY tile of tile_size (by the centre of the feature envelope; features without
+    geometry go to the tile with most features of their building). Each file is a complete
+    CityModel with one cityObjectMember/Building per building that has features in it (the Building
+    keeps its gml:id in all files); xlinks to features in other files are written as 'file.gml#id'.
+    The features are spooled while converting and the files assembled in parallel by write(),
+    which also writes a JSON manifest with the extent and features of each file.
+    """
+    def __init__(self, mode, tile_size, base_path):
+        if mode not in SPLIT_MODES:
+            raise ValueError(f"unknown split mode '{mode}' (available: {', '.join(SPLIT_MODES)})")
+        self.mode = mode
+        self.tile_size = float(tile_size or DEFAULT_TILE_SIZE)
+        self.directory, base_name = os.path.split(base_path)
+        self.stem = strip_output_extension(base_name)
+        # The part files are compressed like the base file
+        compression = get_output_compression(base_name)
+        self.extension = ".gml" + (OUTPUT_COMPRESSIONS[compression] if compression else "")
+        self.manifest_path = os.path.join(self.directory, f"{self.stem}_manifest.json")
+        self.spool = tempfile.TemporaryFile()
+        self.spool_size = 0
+        self.spool_lock = threading.Lock()
+        # Maps part key -> OutputPart (in order of creation)
+        self.parts = {}
+        # Maps gml:id of each feature -> part key (for the xlinks)
+        self.feature_parts = {}
+        # Current building: number, (member, building) elements, manifest info, storey index per
+        # element STEP id and per storey GlobalId, features waiting for the home part
+        self.building_number = 0
+        self.building = None
+        self.buildings = []
+        self.storey_index = {}
+        self.storey_guid_index = {}
+        self.pending = []
+
+    def start_building(self, generator, ifc_bldg, member, building):
+        """Starts a building: determines the storey of its elements (split by storey)."""
+        self.building_number += 1
+        self.building = (member, building)
+        self.buildings.append({"gml_id": building.get(f"{{{NSMAP['gml']}}}id"), "name": getattr(ifc_bldg, 'Name', None), "ifc_guid": getattr(ifc_bldg, 'GlobalId', None), "files": []})
+        self.storey_index = {}
+        self.storey_guid_index = {}
+        self.pending = []
+        if self.mode == 'storey':
+            building_elements = set(ifcopenshell.util.element.get_decomposition(ifc_bldg))
+            storeys = [s for s in generator.model.by_type("IfcBuildingStorey") if s in building_elements]
+            for number, storey in enumerate(storeys, 1):
+                self.storey_index.setdefault(storey.id(), number)
+                self.storey_guid_index[getattr(storey, 'GlobalId', None)] = number
+                for element in generator._get_storey_elements(storey):
+                    self.storey_index.setdefault(element.id(), number)
+
+    def end_building(self):
+        """Ends the current building (features without part go to the home part)."""
+        self._resolve_pending()
+        self.building = None
+
+    def _part(self, key):
+        part = self.parts.get(key)
+        if part is None:
+            if key[0] == 'building':
+                file_name = f"{self.stem}_building{key[1]}{self.extension}"
+            elif key[0] == 'storey':
+                file_name = f"{self.stem}_building{key[1]}_" + (f"storey{key[2]}" if key[2] else "nostorey") + self.extension
+            elif key[1] is None:
+                file_name = f"{self.stem}_untiled{self.extension}"
+            else:
+                file_name = f"{self.stem}_tile_{key[1]}_{key[2]}{self.extension}"
+            part = self.parts[key] = OutputPart(file_name)
+        return part
+
+    def _section(self, key):
+        part = self._part(key)
+        section = part.sections.get(self.building_number)
+        if section is None:
+            section = part.sections[self.building_number] = PartSection(self.building)
+            self.buildings[-1]["files"].append(part.file_name)
+        return section
+
+    def _feature_key(self, job, envelope):
+        """Returns the part key of a feature, None if it depends on the other features (tile without envelope)."""
+        if self.mode == 'building':
+            return ('building', self.building_number)
+        if self.mode == 'storey':
+            if job.kind == 'dummy':
+                number = self.storey_guid_index.get(job.storey_key)
+            else:
+                number = self.storey_index.get(job.step_id)
+            return ('storey', self.building_number, number)
+        if envelope is None:
+            return None
+        x = (envelope[0] + envelope[3]) / 2
+        y = (envelope[1] + envelope[4]) / 2
+        return ('tile', int(np.floor(x / self.tile_size)), int(np.floor(y / self.tile_size)))
+
+    def _home_key(self):
+        """Returns the part with most features of the current building (for features without own part)."""
+        best = None
+        for key, part in self.parts.items():
+            section = part.sections.get(self.building_number)
+            if section is not None and (best is None or len(section.features) > best[0]):
+                best = (len(section.features), key)
+        if best is not None:
+            return best[1]
+        return ('building', self.building_number) if self.mode == 'building' else ('tile', None, None)
+
+    def _resolve_pending(self):
+        if self.pending:
+            key = self._home_key()
+            for spool_range, entry, shared_targets in self.pending:
+                self._add(key, spool_range, entry, shared_targets)
+            self.pending = []
+
+    def _append(self, fragment):
+        offset = self.spool_size
+        self.spool.write(fragment)
+        self.spool_size += len(fragment)
+        return offset, len(fragment)
+
+    def _add(self, key, spool_range, entry, shared_targets=()):
+        section = self._section(key)
+        section.ranges.append(spool_range)
+        section.features.append(entry)
+        self.feature_parts[entry["gml_id"]] = key
+        part = self.parts[key]
+        envelope = entry.get("envelope")
+        if envelope is not None:
+            part.extent = merge_envelopes(part.extent, tuple(envelope))
+            section.extent = merge_envelopes(section.extent, tuple(envelope))
+        for material_key, target in shared_targets:
+            section.shared_material_targets.setdefault(material_key, []).append(target)
+
+    def add_feature(self, generator, job, result):
+        """Spools the fragment of a converted feature into its part (takes over its shared material targets)."""
+        shared_targets, result.shared_material_targets = result.shared_material_targets, []
+        if not result.fragment:
+            return
+        entry = {"gml_id": result.gml_id, "class": job.ifc_type}
+        if job.step_id is not None:
+            entry["ifc_guid"] = getattr(generator.model.by_id(job.step_id), 'GlobalId', None)
+        if result.envelope is not None:
+            entry["envelope"] = [round(c, 3) for c in result.envelope]
+        spool_range = self._append(result.fragment)
+        key = self._feature_key(job, result.envelope)
+        if key is None:
+            self.pending.append((spool_range, entry, shared_targets))
+        else:
+            self._add(key, spool_range, entry, shared_targets)
+
+    def storey_key(self, storey, linked_gml_ids):
+        """Returns the part of a Storey feature: its storey file, the building file or the tile with most linked features."""
+        self._resolve_pending()
+        if self.mode == 'building':
+            return ('building', self.building_number)
+        if self.mode == 'storey':
+            return ('storey', self.building_number, self.storey_index.get(storey.id()))
+        counts = {}
+        for gml_id in linked_gml_ids:
+            key = self.feature_parts.get(gml_id)
+            if key is not None:
+                counts[key] = counts.get(key, 0) + 1
+        if counts:
+            return max(counts, key=counts.get)
+        return self._home_key()
+
+    def href(self, gml_id, key):
+        """Returns the xlink:href of a feature referenced from a feature in part key."""
+        target_key = self.feature_parts.get(gml_id, key)
+        if target_key == key:
+            return f"#{gml_id}"
+        return f"{self.parts[target_key].file_name}#{gml_id}"
+
+    def add_storey(self, key, storey, gml_id, fragment):
+        """Spools the fragment of a Storey feature into a part."""
+        entry = {"gml_id": gml_id, "class": "IfcBuildingStorey", "ifc_guid": getattr(storey, 'GlobalId', None)}
+        self._add(key, self._append(fragment), entry)
+
+    def _read(self, offset, length):
+        if hasattr(os, 'pread'):
+            return os.pread(self.spool.fileno(), length, offset)
+        with self.spool_lock:
+            self.spool.seek(offset)
+            return self.spool.read(length)
+
+    def write(self, generator, root, workers=1):
+        """
+        Writes the part files (CityModel root with the features of each part) in up to workers
+        parallel threads and the manifest. Returns the paths of the written files.
+        """
+        self.spool.flush()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        parts = list(self.parts.values())
+        max_workers = max(1, min(len(parts), workers))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            paths = list(pool.map(lambda part: self._write_part(generator, part, root), parts))
+
+        manifest = {
+            "source": generator.filename,
+            "split": self.mode,
+            "srsName": generator.srs_name,
+            "files": [{"file": part.file_name,
+                       "extent": [round(c, 3) for c in part.extent] if part.extent else None,
+                       "feature_count": sum(len(section.features) for section in part.sections.values()),
+                       "buildings": [{"gml_id": section.building[1].get(f"{{{NSMAP['gml']}}}id"), "features": section.features} for section in part.sections.values()]}
+                      for part in parts],
+            "buildings": self.buildings,
+        }
+        if self.mode == 'tile':
+            manifest["tile_size"] = self.tile_size
+        with open(self.manifest_path, "w", encoding="utf-8") as stream:
+            json.dump(manifest, stream, indent=1)
+        self.spool.close()
+        return paths
+
+    def _write_part(self, generator, part, root):
+        path = os.path.join(self.directory, part.file_name)
+        part_id = strip_output_extension(part.file_name)
+        # The CityModel and Building elements are shared by the parts: serialize copies
+        root = copy.deepcopy(root)
+        if generator.envelopes and part.extent is not None:
+            insert_bounded_by(root, part.extent, generator.srs_name)
+        root_start, root_end = serialize_open_close(root, 0, keep_namespaces=True)
+        feature_offsets = []
+        with open_output(path) as stream:
+            stream.write(XML_DECLARATION + root_start)
+            position = len(XML_DECLARATION + root_start)
+            for section in part.sections.values():
+                member = copy.deepcopy(section.building[0])
+                building = member[0]
+                building_id = building.get(f"{{{NSMAP['gml']}}}id")
+                if generator.shared_materials == 'building' and section.shared_material_targets:
+                    # Shared materials of the building in this file
+                    generator._insert_building_appearance(section, building, f"{building_id}_{part_id}")
+                elif generator.shared_materials == 'citymodel':
+                    for material_key, targets in section.shared_material_targets.items():
+                        part.shared_material_targets.setdefault(material_key, []).extend(targets)
+                if generator.envelopes and section.extent is not None:
+                    insert_bounded_by(building, section.extent, generator.srs_name)
+                member_start, member_end = serialize_open_close(member, 1, container=building)
+                stream.write(member_start)
+                position += len(member_start)
+                for (offset, length), entry in zip(section.ranges, section.features):
+                    stream.write(self._read(offset, length))
+                    if "envelope" in entry:
+                        feature_offsets.append((entry["gml_id"], entry["envelope"], position, length))
+                    position += length
+                stream.write(member_end)
+                position += len(member_end)
+            if part.shared_material_targets:
+                appearance, _ = generator._create_shared_appearance(part, f"CITYMODEL_{part_id}")
+                app_member = etree.Element(f"{{{NSMAP['core']}}}appearanceMember", nsmap=NSMAP)
+                app_member.append(appearance)
+                stream.write(serialize_fragment(app_member, 1))
+            stream.write(root_end)
+        if generator.spatial_index:
+            write_spatial_index(f"{path}.idx", feature_offsets)
+        return path
+
+
+def _hilbert_distance(x, y):
+    """
+    Returns the distances along the Hilbert curve of the points (x, y) of a 2^16 x 2^16 grid (uint32
+    arrays), using the branch-free algorithm of rawrunprotected/hilbert_curves (as in flatbush).
+    """
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C = C ^ ((a & (c >> 2)) ^ (b & (d >> 2)))
+    D = D ^ ((b & (c >> 2)) ^ ((a ^ b) & (d >> 2)))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C = C ^ ((a & (c >> 4)) ^ (b & (d >> 4)))
+    D = D ^ ((b & (c >> 4)) ^ ((a ^ b) & (d >> 4)))
+
+    a, b, c, d = A, B, C, D
+    C = C ^ ((a & (c >> 8)) ^ (b & (d >> 8)))
+    D = D ^ ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        i0 = (i0 | (i0 << shift)) & mask
+        i1 = (i1 | (i1 << shift)) & mask
+    return (i1 << 1) | i0
+
+
+def write_spatial_index(path, feature_offsets, node_size=SPATIAL_INDEX_NODE_SIZE):
+    """
+    Writes a spatial index sidecar for a CityGML file: a packed Hilbert R-tree over the envelopes of
+    its features that maps an envelope to the gml:id and the byte range of the feature property
+    (e.g. bldg:buildingConstructiveElement) in the file. feature_offsets is a list of
+    (gml:id, envelope, byte offset, byte length), see ConversionContext.feature_offsets.
+    The features are sorted by the Hilbert distance of their XY envelope centre and grouped into
+    nodes of node_size entries, level by level up to the root. File layout (little endian):
+    header (SPATIAL_INDEX_MAGIC, node size, number of levels, number of features), number of nodes
+    per level (uint64, leaves first), envelopes of all nodes (6 float64, leaves first), one
+    SPATIAL_INDEX_ITEM_DTYPE record per leaf, UTF-8 gml:ids. See query_spatial_index().
+    """
+    count = len(feature_offsets)
+    boxes = np.array([entry[1] for entry in feature_offsets], dtype=np.float64).reshape(-1, 6)
+    if count > 1:
+        centres = (boxes[:, :2] + boxes[:, 3:5]) / 2
+        minimum = centres.min(axis=0)
+        extent = np.maximum(centres.max(axis=0) - minimum, 1e-9)
+        grid = ((centres - minimum) / extent * 0xFFFF).astype(np.uint32)
+        order = np.argsort(_hilbert_distance(grid[:, 0], grid[:, 1]), kind='stable')
+    else:
+        order = np.arange(count)
+    boxes = boxes[order]
+
+    # Node envelopes level by level: each node covers node_size consecutive nodes of the level below
+    levels = [boxes]
+    while len(levels[-1]) > 1:
+        starts = np.arange(0, len(levels[-1]), node_size)
+        levels.append(np.hstack([np.minimum.reduceat(levels[-1][:, :3], starts), np.maximum.reduceat(levels[-1][:, 3:], starts)]))
+
+    ids = [feature_offsets[i][0].encode() for i in order.tolist()]
+    items = np.zeros(count, dtype=SPATIAL_INDEX_ITEM_DTYPE)
+    items['offset'] = [feature_offsets[i][2] for i in order.tolist()]
+    items['length'] = [feature_offsets[i][3] for i in order.tolist()]
+    items['id_length'] = [len(gml_id) for gml_id in ids]
+    items['id_offset'] = np.cumsum(items['id_length']) - items['id_length']
+
+    with open(path, "wb") as stream:
+        stream.write(SPATIAL_INDEX_HEADER.pack(SPATIAL_INDEX_MAGIC, node_size, len(levels), count))
+        stream.write(np.array([len(level) for level in levels], dtype='<u8').tobytes())
+        for level in levels:
+            stream.write(level.astype('<f8').tobytes())
+        stream.write(items.tobytes())
+        stream.write(b"".join(ids))
+
+
+def query_spatial_index(path, envelope):
+    """
+    Returns the features of a spatial index sidecar (see write_spatial_index()) whose envelope
+    intersects envelope, given as (minx, miny, maxx, maxy) or (minx, miny, minz, maxx, maxy, maxz).
+    Returns a list of (gml:id, byte offset, byte length) of the feature properties in the CityGML file
+    (fragments at feature property level that use the namespace prefixes of the core:CityModel).
+    """
+    with open(path, "rb") as stream:
+        data = stream.read()
+    magic, node_size, level_count, count = SPATIAL_INDEX_HEADER.unpack_from(data)
+    if magic != SPATIAL_INDEX_MAGIC:
+        raise ValueError(f"{path} is not a spatial index")
+    position = SPATIAL_INDEX_HEADER.size
+    level_sizes = np.frombuffer(data, dtype='<u8', count=level_count, offset=position).astype(np.int64)
+    position += 8 * level_count
+    levels = []
+    for size in level_sizes.tolist():
+        levels.append(np.frombuffer(data, dtype='<f8', count=size * 6, offset=position).reshape(-1, 6))
+        position += 48 * size
+    items = np.frombuffer(data, dtype=SPATIAL_INDEX_ITEM_DTYPE, count=count, offset=position)
+    ids_position = position + items.nbytes
+    if count == 0:
+        return []
+
+    query = np.asarray(envelope, dtype=np.float64)
+    dimensions = len(query) // 2
+    lower, upper = query[:dimensions], query[dimensions:]
+    # Descend from the root: keep the nodes intersecting the query, then visit their children
+    candidates = np.arange(len(levels[-1]))
+    for depth in range(len(levels) - 1, -1, -1):
+        boxes = levels[depth][candidates]
+        hits = np.all(boxes[:, :dimensions] <= upper, axis=1) & np.all(boxes[:, 3:3 + dimensions] >= lower, axis=1)
+        candidates = candidates[hits]
+        if depth > 0:
+            children = (candidates[:, None] * node_size + np.arange(node_size)).ravel()
+            candidates = children[children < len(levels[depth - 1])]
+
+    results = []
+    for item in items[candidates].tolist():
+        offset, length, id_offset, id_length = item
+        gml_id = data[ids_position + id_offset:ids_position + id_offset + id_length].decode()
+        results.append((gml_id, offset, length))
+    return results
+
+
+class ElementFilter:
+    """
+    Selection of the IFC elements to convert (--include-types, --exclude-types, --storeys, --guids-file,
+    --bbox). The filter is evaluated in the element selection stage, before tessellation: elements
+    that are not selected are neither tessellated nor are their properties read.
+    - include_types/exclude_types: IFC classes incl. their subclasses (IfcWall includes IfcWallStandardCase)
+    - storeys: names or GlobalIds of IfcBuildingStorey objects; selects the elements contained in or
+      aggregated to them and restricts the Storey features to them
+    - guids: GlobalIds of the elements; a door/window selects the element it fills
+    - bbox: (minx, miny, maxx, maxy) or (minx, miny, minz, maxx, maxy, maxz) in the output CRS,
+      tested with the origin of the element placement
+    Doors and windows are written as fillings of the selected elements (only exclude_types applies to
+    them); doors/windows that fill no element (dummy BCEs) are selected like the other elements.
+    """
+    def __init__(self, generator, include_types=None, exclude_types=None, storeys=None, guids=None, bbox=None):
+        model = generator.model
+        self.generator = generator
+        self.include_types = tuple(include_types or ())
+        self.exclude_types = tuple(exclude_types or ())
+
+        # Selected storeys and the elements belonging to them
+        self.storeys = None
+        self.storey_elements = None
+        if storeys:
+            names = set(storeys)
+            self.storeys = {s for s in model.by_type("IfcBuildingStorey") if s.Name in names or s.GlobalId in names}
+            unknown = names - {s.Name for s in self.storeys} - {s.GlobalId for s in self.storeys}
+            if unknown:
+                print(f"Warning: no storey with name or GlobalId {', '.join(sorted(unknown))}")
+            self.storey_elements = set()
+            for storey in self.storeys:
+                self.storey_elements.update(generator._get_storey_elements(storey))
+
+        # Selected GlobalIds, plus the elements filled by selected doors/windows
+        self.guids = None
+        if guids is not None:
+            self.guids = set(guids)
+            missing = 0
+            for guid in list(self.guids):
+                try:
+                    element = model.by_guid(guid)
+                except RuntimeError:
+                    missing += 1
+                    continue
+                for rel_fills in getattr(element, 'FillsVoids', None) or ():
+                    for rel_voids in getattr(rel_fills.RelatingOpeningElement, 'VoidsElements', None) or ():
+                        self.guids.add(rel_voids.RelatingBuildingElement.GlobalId)
+            if missing:
+                print(f"Warning: {missing} of {len(guids)} GlobalIds not found in the model")
+
+        self.bbox = None
+        if bbox is not None:
+            dimensions = len(bbox) // 2
+            self.bbox = (np.array(bbox[:dimensions], dtype=np.float64), np.array(bbox[dimensions:], dtype=np.float64))
+            # Placements are in project length units, the georeferencing expects metres
+            self.unit_scale = ifcopenshell.util.unit.calculate_unit_scale(model)
+
+    def placement_origin(self, element):
+        """Returns the origin of the placement of an element in the output CRS (None without placement)."""
+        placement = getattr(element, 'ObjectPlacement', None)
+        if placement is None:
+            return None
+        try:
+            matrix = ifcopenshell.util.placement.get_local_placement(placement)
+        except Exception:
+            return None
+        return self.generator.transform_vertices(matrix[:3, 3].reshape(1, 3) * self.unit_scale)[0]
+
+    def accepts(self, element):
+        """Returns True if an element is selected."""
+        if self.include_types and not any(element.is_a(ifc_type) for ifc_type in self.include_types):
+            return False
+        if self.exclude_types and any(element.is_a(ifc_type) for ifc_type in self.exclude_types):
+            return False
+        if self.storey_elements is not None and element not in self.storey_elements:
+            return False
+        if self.guids is not None and getattr(element, 'GlobalId', None) not in self.guids:
+            return False
+        if self.bbox is not None:
+            origin = self.placement_origin(element)
+            if origin is None:
+                return False
+            lower, upper = self.bbox
+            dimensions = len(lower)
+            if np.any(origin[:dimensions] < lower) or np.any(origin[:dimensions] > upper):
+                return False
+        return True
+
+    def accepts_filling(self, door_or_window):
+        """Returns True if a door/window of a selected element is written as its filling."""
+        return not any(door_or_window.is_a(ifc_type) for ifc_type in self.exclude_types)
+
+    def accepts_storey(self, storey):
+        """Returns True if the Storey feature of an IfcBuildingStorey is written."""
+        return self.storeys is None or storey in self.storeys
+
+
+# Generator and encoders (one generator per output variant) used by a pipeline worker process
+# (set by _init_pipeline_worker())
+_PIPELINE_GENERATOR = None
+_PIPELINE_ENCODERS = None
+
+
+def _init_pipeline_worker(generator, encoders):
+    """Initializer of the pipeline worker processes (the generators are inherited by fork, not pickled)."""
+    global _PIPELINE_GENERATOR, _PIPELINE_ENCODERS
+    _PIPELINE_GENERATOR = generator
+    _PIPELINE_ENCODERS = encoders
+
+
+def _convert_in_worker(job):
+    """Converts a FeatureJob in a worker process (tessellation and encoding) and returns the FeatureResults."""
+    return _PIPELINE_GENERATOR._convert_job(job, _PIPELINE_ENCODERS)
+
+
 class CityGMLGenerator:
-    def __init__(self, input_path, output_path, no_references=False, reorient_shells=False, no_properties=False, georef_oktoberfest=False, list_unmapped_doors_windows=False, unrelated_doors_windows_in_dummy_bce=False, no_generic_attribute_sets=False, pset_names_as_prefixes=False, no_storeys=False, no_appearances=False, xoffset=0.0, yoffset=0.0, zoffset=0.0):
-        """Initialize the CityGML generator with input/output paths and processing options."""
-        self.input_path = input_path
-        self.filename = os.path.basename(input_path)
+    def __init__(self, input_path, output_path, no_references=False, reorient_shells=False, no_properties=False, georef_oktoberfest=False, list_unmapped_doors_windows=False, unrelated_doors_windows_in_dummy_bce=False, no_generic_attribute_sets=False, pset_names_as_prefixes=False, no_storeys=False, no_appearances=False, xoffset=0.0, yoffset=0.0, zoffset=0.0, geometry_kernels=None, kernel_timeout=None, linear_deflection=None, angular_deflection=None, adaptive_deflection=False, max_triangles=None, max_triangles_per_class=None, decimation_error=DEFAULT_DECIMATION_ERROR, shared_materials=None, workers=1, source_name=None, split=None, tile_size=DEFAULT_TILE_SIZE, envelopes=False, spatial_index=False, include_types=None, exclude_types=None, storeys=None, guids=None, bbox=None, timings_path=None, checkpoint_dir=None, resume=False, output_format=None, parquet_geometry=False, target_crs=None, kernel_report_path=None):
+        """
+        Initialize the CityGML generator with input/output paths and processing options.
+        Instead of a path, input_path can be an opened ifcopenshell.file or the content of an IFC
+        file (bytes or str); output_path is only needed for generate() (see write() and iter_fragments()).
+        source_name is the file name written as core:informationSystem of the external references
+        (default: the file name of input_path, or the one in the STEP header for in-memory models).
+        kernel_timeout (seconds) only applies to conversions in the main thread of a process (the shapes
+        are then created in forked child processes, see _create_shape_with_timeout()); conversions in
+        other threads, e.g. several conversions from a thread pool, ignore it.
+        split ('building', 'storey' or 'tile') writes the output of generate() to several files (see OutputPartition).
+        spatial_index writes a sidecar '<output>.idx' for each file written by generate() (see write_spatial_index()).
+        include_types, exclude_types, storeys, guids and bbox select the elements to convert (see ElementFilter).
+        timings_path is a JSON file with the conversion times of the elements (by GlobalId) of a previous
+        run: they are used to schedule the expensive elements first and updated by generate().
+        kernel_report_path is a JSON file written by generate() with the geometry kernel that produced each
+        element (by GlobalId, 'failed' if no kernel could tessellate it).
+        checkpoint_dir is a work directory for a checkpoint of the converted features (see Checkpoint);
+        with resume a conversion continues from the checkpoint in it. generate() removes the checkpoint
+        when the output is written completely.
+        target_crs transforms the georeferenced coordinates into another CRS with pyproj (see _setup_target_crs()).
+        """
+        self.input_path = input_path if isinstance(input_path, (str, os.PathLike)) and not str(input_path).lstrip().startswith("ISO-10303-21") else None
         self.output_path = output_path
         self.no_references = no_references
         self.reorient_shells = reorient_shells
@@ -67,23 +2561,75 @@ class CityGMLGenerator:
         self.no_storeys = no_storeys
         # If true, do not export CityGML appearance elements (colors/materials)
         self.no_appearances = no_appearances
+        # If set ('building' or 'citymodel'), write one X3DMaterial per unique colour/transparency
+        # at Building or CityModel level instead of separate materials for every feature
+        self.shared_materials = shared_materials
         # XYZ offsets to shift the model (applied after georeferencing)
         self.xoffset = xoffset
         self.yoffset = yoffset
         self.zoffset = zoffset
-        self.model = ifcopenshell.open(input_path)
+        # Chain of geometry kernels: the first one is tried first, the following ones are
+        # used as fallbacks if an element fails (or takes longer than kernel_timeout seconds)
+        self.geometry_kernels = list(geometry_kernels) if geometry_kernels else [DEFAULT_GEOMETRY_KERNEL]
+        self.kernel_timeout = kernel_timeout
+        # Whether the warning that kernel_timeout is ignored in a thread was printed
+        self.kernel_timeout_ignored = False
+        # Mesher tolerances for curved geometry (None = IfcOpenShell default)
+        self.linear_deflection = linear_deflection
+        self.angular_deflection = angular_deflection
+        # If true, choose the linear deflection per element from its size and IFC class
+        self.adaptive_deflection = adaptive_deflection
+        # Triangle budget per element (None = no decimation) and per IFC class (overrides max_triangles)
+        self.max_triangles = max_triangles
+        self.max_triangles_per_class = dict(max_triangles_per_class) if max_triangles_per_class else {}
+        self._triangle_budgets_by_type = {}
+        # Maximum geometric error the decimation may introduce
+        self.decimation_error = decimation_error
+        # Number of workers of the conversion pipeline (processes where fork is available)
+        self.workers = max(1, int(workers or 1))
+        # Format of the output (see OUTPUT_FORMATS), by default from the extension of output_path
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format '{output_format}' (available: {', '.join(OUTPUT_FORMATS)})")
+        self.output_format = output_format or get_output_format(output_path)
+        # Add the geometry as WKB column to the Parquet output
+        self.parquet_geometry = parquet_geometry
+        # Split the output into one file per building, storey or XY tile (of tile_size) plus a manifest
+        if split is not None and split not in SPLIT_MODES:
+            raise ValueError(f"unknown split mode '{split}' (available: {', '.join(SPLIT_MODES)})")
+        self.split = split
+        self.tile_size = tile_size
+        # If true, write gml:boundedBy envelopes of the features, Buildings and the CityModel
+        self.envelopes = envelopes
+        # If true, record the position of the features in the output and write a spatial index sidecar
+        self.spatial_index = spatial_index
+        # Conversion times of previous runs (GlobalId -> seconds), preferred to the estimate of the cost model
+        self.timings_path = timings_path
+        self.historical_timings = {}
+        if timings_path and os.path.exists(timings_path):
+            with open(timings_path, encoding="utf-8") as stream:
+                self.historical_timings = json.load(stream)
+        # JSON file for the geometry kernel per element (GlobalId -> kernel), written by generate()
+        self.kernel_report_path = kernel_report_path
+        # Work directory of the checkpoint and whether to resume from it
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.model = self._open_model(input_path)
+        if source_name:
+            self.filename = source_name
+        elif self.input_path:
+            self.filename = os.path.basename(self.input_path)
+        else:
+            self.filename = self._get_header_file_name()
         
-        self.settings = ifcopenshell.geom.settings()
-        self.settings.set(self.settings.USE_WORLD_COORDS, True)
-        self.settings.set("triangulation-type", ifcopenshell.ifcopenshell_wrapper.TRIANGLE_MESH)
-        # Optionally enable shell reorientation to ensure consistent winding
-        if getattr(self, 'reorient_shells', False):
-            try:
-                self.settings.set("reorient-shells", True)
-            except Exception:
-                pass
+        self.settings = self._create_settings(linear_deflection, angular_deflection)
+        # Settings objects for the adaptive deflection levels (created on demand)
+        # Maps linear deflection -> settings
+        self.adaptive_settings = {}
+        # Metres per project length unit (the element sizes for adaptive deflection are estimated
+        # from the representation, the tessellation is in metres)
+        self.length_unit_scale = ifcopenshell.util.unit.calculate_unit_scale(self.model) if self.adaptive_deflection else 1.0
 
-        print(f"Processing IFC file: {self.input_path} - IFC Version: {self.model.schema}")
+        print(f"Processing IFC file: {self.input_path or '<in-memory model>'} - IFC Version: {self.model.schema}")
         
         # Georeferencing parameters
         self.eastings = 0.0
@@ -92,13 +2638,12 @@ class CityGMLGenerator:
         self.scale = 1.0
         self.rotation_matrix = np.eye(3)
         self.srs_name = "EPSG:0"
+        # Vertical datum of the IfcProjectedCRS (used as vertical CRS of the model by _setup_target_crs())
+        self.vertical_datum = None
+        # True if the coordinates are transformed to a CRS (IfcMapConversion or --georef-oktoberfest)
+        self.georeferenced = False
 
-        # Track gml:id values for each exported element so we can create xlinks
-        # Maps IFC element -> gml:id string
-        self.element_gml_ids = {}
-        # Track which elements were actually exported (not removed later)
-        # This is a set of IFC elements that have valid geometry and are in the output
-        self.exported_elements = set()
+        # The per-run state (gml:ids, exported elements, statistics) is kept in a ConversionContext
 
         self._setup_georeferencing()
 
@@ -109,8 +2654,53 @@ class CityGMLGenerator:
             self.northings = 5334100.0
             self.orthogonal_height = 521.0
             self.srs_name = "EPSG:25832"
+            self.georeferenced = True
             print(f"Georeference set to Theresienwiese in Munich (EPSG:25832): E={self.eastings:.3f}, N={self.northings:.3f}, H={self.orthogonal_height}")
 
+        # Transformation of the georeferenced coordinates into target_crs (pyproj Transformer or None)
+        self.target_crs = target_crs
+        self.crs_transformer = None
+        if target_crs:
+            self._setup_target_crs(target_crs)
+
+        if self.geometry_kernels != [DEFAULT_GEOMETRY_KERNEL]:
+            print(f"Geometry kernel chain: {' -> '.join(self.geometry_kernels)}")
+
+        # Selection of the elements to convert (None = all elements), after the georeferencing (bbox)
+        self.element_filter = None
+        if include_types or exclude_types or storeys or guids is not None or bbox is not None:
+            self.element_filter = ElementFilter(self, include_types, exclude_types, storeys, guids, bbox)
+
+    @staticmethod
+    def _open_model(source):
+        """
+        Returns the IFC model for an ifcopenshell.file, the content of an IFC file (bytes/str) or a path.
+        Compressed files (.ifc.gz, .ifczip) are decompressed in memory (see read_compressed_ifc()).
+        """
+        if isinstance(source, ifcopenshell.file):
+            return source
+        if not isinstance(source, str) or not source.lstrip().startswith("ISO-10303-21"):
+            decompressed = read_compressed_ifc(source)
+            if decompressed is not None:
+                source = decompressed
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+            try:
+                return ifcopenshell.file.from_string(data.decode("utf-8"))
+            except UnicodeDecodeError:
+                return ifcopenshell.file.from_string(data.decode("latin-1"))
+        if isinstance(source, str) and source.lstrip().startswith("ISO-10303-21"):
+            return ifcopenshell.file.from_string(source)
+        return ifcopenshell.open(source)
+
+    def _get_header_file_name(self):
+        """Returns the file name from the STEP header of the model (FILE_NAME), without directories."""
+        try:
+            name = self.model.header.file_name.name
+        except Exception:
+            return None
+        return re.split(r"[\\/]", name)[-1] if name else None
+
     def _setup_georeferencing(self):
         """Extract georeferencing parameters from IFC model (IfcMapConversion, IfcProjectedCRS)."""
         try:
@@ -120,6 +2710,7 @@ class CityGMLGenerator:
 
         if map_conversions:
             mc = map_conversions[0]
+            self.georeferenced = True
             self.eastings = mc.Eastings
             self.northings = mc.Northings
             self.orthogonal_height = mc.OrthogonalHeight
@@ -141,11 +2732,62 @@ class CityGMLGenerator:
 
             if crs and getattr(crs[0], 'Name', None):
                 self.srs_name = crs[0].Name
+                self.vertical_datum = getattr(crs[0], 'VerticalDatum', None)
         else:
             print("No IfcMapConversion found. Using local coordinates.")
 
+    def _setup_target_crs(self, target_crs):
+        """
+        Creates the transformation of the georeferenced coordinates from the CRS of the model (srsName,
+        with IfcProjectedCRS.VerticalDatum as vertical CRS if PROJ knows it) into target_crs (any CRS
+        definition of pyproj, e.g. EPSG:25833 or EPSG:25832+7837 with heights in DHHN2016) and makes
+        target_crs the srsName. If only target_crs has a vertical CRS, the heights of the model are taken
+        as heights in it. The most accurate transformation with the locally installed PROJ grids is used
+        (no network access); a warning is printed if a better one needs a missing grid.
+        """
+        if pyproj is None:
+            raise ValueError("--target-crs needs the pyproj package (pip install pyproj)")
+        if not self.georeferenced:
+            raise ValueError("--target-crs needs a georeferenced model (IfcMapConversion or --georef-oktoberfest)")
+        try:
+            source = pyproj.CRS.from_user_input(self.srs_name)
+        except pyproj.exceptions.CRSError:
+            raise ValueError(f"the CRS of the model '{self.srs_name}' is unknown to PROJ, it cannot be transformed into another CRS") from None
+        try:
+            target = pyproj.CRS.from_user_input(target_crs)
+        except pyproj.exceptions.CRSError as e:
+            raise ValueError(f"invalid target CRS '{target_crs}': {e}") from None
+        # (all outputs write the coordinates with 3 decimals, i.e. in millimetres)
+        if target.is_geographic:
+            raise ValueError(f"the target CRS '{target_crs}' is geographic; the coordinates are written in metres with 3 decimals, so it must be projected")
+
+        if self.vertical_datum and not source.is_compound:
+            try:
+                vertical = pyproj.CRS.from_user_input(self.vertical_datum)
+            except pyproj.exceptions.CRSError:
+                print(f"Warning: vertical datum '{self.vertical_datum}' of the model is unknown to PROJ (ignored)")
+            else:
+                if vertical.is_vertical:
+                    source = pyproj.crs.CompoundCRS(f"{source.name} + {vertical.name}", [source, vertical])
+        if target.is_compound and not source.is_compound:
+            vertical = target.sub_crs_list[1]
+            source = pyproj.crs.CompoundCRS(f"{source.name} + {vertical.name}", [source, vertical])
+
+        group = pyproj.transformer.TransformerGroup(source, target, always_xy=True)
+        if not group.transformers:
+            raise ValueError(f"no transformation from {source.name} to {target.name} is available (missing PROJ grids?)")
+        if not group.best_available:
+            print(f"Warning: a more accurate transformation from {source.name} to {target.name} needs PROJ grids that are not installed (see projsync)")
+        self.crs_transformer = group.transformers[0]
+        # (the given name is kept as srsName unless it is a definition with another EPSG code)
+        code = target.to_epsg()
+        self.srs_name = target_crs if code is None or get_epsg_code(target_crs) == code else f"EPSG:{code}"
+        print(f"Target CRS {self.srs_name} ({target.name}), transformation: {self.crs_transformer.description}")
+
     def transform_vertex(self, vertex):
         """Apply georeferencing transformation (scale, rotation, translation) to a vertex."""
+        if self.crs_transformer is not None:
+            return self.transform_vertices(np.reshape(vertex, (1, 3)))[0]
         v = np.array(vertex) * self.scale
         v = np.dot(self.rotation_matrix, v)
         v[0] += self.eastings + self.xoffset
@@ -153,6 +2795,21 @@ class CityGMLGenerator:
         v[2] += self.orthogonal_height + self.zoffset
         return v
 
+    def transform_vertices(self, vertices):
+        """
+        Apply the georeferencing transformation to an (N, 3) array of vertices in one operation. With
+        target_crs, the map coordinates are transformed with one pyproj call for the whole array and the
+        offsets are added in the target CRS.
+        """
+        transformed = (np.asarray(vertices, dtype=np.float64) * self.scale) @ self.rotation_matrix.T
+        if self.crs_transformer is None:
+            transformed += np.array([self.eastings + self.xoffset, self.northings + self.yoffset, self.orthogonal_height + self.zoffset])
+            return transformed
+        transformed += np.array([self.eastings, self.northings, self.orthogonal_height])
+        transformed = np.column_stack(self.crs_transformer.transform(transformed[:, 0], transformed[:, 1], transformed[:, 2]))
+        transformed += np.array([self.xoffset, self.yoffset, self.zoffset])
+        return transformed
+
     def create_external_reference(self, parent_element, ifc_guid):
         """Create a CityGML external reference linking to the original IFC element by GUID."""
         if getattr(self, 'no_references', False):
@@ -167,23 +2824,11 @@ class CityGMLGenerator:
 
     def add_properties(self, city_object, ifc_element):
         """Add IFC property sets as CityGML generic attributes to a feature."""
-        # Skip exporting properties when requested
-        if getattr(self, 'no_properties', False):
-            return
-        psets = ifcopenshell.util.element.get_psets(ifc_element)
-        
         # Check options
         no_generic_attribute_sets = getattr(self, 'no_generic_attribute_sets', False)
         pset_names_as_prefixes = getattr(self, 'pset_names_as_prefixes', False)
         
-        for pset_name, properties in psets.items():
-            if not properties or pset_name == 'id':
-                continue
-            # Filter properties to find valid ones (not None, not 'id')
-            valid_props = {k: v for k, v in properties.items() if v is not None and k != 'id'}
-            if not valid_props:
-                continue
-
+        for pset_name, valid_props in self._get_property_sets(ifc_element):
             if no_generic_attribute_sets:
                 # Output properties as direct generic attributes without GenericAttributeSet wrapper
                 for prop_name, prop_value in valid_props.items():
@@ -205,6 +2850,50 @@ class CityGMLGenerator:
                     inner_attr_container = etree.SubElement(attr_set, f"{{{NSMAP['gen']}}}genericAttribute")
                     self._add_generic_attribute_value(inner_attr_container, prop_name, prop_value, pset_names_as_prefixes, pset_name)
 
+    def _get_property_sets(self, ifc_element):
+        """Returns the property sets of an element to be exported as list of (pset name, {property name: value}) (empty with no_properties)."""
+        # Skip exporting properties when requested
+        if getattr(self, 'no_properties', False):
+            return []
+        property_sets = []
+        for pset_name, properties in ifcopenshell.util.element.get_psets(ifc_element).items():
+            if not properties or pset_name == 'id':
+                continue
+            # Filter properties to find valid ones (not None, not 'id')
+            valid_props = {k: v for k, v in properties.items() if v is not None and k != 'id'}
+            if valid_props:
+                property_sets.append((pset_name, valid_props))
+        return property_sets
+
+    def _get_cityjson_attributes(self, ifc_element, flat=False):
+        """
+        Returns the CityJSON attributes of an IFC element: name, description, external reference and
+        the property sets (one attribute per property set unless no_generic_attribute_sets, property names
+        prefixed with the property set name with pset_names_as_prefixes). With flat, all values are
+        scalars (for semantic surfaces): the external reference is split into informationSystem and
+        targetResource and the properties are prefixed attributes.
+        """
+        attributes = {}
+        if getattr(ifc_element, 'Name', None):
+            attributes["name"] = ifc_element.Name
+        if getattr(ifc_element, 'Description', None):
+            attributes["description"] = ifc_element.Description
+        if not getattr(self, 'no_references', False):
+            reference = {"informationSystem": self.filename, "targetResource": getattr(ifc_element, 'GlobalId', None) or "UNKNOWN"}
+            if flat:
+                attributes.update(reference)
+            else:
+                attributes["externalReference"] = reference
+        for pset_name, valid_props in self._get_property_sets(ifc_element):
+            if flat or self.no_generic_attribute_sets:
+                for prop_name, prop_value in valid_props.items():
+                    name = f"[{pset_name}]{prop_name}" if flat or self.pset_names_as_prefixes else prop_name
+                    attributes[name] = to_json_value(prop_value)
+            else:
+                attributes[pset_name] = {(f"[{pset_name}]{prop_name}" if self.pset_names_as_prefixes else prop_name): to_json_value(prop_value)
+                                         for prop_name, prop_value in valid_props.items()}
+        return attributes
+
     def _add_generic_attribute(self, parent, attr_name, attr_value):
         """Helper method to add a generic attribute directly to parent element."""
         gen_attr_container = etree.SubElement(parent, f"{{{NSMAP['core']}}}genericAttribute")
@@ -269,11 +2958,13 @@ class CityGMLGenerator:
         
         return doors_and_windows
 
-    def _add_door_or_window_as_filling(self, parent_element, door_or_window, building_appearance_count):
+    def _add_door_or_window_as_filling(self, parent_element, door_or_window, dw_record, shared_targets=None, deferred_geometries=None):
         """
         Adds a Door or Window as a filling element (con:filling) to the parent element.
         This is the proper CityGML 3.0 way to represent openings in constructive elements.
         Also adds appearance information if the door/window has colors/materials.
+        dw_record is the GeometryRecord of the door/window from the tessellation stage (or None).
+        shared_targets and deferred_geometries are passed on to add_appearance() and _add_lod3_geometry().
         Returns the number of materials added for appearance tracking.
         """
         dw_type = "Door" if door_or_window.is_a("IfcDoor") else "Window"
@@ -296,15 +2987,14 @@ class CityGMLGenerator:
 
         self.create_external_reference(dw_elem, getattr(door_or_window, 'GlobalId', 'UNKNOWN'))
         
-        # Generate geometry with surface IDs and per-face materials for multi-appearance support
+        # Geometry record (surface IDs and per-face materials for multi-appearance support)
         dw_is_solid = self.is_intended_solid(door_or_window)
-        dw_polygons, dw_surface_ids, dw_face_materials = self.get_geometry_with_surface_ids(door_or_window)
-        dw_geometry_id = f"UUID_{uuid.uuid4()}" if dw_polygons else None
+        dw_geometry_id = f"UUID_{uuid.uuid4()}" if dw_record else None
         
         # Add appearance if door/window has color information (before generic attributes)
-        # Pass surface_ids and face_materials for per-face targeting
+        # Pass the geometry record for per-face targeting
         if dw_geometry_id:
-            success, mat_count = self.add_appearance(dw_elem, door_or_window, f"DW_{id(door_or_window)}", dw_geometry_id, dw_surface_ids, dw_face_materials)
+            success, mat_count = self.add_appearance(dw_elem, door_or_window, f"DW_{door_or_window.id()}", dw_geometry_id, dw_record, shared_targets)
             if success:
                 materials_added = mat_count
         
@@ -312,29 +3002,44 @@ class CityGMLGenerator:
         self.add_properties(dw_elem, door_or_window)
 
         # Output geometry (after generic attributes)
-        if dw_polygons:
-            if dw_is_solid:
-                dw_lod3 = etree.SubElement(dw_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                dw_solid = etree.SubElement(dw_lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": dw_geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                dw_exterior = etree.SubElement(dw_solid, f"{{{NSMAP['gml']}}}exterior")
-                dw_shell = etree.SubElement(dw_exterior, f"{{{NSMAP['gml']}}}Shell")
-                dw_parent = dw_shell
-            else:
-                dw_lod3 = etree.SubElement(dw_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                dw_ms = etree.SubElement(dw_lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": dw_geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                dw_parent = dw_ms
-
-            # Use the pre-generated surface_ids for each polygon
-            for poly_coords, surface_id in zip(dw_polygons, dw_surface_ids):
-                sm = etree.SubElement(dw_parent, f"{{{NSMAP['gml']}}}surfaceMember")
-                poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-        
+        if dw_record:
+            self._add_lod3_geometry(dw_elem, dw_record, dw_geometry_id, dw_is_solid, deferred_geometries)
+            if self.envelopes:
+                lower, upper = dw_record.envelope()
+                insert_bounded_by(dw_elem, tuple(float(c) for c in np.concatenate([lower, upper])), self.srs_name)
+
         return materials_added
 
+    def _add_lod3_geometry(self, parent_element, record, geometry_id, is_solid, deferred_geometries=None):
+        """
+        Adds the geometry of a GeometryRecord as lod3Solid (if the element was modeled as a solid)
+        or lod3MultiSurface with one triangle polygon per face to a CityGML feature.
+        If a deferred_geometries list is given, only a placeholder element is added and the geometry
+        is appended to the list, to be template-encoded after serialization (see expand_geometry_placeholders()).
+        """
+        if deferred_geometries is not None and len(record) > 0:
+            etree.SubElement(parent_element, f"{GEOMETRY_PLACEHOLDER}_{len(deferred_geometries)}")
+            deferred_geometries.append((record, geometry_id, is_solid))
+            return
+
+        if is_solid:
+            lod3 = etree.SubElement(parent_element, f"{{{NSMAP['core']}}}lod3Solid")
+            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
+            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
+            parent_for_polys = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
+        else:
+            lod3 = etree.SubElement(parent_element, f"{{{NSMAP['core']}}}lod3MultiSurface")
+            parent_for_polys = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
+
+        # Polygon ids are derived from the face index (same ids as used by the appearance targets)
+        for face_idx, pos_list in enumerate(format_pos_lists(record.ring_coordinates())):
+            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
+            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": record.surface_id(face_idx)})
+            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
+            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
+            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
+            pos.text = pos_list
+
     def is_intended_solid(self, element):
         """
         Checks the IFC Representation Type to determine if the element 
@@ -362,6 +3067,236 @@ class CityGMLGenerator:
                     
         return False
 
+    def get_cost_signals(self, element):
+        """
+        Collects cheap signals for the conversion cost of an element from its Body representations
+        (the same representations as is_intended_solid()) without tessellating it. Mapped
+        representations are resolved to the representation type of their source.
+        Returns a CostSignals object.
+        """
+        signals = CostSignals()
+        signals.openings = len(getattr(element, 'HasOpenings', None) or ())
+        representation = getattr(element, 'Representation', None)
+        if not representation:
+            return signals
+
+        def add_items(rep, depth=0):
+            rtype = getattr(rep, 'RepresentationType', None)
+            for item in rep.Items or ():
+                if item.is_a('IfcMappedItem') and depth < 8:
+                    signals.mapped_items += 1
+                    add_items(item.MappingSource.MappedRepresentation, depth + 1)
+                    continue
+                signals.items += 1
+                if rtype and rtype != 'MappedRepresentation':
+                    signals.representation_types.add(rtype)
+                if item.is_a('IfcFacetedBrep'):
+                    signals.faces += len(item.Outer.CfsFaces)
+                elif item.is_a('IfcTriangulatedFaceSet'):
+                    signals.faces += len(item.CoordIndex)
+                elif item.is_a('IfcPolygonalFaceSet'):
+                    signals.faces += len(item.Faces)
+
+        for rep in representation.Representations:
+            rid = getattr(rep, 'RepresentationIdentifier', None)
+            if rid and rid.lower() not in ['body', 'mesh', 'facetedbrep']:
+                continue
+            add_items(rep)
+        return signals
+
+    def _create_settings(self, linear_deflection=None, angular_deflection=None):
+        """Create IfcOpenShell geometry settings (world coordinates, triangle meshes) with optional mesher tolerances."""
+        settings = ifcopenshell.geom.settings()
+        settings.set(settings.USE_WORLD_COORDS, True)
+        settings.set("triangulation-type", ifcopenshell.ifcopenshell_wrapper.TRIANGLE_MESH)
+        if linear_deflection is not None:
+            settings.set("mesher-linear-deflection", linear_deflection)
+        if angular_deflection is not None:
+            settings.set("mesher-angular-deflection", angular_deflection)
+        # Optionally enable shell reorientation to ensure consistent winding
+        if getattr(self, 'reorient_shells', False):
+            try:
+                settings.set("reorient-shells", True)
+            except Exception:
+                pass
+        return settings
+
+    def get_size_estimate(self, element):
+        """
+        Estimates the bounding box diagonal of an element (in metres) from its representations without
+        tessellating it: the IfcBoundingBox of its 'Box' representation if there is one, else the extent
+        of the IfcCartesianPoints (and point lists) of the items of its Body representations (the same
+        representations as is_intended_solid()), combined with the largest extrusion depth or parametric
+        profile size (which are not given by points). Placements within the items are not applied, so
+        this is an estimate. Returns None if the representations give no size.
+        """
+        representation = getattr(element, 'Representation', None)
+        if not representation:
+            return None
+        for rep in representation.Representations:
+            for item in rep.Items or ():
+                if item.is_a('IfcBoundingBox'):
+                    return float(np.linalg.norm([item.XDim, item.YDim, item.ZDim])) * self.length_unit_scale
+
+        points = []
+        dimension = 0.0
+        for rep in representation.Representations:
+            rid = getattr(rep, 'RepresentationIdentifier', None)
+            if rid and rid.lower() not in ['body', 'mesh', 'facetedbrep']:
+                continue
+            for item in rep.Items or ():
+                # Also follows mapped items to the items of their source representation
+                for entity in self.model.traverse(item):
+                    if entity.is_a('IfcCartesianPoint'):
+                        points.append(tuple(entity.Coordinates) + (0.0,) * (3 - len(entity.Coordinates)))
+                    elif entity.is_a('IfcCartesianPointList'):
+                        points.extend(tuple(coordinates) + (0.0,) * (3 - len(coordinates)) for coordinates in entity.CoordList)
+                    elif entity.is_a('IfcExtrudedAreaSolid'):
+                        dimension = max(dimension, entity.Depth)
+                    elif entity.is_a('IfcRectangleProfileDef'):
+                        dimension = max(dimension, float(np.hypot(entity.XDim, entity.YDim)))
+                    elif entity.is_a('IfcCircleProfileDef'):
+                        dimension = max(dimension, 2 * entity.Radius)
+        diagonal = 0.0
+        if points:
+            points = np.array(points, dtype=np.float64)
+            diagonal = float(np.linalg.norm(points.max(axis=0) - points.min(axis=0)))
+        if diagonal == 0.0 and dimension == 0.0:
+            return None
+        return float(np.hypot(diagonal, dimension)) * self.length_unit_scale
+
+    def _get_adaptive_settings(self, element):
+        """
+        Returns the geometry settings with a linear deflection chosen from the element's size (see
+        get_size_estimate(), no tessellation is needed) and IFC class, or the global settings if the
+        size is unknown. The deflection is rounded down to a power-of-two multiple of the minimum
+        deflection and capped at the maximum, so that only a few settings objects are needed and
+        similar elements share them.
+        """
+        diagonal = self.get_size_estimate(element)
+        if diagonal is None:
+            return self.settings
+
+        factor = ADAPTIVE_DEFLECTION_FACTORS.get(element.is_a(), ADAPTIVE_DEFAULT_DEFLECTION_FACTOR)
+        level = int(np.floor(np.log2(max(diagonal * factor, ADAPTIVE_MIN_LINEAR_DEFLECTION) / ADAPTIVE_MIN_LINEAR_DEFLECTION)))
+        deflection = min(ADAPTIVE_MIN_LINEAR_DEFLECTION * (2 ** level), ADAPTIVE_MAX_LINEAR_DEFLECTION)
+
+        if deflection not in self.adaptive_settings:
+            self.adaptive_settings[deflection] = self._create_settings(deflection, self.angular_deflection)
+        return self.adaptive_settings[deflection]
+
+    def _get_linear_deflection(self, settings):
+        """Returns the linear deflection used by a settings object (for the tessellation report)."""
+        try:
+            return settings.get("mesher-linear-deflection")
+        except Exception:
+            return None
+
+    def _create_shape_with_kernel(self, element, kernel, settings=None):
+        """Run the IfcOpenShell shape creation for an element with one specific geometry kernel."""
+        settings = settings or self.settings
+        if kernel == DEFAULT_GEOMETRY_KERNEL:
+            # Do not pass the kernel explicitly to stay compatible with older IfcOpenShell versions
+            return ifcopenshell.geom.create_shape(settings, element)
+        return ifcopenshell.geom.create_shape(settings, element, geometry_library=kernel)
+
+    def _run_kernel(self, element, kernel, settings):
+        """
+        Runs one kernel of the chain for an element, in a child process if a kernel_timeout is set and
+        this is the main thread. Forking a process with other running threads can deadlock the child on
+        a lock held by one of them (e.g. in logging or IfcOpenShell), so off the main thread (e.g. with
+        the in-memory API in a thread pool) the shape is created in-process without timeout.
+        """
+        if not self.kernel_timeout:
+            return self._create_shape_with_kernel(element, kernel, settings)
+        if threading.current_thread() is threading.main_thread():
+            return self._create_shape_with_timeout(element, kernel, settings)
+        if not self.kernel_timeout_ignored:
+            self.kernel_timeout_ignored = True
+            print("Warning: --kernel-timeout is ignored for conversions outside the main thread")
+        return self._create_shape_with_kernel(element, kernel, settings)
+
+    def _create_shape_with_timeout(self, element, kernel, settings=None):
+        """
+        Run the shape creation in a forked child process and kill it after kernel_timeout seconds.
+        (The native kernel call holds the Python GIL and cannot be interrupted within the process.)
+        The child sends back a detached copy of the triangulated geometry. On platforms without
+        fork (e.g. Windows) the shape is created in-process without timeout. Only called from the main
+        thread (see _run_kernel()).
+        """
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            return self._create_shape_with_kernel(element, kernel, settings)
+
+        receiver, sender = ctx.Pipe(duplex=False)
+        child = ctx.Process(target=self._detached_shape_worker, args=(element, kernel, settings, sender), daemon=True)
+        child.start()
+        sender.close()
+        try:
+            if not receiver.poll(self.kernel_timeout):
+                raise TimeoutError(f"{kernel} exceeded {self.kernel_timeout}s")
+            status, payload = receiver.recv()
+        except EOFError:
+            raise RuntimeError(f"{kernel} worker process terminated unexpectedly")
+        finally:
+            if child.is_alive():
+                child.terminate()
+            child.join()
+            receiver.close()
+
+        if status != 'ok':
+            raise RuntimeError(payload)
+        return payload
+
+    def _detached_shape_worker(self, element, kernel, settings, sender):
+        """Child process part of _create_shape_with_timeout()."""
+        try:
+            geom = self._create_shape_with_kernel(element, kernel, settings).geometry
+            materials = []
+            for mat in geom.materials:
+                diffuse = mat.diffuse
+                materials.append(DetachedMaterial((diffuse.r(), diffuse.g(), diffuse.b()), mat.transparency))
+            detached = DetachedGeometry(tuple(geom.verts), tuple(geom.faces), tuple(geom.material_ids), materials)
+            sender.send(('ok', DetachedShape(detached)))
+        except Exception as e:
+            sender.send(('error', str(e)))
+        finally:
+            sender.close()
+
+    def create_shape(self, element, stats=None):
+        """
+        Creates the shape of an element using the chain of geometry kernels.
+        The kernels are tried in the given order; if a kernel fails or exceeds the timeout,
+        the next one is used. The kernel that produced the shape and the triangle counts are
+        recorded in stats (a TessellationStats object, optional).
+        With adaptive deflection the mesher tolerance is chosen per element.
+        Raises the last error if all kernels failed.
+        """
+        stats = stats if stats is not None else TessellationStats()
+        settings = self._get_adaptive_settings(element) if self.adaptive_deflection else self.settings
+        last_error = None
+        for kernel in self.geometry_kernels:
+            try:
+                shape = self._run_kernel(element, kernel, settings)
+            except Exception as e:
+                last_error = e
+                continue
+            stats.element_kernels[element.id()] = kernel
+            stats.kernel_counts[kernel] = stats.kernel_counts.get(kernel, 0) + 1
+
+            # Count triangles per IFC class and per linear deflection for the tessellation report
+            triangle_count = len(shape.geometry.faces) // 3
+            ifc_class = element.is_a()
+            stats.triangle_counts[ifc_class] = stats.triangle_counts.get(ifc_class, 0) + triangle_count
+            deflection = self._get_linear_deflection(settings)
+            stats.deflection_triangle_counts[deflection] = stats.deflection_triangle_counts.get(deflection, 0) + triangle_count
+            return shape
+
+        stats.element_kernels[element.id()] = 'failed'
+        stats.kernel_counts['failed'] = stats.kernel_counts.get('failed', 0) + 1
+        raise last_error if last_error else RuntimeError("No geometry kernel configured")
+
     def get_geometry(self, element):
         """
         Extracts geometry. 
@@ -369,7 +3304,7 @@ class CityGMLGenerator:
         We rely on is_intended_solid(element) in the main loop.
         """
         try:
-            shape = ifcopenshell.geom.create_shape(self.settings, element)
+            shape = self.create_shape(element)
             verts = shape.geometry.verts
             faces = shape.geometry.faces
             
@@ -391,26 +3326,30 @@ class CityGMLGenerator:
         except:
             return None
 
-    def get_geometry_with_surface_ids(self, element):
+    def get_geometry_with_surface_ids(self, element, stats=None):
         """
-        Extracts geometry with unique surface IDs for each polygon.
-        Also extracts per-face material information from IfcOpenShell.
-        Returns a tuple: (polygons, surface_ids, face_materials) where:
-        - polygons is a list of polygon coordinates
-        - surface_ids is a list of UUIDs corresponding to each polygon
-        - face_materials is a list of (r, g, b) tuples for each polygon (or None if no material)
+        Extracts the triangulated geometry of an element including per-face material information.
+        Returns a GeometryRecord (vertices, faces, per-face material ids and the material table in
+        numpy arrays; the surface ids are derived from the face index) or None if no geometry
+        could be created. Kernel, triangle and decimation statistics are recorded in stats.
         """
+        stats = stats if stats is not None else TessellationStats()
         try:
-            shape = ifcopenshell.geom.create_shape(self.settings, element)
+            shape = self.create_shape(element, stats)
             geom = shape.geometry
-            verts = geom.verts
-            faces = geom.faces
-            
-            raw_verts = np.array(verts).reshape(-1, 3)
-            polygons = []
-            surface_ids = []
-            face_materials = []
-            
+
+            # Read vertices, faces and material ids directly from the buffers (no Python lists)
+            if hasattr(geom, 'verts_buffer'):
+                raw_verts = np.frombuffer(geom.verts_buffer, dtype=np.float64).reshape(-1, 3)
+                raw_faces = np.frombuffer(geom.faces_buffer, dtype=np.int32).reshape(-1, 3)
+                material_ids = np.frombuffer(geom.material_ids_buffer, dtype=np.int32)
+            else:
+                raw_verts = np.asarray(geom.verts, dtype=np.float64).reshape(-1, 3)
+                raw_faces = np.asarray(geom.faces, dtype=np.int32).reshape(-1, 3)
+                material_ids = np.asarray(geom.material_ids if geom.material_ids else [], dtype=np.int32)
+            if len(raw_faces) == 0:
+                return None
+
             # Extract material information if available (including transparency)
             materials_list = []
             if hasattr(geom, 'materials') and geom.materials:
@@ -427,7 +3366,7 @@ class CityGMLGenerator:
                                 g_val = diffuse.g() if callable(diffuse.g) else diffuse.g
                                 b_val = diffuse.b() if callable(diffuse.b) else diffuse.b
                                 color = (r_val, g_val, b_val)
-                            except:
+                            except Exception:
                                 pass
                         elif hasattr(diffuse, 'colour'):
                             col = diffuse.colour
@@ -437,54 +3376,64 @@ class CityGMLGenerator:
                                     g_val = col.g() if callable(col.g) else col.g
                                     b_val = col.b() if callable(col.b) else col.b
                                     color = (r_val, g_val, b_val)
-                                except:
+                                except Exception:
                                     pass
                         elif isinstance(diffuse, tuple) and len(diffuse) >= 3:
                             color = (diffuse[0], diffuse[1], diffuse[2])
-                    
-                    # Extract transparency
-                    if hasattr(mat, 'transparency'):
-                        try:
-                            trans_val = mat.transparency() if callable(mat.transparency) else mat.transparency
-                            if trans_val is not None and trans_val > 0:
-                                transparency = trans_val
-                        except:
-                            pass
-                    
-                    if color:
-                        materials_list.append((color[0], color[1], color[2], transparency))
-            
-            # Get material IDs per face
-            material_ids = []
-            if hasattr(geom, 'material_ids') and geom.material_ids:
-                material_ids = list(geom.material_ids)
-            
-            for i in range(0, len(faces), 3):
-                idx = [faces[i], faces[i+1], faces[i+2]]
-                poly_coords = []
-                for id in idx:
-                    v = self.transform_vertex(raw_verts[id])
-                    poly_coords.extend(v)
-                
-                v_start = self.transform_vertex(raw_verts[idx[0]])
-                poly_coords.extend(v_start)
-                polygons.append(poly_coords)
-                surface_ids.append(f"UUID_{uuid.uuid4()}")
-                
-                # Get material for this face
-                face_idx = i // 3
-                if material_ids and face_idx < len(material_ids):
-                    mat_id = material_ids[face_idx]
-                    if mat_id < len(materials_list):
-                        face_materials.append(materials_list[mat_id])
-                    else:
-                        face_materials.append(None)
-                else:
-                    face_materials.append(None)
-                
-            return polygons, surface_ids, face_materials
-        except:
-            return None, None, None
+                    
+                    # Extract transparency
+                    if hasattr(mat, 'transparency'):
+                        try:
+                            trans_val = mat.transparency() if callable(mat.transparency) else mat.transparency
+                            if trans_val is not None and trans_val > 0:
+                                transparency = trans_val
+                        except Exception:
+                            pass
+                    
+                    # Keep the table aligned with the material ids (None for materials without colour)
+                    materials_list.append((color[0], color[1], color[2], transparency) if color else None)
+            
+            # Material index per face (-1 = no material)
+            face_material_ids = np.full(len(raw_faces), -1, dtype=np.int16)
+            count = min(len(material_ids), len(raw_faces))
+            face_material_ids[:count] = material_ids[:count]
+            face_material_ids[face_material_ids >= len(materials_list)] = -1
+
+            # Optionally decimate meshes that exceed the triangle budget (keeping per-face materials)
+            budget = self._get_triangle_budget(element)
+            if budget is not None and len(raw_faces) > budget:
+                triangles_before = len(raw_faces)
+                raw_verts, raw_faces, face_material_ids = decimate_mesh(raw_verts, raw_faces, face_material_ids, budget, self.decimation_error)
+                if len(raw_faces) < triangles_before:
+                    stats.decimation['elements'] += 1
+                    stats.decimation['before'] += triangles_before
+                    stats.decimation['after'] += len(raw_faces)
+
+            return GeometryRecord(self.transform_vertices(raw_verts), raw_faces, face_material_ids, materials_list)
+        except Exception:
+            return None
+
+    def _get_triangle_budget(self, element):
+        """
+        Returns the triangle budget for an element: the per-class budget of the most specific configured
+        class the element is an instance of (so IfcBuildingElementProxy=... also covers its subtypes and
+        IfcDoor=... takes precedence over IfcBuildingElement=...), else the global one.
+        """
+        if not self.max_triangles_per_class:
+            return self.max_triangles
+        entity_type = element.is_a()
+        if entity_type not in self._triangle_budgets_by_type:
+            budgets = {ifc_class.lower(): budget for ifc_class, budget in self.max_triangles_per_class.items()}
+            schema, _, _ = element.is_a(True).partition(".")
+            declaration = ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema).declaration_by_name(entity_type)
+            budget = self.max_triangles
+            while declaration is not None:
+                if declaration.name().lower() in budgets:
+                    budget = budgets[declaration.name().lower()]
+                    break
+                declaration = declaration.supertype()
+            self._triangle_budgets_by_type[entity_type] = budget
+        return self._triangle_budgets_by_type[entity_type]
 
     def get_element_color(self, element):
         """
@@ -693,7 +3642,7 @@ class CityGMLGenerator:
         except Exception as e:
             return []
 
-    def add_appearance(self, parent_element, element, element_id, geometry_id, surface_ids=None, face_materials=None):
+    def add_appearance(self, parent_element, element, element_id, geometry_id, record=None, shared_targets=None):
         """
         Adds CityGML appearance elements if the IFC element has color information.
         Supports multi-appearance with multiple materials targeting different surfaces.
@@ -703,8 +3652,8 @@ class CityGMLGenerator:
             element: The IFC element
             element_id: The gml:id of the CityGML element
             geometry_id: The gml:id of the geometry (Solid or MultiSurface)
-            surface_ids: Optional list of surface IDs corresponding to each polygon face
-            face_materials: Optional list of (r, g, b, transparency) tuples per face from IfcOpenShell
+            record: Optional GeometryRecord with the per-face materials from IfcOpenShell and the surface IDs
+            shared_targets: Optional list collecting the shared material targets (see _add_shared_material_targets)
         
         Returns:
             tuple: (success: bool, material_count: int) - success flag and number of materials added
@@ -712,22 +3661,15 @@ class CityGMLGenerator:
         # Skip if appearances are disabled
         if getattr(self, 'no_appearances', False):
             return False, 0
+
+        # Shared materials: only collect the targets, the appearance is written for the whole Building/CityModel
+        if self.shared_materials:
+            return self._add_shared_material_targets(element, geometry_id, record, shared_targets)
         
         # If we have per-face materials from IfcOpenShell, use those (most accurate)
-        if face_materials and surface_ids:
-            # Group faces by material color and transparency
-            material_faces = {}
-            for face_idx, mat_data in enumerate(face_materials):
-                if mat_data is not None:
-                    # mat_data is (r, g, b, transparency) tuple
-                    if len(mat_data) >= 3:
-                        r, g, b = mat_data[0], mat_data[1], mat_data[2]
-                        transparency = mat_data[3] if len(mat_data) > 3 else 0.0
-                        # Round to avoid floating point comparison issues
-                        material_key = (round(r, 6), round(g, 6), round(b, 6), round(transparency, 6))
-                        if material_key not in material_faces:
-                            material_faces[material_key] = []
-                        material_faces[material_key].append(face_idx)
+        if record is not None:
+            # Group faces by material color and transparency (vectorized over the per-face material ids)
+            material_faces = record.faces_by_material()
             
             if material_faces:
                 try:
@@ -740,7 +3682,7 @@ class CityGMLGenerator:
                     
                     material_count = 0
                     
-                    for mat_idx, (material_key, face_indices) in enumerate(material_faces.items()):
+                    for mat_idx, (material_key, face_indices) in enumerate(material_faces):
                         r, g, b, transparency = material_key
                         
                         surface_data_member = etree.SubElement(appearance, f"{{{NSMAP['app']}}}surfaceData")
@@ -759,10 +3701,9 @@ class CityGMLGenerator:
                             trans_elem.text = f"{transparency}"
                         
                         # Add targets for each face with this material
-                        for face_idx in face_indices:
-                            if 0 <= face_idx < len(surface_ids):
-                                target = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}target")
-                                target.text = f"#{surface_ids[face_idx]}"
+                        for target_ref in record.surface_id_targets(face_indices):
+                            target = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}target")
+                            target.text = target_ref
                         
                         material_count += 1
                     
@@ -804,12 +3745,12 @@ class CityGMLGenerator:
                 diffuse_color.text = f"{color[0]} {color[1]} {color[2]}"
                 
                 # Add target reference(s) to the geometry
-                if face_indices and surface_ids:
+                if face_indices and record is not None:
                     # Multi-appearance: target specific surfaces by their IDs
                     for face_idx in face_indices:
-                        if 0 <= face_idx < len(surface_ids):
+                        if 0 <= face_idx < len(record):
                             target = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}target")
-                            target.text = f"#{surface_ids[face_idx]}"
+                            target.text = f"#{record.surface_id(face_idx)}"
                 else:
                     # Single-appearance: target the entire geometry
                     target = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}target")
@@ -821,14 +3762,316 @@ class CityGMLGenerator:
         except Exception as e:
             return False, 0
 
-    def generate(self):
-        """Generate CityGML 3.0 output from the IFC model and write to file."""
+    def _add_shared_material_targets(self, element, geometry_id, record=None, shared_targets=None):
+        """
+        Registers the surfaces (or the whole geometry) of an element as targets of the shared materials.
+        Uses the same material sources as add_appearance(). Returns (success, number of materials used).
+        The (material key, target) pairs are appended to shared_targets; the pipeline merges them into
+        the shared_material_targets of the ConversionContext in document order.
+        """
+        if shared_targets is None:
+            shared_targets = []
+
+        def add_target(material_key, target):
+            shared_targets.append((material_key, target))
+
+        if record is not None:
+            material_faces = record.faces_by_material()
+            if material_faces:
+                for material_key, face_indices in material_faces:
+                    add_target(material_key, (record.surface_id_prefix, face_indices))
+                return True, len(material_faces)
+
+        # Fallback: use get_element_materials_with_faces (less accurate, no per-face mapping)
+        materials_with_faces = self.get_element_materials_with_faces(element)
+        if not materials_with_faces:
+            return False, 0
+
+        for color, face_indices in materials_with_faces:
+            material_key = (round(color[0], 6), round(color[1], 6), round(color[2], 6), 0.0)
+            if face_indices and record is not None:
+                # Multi-appearance: target specific surfaces by their IDs
+                valid_indices = np.array([i for i in face_indices if 0 <= i < len(record)], dtype=np.int64)
+                target = (record.surface_id_prefix, valid_indices)
+            else:
+                # Single-appearance: target the entire geometry
+                target = f"#{geometry_id}"
+            add_target(material_key, target)
+        return True, len(materials_with_faces)
+
+    def _create_shared_appearance(self, context, owner_id):
+        """
+        Creates an app:Appearance with one X3DMaterial per unique colour/transparency collected by
+        _add_shared_material_targets(), each targeting all surfaces/geometries using it.
+        Clears the collected targets of the context. Returns (appearance element, material count) or (None, 0).
+        """
+        if not context.shared_material_targets:
+            return None, 0
+
+        appearance = etree.Element(f"{{{NSMAP['app']}}}Appearance")
+        appearance.set(f"{{{NSMAP['gml']}}}id", f"APP_{owner_id}")
+        theme = etree.SubElement(appearance, f"{{{NSMAP['app']}}}theme")
+        theme.text = "RGB"
+
+        for mat_idx, (material_key, targets) in enumerate(context.shared_material_targets.items()):
+            r, g, b, transparency = material_key
+            surface_data_member = etree.SubElement(appearance, f"{{{NSMAP['app']}}}surfaceData")
+            x3d_material = etree.SubElement(surface_data_member, f"{{{NSMAP['app']}}}X3DMaterial")
+            x3d_material.set(f"{{{NSMAP['gml']}}}id", f"MAT_{owner_id}_{mat_idx}")
+
+            is_front = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}isFront")
+            is_front.text = "true"
+            diffuse_color = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}diffuseColor")
+            diffuse_color.text = f"{r} {g} {b}"
+            if transparency > 0:
+                trans_elem = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}transparency")
+                trans_elem.text = f"{transparency}"
+
+            for target_entry in targets:
+                if isinstance(target_entry, str):
+                    target_refs = [target_entry]
+                else:
+                    prefix, face_indices = target_entry
+                    target_refs = [f"#{prefix}_{face_idx}" for face_idx in face_indices.tolist()]
+                for target_ref in target_refs:
+                    target = etree.SubElement(x3d_material, f"{{{NSMAP['app']}}}target")
+                    target.text = target_ref
+
+        material_count = len(context.shared_material_targets)
+        context.shared_material_targets = {}
+        return appearance, material_count
+
+    def _insert_building_appearance(self, context, building, owner_id=None):
+        """
+        Inserts the shared appearance into a Building. The core:appearance property must follow
+        gml:description, gml:name, gml:boundedBy and core:externalReference and precede the generic attributes.
+        Returns the number of shared materials.
+        """
+        appearance, material_count = self._create_shared_appearance(context, owner_id or building.get(f"{{{NSMAP['gml']}}}id"))
+        if appearance is None:
+            return 0
+        app_member = etree.Element(f"{{{NSMAP['core']}}}appearance")
+        app_member.append(appearance)
+        insert_appearance_property(building, app_member)
+        return material_count
+
+    def generate(self, variants=None):
+        """
+        Generate CityGML 3.0 output from the IFC model and write it to file (output_path).
+        The features are converted by a pipeline (see _run_pipeline()) and streamed to the file
+        in the usual category and schema order, so no document tree is built in memory.
+        variants is an optional list of (output path, options) for further outputs with other
+        serialization options, written in the same run (see write_variants()); their output format
+        is taken from the extension of the path unless given in the options.
+        Returns the ConversionContext of the output_path document.
+        """
+        if self.split:
+            if variants:
+                raise ValueError("output variants cannot be combined with split output")
+            if self.output_format != 'citygml':
+                raise ValueError("split output is only written as CityGML")
+            if self.spatial_index and get_output_compression(self.output_path):
+                raise ValueError("a spatial index needs an uncompressed output (its byte ranges refer to the file)")
+            context, paths = self.write_parts(self.output_path)
+            print(f"Successfully wrote {len(paths)} files and {os.path.join(os.path.dirname(self.output_path), strip_output_extension(os.path.basename(self.output_path)))}_manifest.json")
+            if context.checkpoint is not None:
+                context.checkpoint.remove()
+            self._save_timings(context)
+            self._save_kernel_report(context)
+            if context.building_count > 0:
+                self._print_summary(context)
+            return context
+
+        outputs = [(self.output_path, {})]
+        for path, options in variants or []:
+            if 'output_format' not in options and get_output_format(path) != self.output_format:
+                options = dict(options, output_format=get_output_format(path))
+            outputs.append((path, options))
+        formats = [options.get('output_format', self.output_format) for _, options in outputs]
+        if self.spatial_index and any(get_output_compression(path) for path, _ in outputs):
+            raise ValueError("a spatial index needs an uncompressed output (its byte ranges refer to the file)")
+        if self.spatial_index and formats[0] != 'citygml':
+            raise ValueError("a spatial index is only written for CityGML output")
+        if any(output_format in PATH_OUTPUT_FORMATS and get_output_compression(path) for (path, _), output_format in zip(outputs, formats)):
+            raise ValueError("GeoPackage and Parquet outputs cannot be compressed")
+        with contextlib.ExitStack() as stack:
+            # (the files of GeoPackage and Parquet outputs are opened by their writers)
+            streams = [path if output_format in PATH_OUTPUT_FORMATS else stack.enter_context(open_output(path)) for (path, _), output_format in zip(outputs, formats)]
+            contexts = self.write_variants([(stream, options) for stream, (_, options) in zip(streams, outputs)])
+
+        for (path, _), context, output_format in zip(outputs, contexts, formats):
+            print(f"Successfully wrote {path}")
+            if output_format == 'parquet':
+                print(f"Successfully wrote {get_parquet_properties_path(path)}")
+            if self.spatial_index and output_format == 'citygml':
+                write_spatial_index(f"{path}.idx", context.feature_offsets)
+                print(f"Successfully wrote {path}.idx ({len(context.feature_offsets)} features)")
+        if contexts[0].checkpoint is not None:
+            contexts[0].checkpoint.remove()
+        self._save_timings(contexts[0])
+        self._save_kernel_report(contexts[0])
+        if contexts[0].building_count > 0:
+            self._print_summary(contexts[0])
+        return contexts[0]
+
+    def _save_timings(self, context):
+        """Writes the conversion times of the jobs (merged with those of previous runs) to timings_path."""
+        if not self.timings_path:
+            return
+        timings = dict(self.historical_timings)
+        timings.update(context.schedule.timings)
+        with open(self.timings_path, "w", encoding="utf-8") as stream:
+            json.dump(timings, stream, indent=1, sort_keys=True)
+        print(f"Successfully wrote {self.timings_path} ({len(context.schedule.timings)} timings)")
+
+    def _save_kernel_report(self, context):
+        """Writes the geometry kernel of each tessellated element (by GlobalId, STEP id #n without one) to kernel_report_path."""
+        if not self.kernel_report_path:
+            return
+        report = {}
+        for step_id, kernel in context.stats.element_kernels.items():
+            report[getattr(self.model.by_id(step_id), 'GlobalId', None) or f"#{step_id}"] = kernel
+        with open(self.kernel_report_path, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, indent=1, sort_keys=True)
+        print(f"Successfully wrote {self.kernel_report_path} ({len(report)} elements)")
+
+    def write(self, stream, context=None):
+        """
+        Converts the model and writes the CityGML document to a binary stream (file, io.BytesIO,
+        socket file, ...). Returns the ConversionContext of the run (gml:ids, statistics).
+        """
+        return self.write_variants([(stream, {})], [context])[0]
+
+    def write_variants(self, outputs, contexts=None):
+        """
+        Converts the model once and writes several CityGML documents that differ in the serialization
+        options (VARIANT_OPTIONS, e.g. one without properties and appearances for visualization):
+        outputs is a list of (binary stream, options), the options are keyword arguments of derive().
+        The model is opened, indexed and tessellated once; only the features are encoded and
+        serialized per output. Returns the ConversionContexts of the outputs.
+        With envelopes, the envelope corners of the Buildings and the CityModel are written into the
+        streams when the documents are complete (non-seekable streams get the document from a
+        temporary file at the end). With spatial_index, the byte ranges of the features (relative to
+        the start of the document) are recorded in ConversionContext.feature_offsets.
+        Outputs with the output_format option 'cityjson' or 'cityjsonseq' are written by a CityJSONWriter.
+        Outputs with the output_format 'gpkg' are loaded into a GeoPackage by a DatabaseWriter, those with
+        'parquet' are written by a ParquetWriter: their "stream" is the path of the output file. Outputs
+        with the output_format 'glb' are written by a GltfWriter.
+        """
+        variants = self._create_variants([options for _, options in outputs], contexts)
+        with contextlib.ExitStack() as stack:
+            streams = []
+            for (stream, _), variant in zip(outputs, variants):
+                seekable = getattr(stream, 'seekable', None)
+                if variant.generator.envelopes and variant.generator.output_format == 'citygml' and not (seekable and seekable()):
+                    stream = stack.enter_context(tempfile.TemporaryFile())
+                streams.append(stream)
+            bases = [stream.tell() if variant.generator.envelopes and variant.generator.output_format == 'citygml' else 0 for stream, variant in zip(streams, variants)]
+            positions = [0] * len(variants)
+            placeholders = [[] for _ in variants]
+
+            # (a writer thread only pays off if the features are converted in separate workers)
+            writers = []
+            for stream, variant in zip(streams, variants):
+                if variant.generator.output_format == 'citygml':
+                    writers.append(FragmentWriter(stream, background=self.workers > 1))
+                elif variant.generator.output_format == 'gpkg':
+                    writers.append(DatabaseWriter(stream, variant.generator._get_database_srs_id(), variant.generator.srs_name, f"City objects converted from {variant.generator.filename}"))
+                elif variant.generator.output_format == 'parquet':
+                    writers.append(ParquetWriter(stream, variant.generator.parquet_geometry, variant.generator.srs_name))
+                elif variant.generator.output_format == 'glb':
+                    writers.append(GltfWriter(stream, variant.generator._get_cityjson_translate(), variant.generator.srs_name))
+                else:
+                    writers.append(CityJSONWriter(stream, variant.generator._get_cityjson_translate(), variant.generator._get_cityjson_metadata(),
+                                                  variant.generator.output_format == 'cityjsonseq', background=self.workers > 1))
+            try:
+                for index, fragment in self._iter_variant_fragments(variants):
+                    if not isinstance(fragment, bytes):
+                        writers[index].write(fragment)
+                        continue
+                    if isinstance(fragment, AnnotatedFragment):
+                        position = positions[index]
+                        placeholders[index].extend((position + offset, width, key, corner) for offset, width, key, corner in fragment.placeholders)
+                        if fragment.feature is not None:
+                            variants[index].context.feature_offsets.append(fragment.feature + (position, len(fragment)))
+                    positions[index] += len(fragment)
+                    writers[index].write(fragment)
+            finally:
+                for writer in writers:
+                    writer.close()
+
+            for (stream, _), written, variant, base, variant_placeholders in zip(outputs, streams, variants, bases, placeholders):
+                if variant_placeholders:
+                    fill_envelope_placeholders(written, variant_placeholders, variant.context.envelopes, base)
+                if written is not stream:
+                    written.seek(0)
+                    shutil.copyfileobj(written, stream, 1 << 20)
+        return [variant.context for variant in variants]
+
+    def write_parts(self, base_path, context=None):
+        """
+        Converts the model and writes it split into several files by building, storey or XY tile
+        (split option) next to base_path ('<name>_building1.gml', ..., see OutputPartition), plus
+        '<name>_manifest.json'. The files are written in parallel after the conversion.
+        Returns the ConversionContext and the paths of the written files.
+        """
+        partition = OutputPartition(self.split or 'building', self.tile_size, base_path)
+        variant = OutputVariant(self, context, partition)
+        # The fragments of the partitioned output are spooled by the partition, only the
+        # CityModel start and end tags are yielded
+        for _ in self._iter_variant_fragments([variant]):
+            pass
+        root, _ = self._create_city_model()
+        paths = partition.write(self, root, self.workers)
+        return variant.context, paths
+
+    def iter_fragments(self, context=None):
+        """
+        Converts the model and yields the CityGML document as a sequence of bytes fragments: XML
+        declaration and core:CityModel start tag, the start tag of each core:cityObjectMember/Building
+        followed by its features one by one, ..., the core:CityModel end tag. Concatenated they form
+        the document written by generate(). The per-run state is kept in context (a new
+        ConversionContext if not given).
+        With envelopes, the document is only complete at the end of the conversion (the envelopes of
+        the Buildings and the CityModel are filled in): it is written to a temporary file and yielded from there.
+        """
+        if self.envelopes:
+            with tempfile.TemporaryFile() as spool:
+                self.write(spool, context)
+                spool.seek(0)
+                yield from iter(lambda: spool.read(1 << 20), b"")
+            return
+        for _, fragment in self._iter_variant_fragments(self._create_variants([{}], [context])):
+            yield fragment
+
+    def derive(self, **options):
+        """
+        Returns a copy of the generator with other serialization options (VARIANT_OPTIONS) that shares
+        the opened model, the geometry settings and the georeferencing.
+        """
+        unknown = set(options) - set(VARIANT_OPTIONS)
+        if unknown:
+            raise ValueError(f"option(s) {', '.join(sorted(unknown))} cannot differ between the outputs of a run (allowed: {', '.join(VARIANT_OPTIONS)})")
+        if options.get('output_format', self.output_format) not in OUTPUT_FORMATS:
+            raise ValueError(f"unknown output format '{options['output_format']}' (available: {', '.join(OUTPUT_FORMATS)})")
+        generator = copy.copy(self)
+        for name, value in options.items():
+            setattr(generator, name, value)
+        return generator
+
+    def _create_variants(self, options_list, contexts=None):
+        """Returns an OutputVariant for each options dict (the generator itself for empty options)."""
+        contexts = contexts or [None] * len(options_list)
+        return [OutputVariant(self.derive(**options) if options else self, context) for options, context in zip(options_list, contexts)]
+
+    def _create_city_model(self):
+        """Creates the core:CityModel element with the project name/description. Returns (root, IfcProject or None)."""
         root = etree.Element(f"{{{NSMAP['core']}}}CityModel", nsmap=NSMAP)
         root.set(f"{{{NSMAP['xsi']}}}schemaLocation", "http://www.opengis.net/citygml/profiles/base/3.0 http://schemas.opengis.net/citygml/profiles/base/3.0/CityGML.xsd")
-        
+
         # cityObjectMember will be created after project metadata so
         # that project name/description become the first child elements
-        
+
         try:
             projects = self.model.by_type("IfcProject")
             ifc_project = projects[0] if projects else None
@@ -845,6 +4088,17 @@ class CityGMLGenerator:
             if proj_name:
                 proj_name_el = etree.SubElement(root, f"{{{NSMAP['gml']}}}name")
                 proj_name_el.text = proj_name
+        return root, ifc_project
+
+    def _iter_variant_fragments(self, variants):
+        """
+        Converts the model and yields the fragments of the CityGML documents of all output variants
+        as (variant index, bytes). The fragments of each variant are yielded in document order.
+        CityJSON, GeoPackage and Parquet variants get their city objects (CityJSONObject or
+        DatabaseFeature, or lists of them) instead; the document around them is written by the
+        CityJSONWriter, the tables by the DatabaseWriter and the ParquetWriter.
+        """
+        root, ifc_project = self._create_city_model()
 
         # Get all IFC buildings and export each as a separate CityGML Building
         try:
@@ -854,698 +4108,1148 @@ class CityGMLGenerator:
 
         if not ifc_buildings:
             print("No IfcBuilding objects found in the model.")
-            tree = etree.ElementTree(root)
-            tree.write(self.output_path, pretty_print=True, xml_declaration=True, encoding="UTF-8")
-            print(f"Successfully wrote {self.output_path}")
+            document = etree.tostring(etree.ElementTree(root), pretty_print=True, xml_declaration=True, encoding="UTF-8")
+            for index, variant in enumerate(variants):
+                if variant.generator.output_format == 'citygml':
+                    yield index, document
+            return
+
+        # Stream the CityModel: start tag and project metadata (and envelope), one cityObjectMember
+        # per building, (shared appearance,) end tag
+        root_start, root_end = serialize_open_close(root, 0, keep_namespaces=True)
+        if self.checkpoint_dir:
+            variants[0].context.checkpoint = Checkpoint(self.checkpoint_dir, self._get_checkpoint_signature(variants), self.resume)
+        executor = self._create_pipeline_executor([variant.generator for variant in variants])
+        try:
+            for index, variant in enumerate(variants):
+                if variant.generator.output_format != 'citygml':
+                    continue
+                if variant.generator.envelopes and variant.partition is None:
+                    yield index, variant.generator._serialize_start_with_envelope(root, CITY_MODEL_ENVELOPE_KEY, 0, keep_namespaces=True, prefix=XML_DECLARATION)
+                else:
+                    yield index, XML_DECLARATION + root_start
+
+            # Iterate over all IfcBuilding objects and export each one
+            for ifc_bldg in ifc_buildings:
+                yield from self._iter_building_fragments(variants, ifc_bldg, ifc_project, executor)
+
+            # Write the shared materials of the whole CityModel (after all city objects)
+            for index, variant in enumerate(variants):
+                if variant.generator.shared_materials != 'citymodel' or variant.generator.output_format != 'citygml':
+                    continue
+                appearance, shared_count = variant.generator._create_shared_appearance(variant.context, "CITYMODEL")
+                if appearance is not None:
+                    app_member = etree.Element(f"{{{NSMAP['core']}}}appearanceMember", nsmap=NSMAP)
+                    app_member.append(appearance)
+                    yield index, serialize_fragment(app_member, 1)
+                    if index == 0:
+                        print(f"Shared materials in the CityModel: {shared_count}")
+
+            for index, variant in enumerate(variants):
+                if variant.generator.output_format == 'citygml':
+                    yield index, root_end
+        except BaseException:
+            # Do not wait for the workers if the conversion failed or was abandoned
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            if executor is not None:
+                executor.shutdown()
+        finally:
+            if variants[0].context.checkpoint is not None:
+                variants[0].context.checkpoint.close()
+
+    def _get_checkpoint_signature(self, variants):
+        """Returns the input file (path, size, modification time) and the options of the outputs (CHECKPOINT_OPTIONS) recorded in a checkpoint."""
+        if not self.input_path:
+            raise ValueError("checkpoints need an input file (not an in-memory model)")
+        status = os.stat(self.input_path)
+        return {"input": {"path": os.path.abspath(self.input_path), "size": status.st_size, "mtime_ns": status.st_mtime_ns},
+                "options": [{name: getattr(variant.generator, name, None) for name in CHECKPOINT_OPTIONS} for variant in variants]}
+
+    def _serialize_start_with_envelope(self, element, key, level, keep_namespaces=False, container=None, prefix=b""):
+        """
+        Returns the start part of an element (see serialize_open_close()) with a gml:boundedBy whose
+        corners are filled in by the writer when the envelope of key is known, as AnnotatedFragment
+        (prefix is prepended, e.g. the XML declaration).
+        """
+        target = element if container is None else container
+        bounded_by = insert_bounded_by(target, key, self.srs_name)
+        try:
+            start, _ = serialize_open_close(element, level, keep_namespaces, container)
+        finally:
+            target.remove(bounded_by)
+        return extract_envelope_placeholders(prefix + start)
+
+    def _print_summary(self, context):
+        """Prints the georeferencing, offsets and geometry statistics of a conversion."""
+        # If georeference override was requested, print the exact coordinates used
+        if getattr(self, 'georef_oktoberfest', False):
+            print(f"Georeference used (EPSG:25832): Easting={self.eastings:.3f}, Northing={self.northings:.3f}, Height={self.orthogonal_height:.3f}")
+        # Print offset information if any offset was applied
+        if self.xoffset != 0.0 or self.yoffset != 0.0 or self.zoffset != 0.0:
+            print(f"Offset applied: X={self.xoffset:.3f}, Y={self.yoffset:.3f}, Z={self.zoffset:.3f}")
+        # Print which geometry kernels produced the element geometries (only if a kernel chain was given)
+        stats = context.stats
+        if self.geometry_kernels != [DEFAULT_GEOMETRY_KERNEL] and stats.kernel_counts:
+            counts = ", ".join(f"{kernel}={count}" for kernel, count in stats.kernel_counts.items())
+            print(f"Geometry kernels used: {counts}")
+        # Print decimation statistics
+        if stats.decimation['elements'] > 0:
+            decimation = stats.decimation
+            print(f"Decimated {decimation['elements']} elements from {decimation['before']} to {decimation['after']} triangles")
+        # Print the tessellation report if mesher tolerances were given
+        if self.linear_deflection is not None or self.angular_deflection is not None or self.adaptive_deflection:
+            self._print_tessellation_report(stats)
+        # Print the effect of the cost-aware scheduling: makespan with the measured job times in the
+        # dispatch order used and in document order
+        schedule = context.schedule
+        if self.workers > 1 and schedule.jobs:
+            saved = round(schedule.makespan_document_order - schedule.makespan, 2) + 0.0
+            print(f"Scheduling: {schedule.jobs} jobs ({schedule.busy_seconds:.2f} s) on {self.workers} workers, makespan {schedule.makespan:.2f} s "
+                  f"(document order: {schedule.makespan_document_order:.2f} s, tail latency saved: {saved:.2f} s)")
+
+    def _iter_building_fragments(self, variants, ifc_bldg, ifc_project, executor):
+        """Converts one IfcBuilding and yields it as core:cityObjectMember in fragments, as (variant index, bytes)."""
+        b_name = getattr(ifc_bldg, 'Name', None)
+        print(f"\nConverting building: {b_name or 'Unnamed'}")
+
+        summary = {}
+        items = self._plan_building(variants, ifc_bldg, summary)
+        if self.element_filter is not None and not any(isinstance(item, FeatureJob) for item in items):
+            print("No selected elements in this building, skipped")
             return
 
-        # Mapping of IFC types to CityGML 3.0 Building classes
-        # Format: "IfcType": ("CityGML_Class", "ifc_type_for_class")
-        target_elements = {
-            # BuildingConstructiveElement types
-            "IfcWall": ("BuildingConstructiveElement", "Wall"),
-            "IfcWallStandardCase": ("BuildingConstructiveElement", "Wall"),
-            "IfcRoof": ("BuildingConstructiveElement", "Roof"),
-            "IfcSlab": ("BuildingConstructiveElement", "Slab"),
-            "IfcColumn": ("BuildingConstructiveElement", "Column"),
-            "IfcBeam": ("BuildingConstructiveElement", "Beam"),
-            "IfcMember": ("BuildingConstructiveElement", "Member"),
-            "IfcPlate": ("BuildingConstructiveElement", "Plate"),
-            "IfcStair": ("BuildingConstructiveElement", "Stair"),
-            "IfcStairFlight": ("BuildingConstructiveElement", "StairFlight"),
-            "IfcRamp": ("BuildingConstructiveElement", "Ramp"),
-            "IfcRampFlight": ("BuildingConstructiveElement", "RampFlight"),
-            "IfcFooting": ("BuildingConstructiveElement", "Footing"),
-            "IfcPile": ("BuildingConstructiveElement", "Pile"),
-            "IfcBuildingElementProxy": ("BuildingConstructiveElement", "BuildingElementProxy"),
-            "IfcCurtainWall": ("BuildingConstructiveElement", "CurtainWall"),
-            # BuildingInstallation types
-            "IfcCovering": ("BuildingInstallation", "Covering"),
-            "IfcRailing": ("BuildingInstallation", "Railing"),
-            # BuildingFurniture types
-            "IfcFurnishingElement": ("BuildingFurniture", "FurnishingElement"),
-            "IfcFurniture": ("BuildingFurniture", "Furniture"),
-            "IfcSystemFurnitureElement": ("BuildingFurniture", "SystemFurnitureElement"),
-            # Door and Window are handled as child elements of walls
-            "IfcDoor": ("Door", "Door"),
-            "IfcWindow": ("Window", "Window")
-        }
+        members = []
+        storey_members = None
+        for variant in variants:
+            # Reset exported elements tracking for each building
+            variant.context.building_count += 1
+            variant.context.exported_elements = set()
+            # Per-building state updated while merging the pipeline results:
+            # number of appearances/materials, dummy BCE gml:id per storey (for xlinks from Storey elements),
+            # envelope of the features
+            variant.building_state = {'appearance_count': 0, 'dummy_bce_per_storey': {}, 'envelope': None}
+            if variant.generator.output_format != 'citygml':
+                # CityJSON, GeoPackage, Parquet and glTF: the Building object is written after its
+                # children, which get the Building and their BuildingStoreys (ids assigned here) as parents
+                if variant.generator.output_format in DATABASE_OUTPUT_FORMATS:
+                    building = variant.generator._create_database_building(ifc_bldg, ifc_project)
+                else:
+                    building = variant.generator._create_cityjson_building(ifc_bldg, ifc_project)
+                if storey_members is None:
+                    storey_members = [(storey, self._get_storey_elements(storey)) for storey in self._get_building_storeys(summary['building_elements'])]
+                storeys = [] if variant.generator.no_storeys else [(storey, f"UUID_{uuid.uuid4()}") for storey, _ in storey_members]
+                # BuildingStorey ids per STEP id of the elements (and per GlobalId of the storeys for the dummy elements)
+                object_storeys = {}
+                for (storey, elements), (_, object_id) in zip(storey_members, storeys):
+                    object_storeys.setdefault(getattr(storey, 'GlobalId', None), []).append(object_id)
+                    for element in elements:
+                        object_storeys.setdefault(element.id(), []).append(object_id)
+                variant.building_state.update(building_id=building.object_id, storeys=storeys, object_storeys=object_storeys)
+                members.append((None, building))
+                continue
+            members.append(variant.generator._create_building_member(ifc_bldg, ifc_project))
+
+        # The shared appearance precedes the features in the Building but is only known after
+        # converting them: spool the features of such variants to a temporary file and yield the
+        # Building afterwards (the envelope of the Building is filled in by the writer otherwise)
+        spooled_features = [[] for _ in variants]
+        with contextlib.ExitStack() as stack:
+            for index, variant in enumerate(variants):
+                member, building = members[index]
+                variant.spool = None
+                if variant.partition is not None:
+                    # Split output: the partition spools the features (and shared materials) per file
+                    variant.partition.start_building(self, ifc_bldg, member, building)
+                elif member is None:
+                    continue
+                elif variant.generator.shared_materials == 'building':
+                    variant.spool = stack.enter_context(tempfile.TemporaryFile())
+                elif variant.generator.envelopes:
+                    yield index, variant.generator._serialize_start_with_envelope(member, building.get(f"{{{NSMAP['gml']}}}id"), 1, container=building)
+                else:
+                    yield index, serialize_open_close(member, 1, container=building)[0]
+
+            for index, fragment in self._run_pipeline(variants, items, executor):
+                spool = variants[index].spool
+                if isinstance(fragment, (CityJSONObject, DatabaseFeature)):
+                    state = variants[index].building_state
+                    key = fragment.step_id if fragment.step_id is not None else fragment.storey_key
+                    fragment.parents = [state['building_id']] + state['object_storeys'].get(key, [])
+                    yield index, fragment
+                elif spool is not None:
+                    spool.write(fragment)
+                    # (the spool is read back per feature to keep the features of the spatial index)
+                    if variants[index].generator.spatial_index:
+                        spooled_features[index].append((len(fragment), getattr(fragment, 'feature', None)))
+                else:
+                    yield index, fragment
+
+            for index, variant in enumerate(variants):
+                member, building = members[index]
+                building_id = building.get(f"{{{NSMAP['gml']}}}id") if member is not None else building.object_id
+                envelope = variant.building_state['envelope']
+                if envelope is not None:
+                    variant.context.envelopes[building_id] = envelope
+                    variant.context.envelopes[CITY_MODEL_ENVELOPE_KEY] = merge_envelopes(variant.context.envelopes.get(CITY_MODEL_ENVELOPE_KEY), envelope)
+                shared_count = 0
+                if variant.partition is not None:
+                    variant.partition.end_building()
+                elif member is None:
+                    # (completes the CityJSONFeature of the building)
+                    if variant.generator.envelopes and envelope is not None and isinstance(building, CityJSONObject):
+                        building.city_object["geographicalExtent"] = [round(c, 3) for c in envelope]
+                    yield index, building
+                elif variant.spool is not None:
+                    shared_count = variant.generator._insert_building_appearance(variant.context, building)
+                    if variant.generator.envelopes and envelope is not None:
+                        insert_bounded_by(building, envelope, variant.generator.srs_name)
+                    member_start, member_end = serialize_open_close(member, 1, container=building)
+                    yield index, member_start
+                    variant.spool.seek(0)
+                    if spooled_features[index]:
+                        for length, feature in spooled_features[index]:
+                            yield index, AnnotatedFragment.create(variant.spool.read(length), feature=feature)
+                    else:
+                        for data in iter(lambda: variant.spool.read(1 << 20), b""):
+                            yield index, data
+                    yield index, member_end
+                    variant.spool = None
+                else:
+                    yield index, serialize_open_close(member, 1, container=building)[1]
+
+                # Print appearance count for this building (of the first output)
+                if index > 0:
+                    continue
+                building_appearance_count = variant.building_state['appearance_count']
+                if not getattr(variant.generator, 'no_storeys', False):
+                    if building_appearance_count > 0 and not variant.generator.shared_materials:
+                        print(f"Total materials/appearances in this building: {building_appearance_count}")
+                if variant.generator.shared_materials == 'building' and shared_count > 0:
+                    print(f"Shared materials in this building: {shared_count} (used {building_appearance_count} times)")
+
+    def inventory(self, workers=None):
+        """
+        Dry run: determines the elements that would be converted (after the element filter) and
+        their cost signals (see get_cost_signals()) per building and storey without tessellating
+        them, and estimates the runtime and output size with COST_MODEL. The runtime estimate for
+        workers (default: self.workers) is bounded by the most expensive element.
+        Returns a dict that can be serialized as JSON.
+        """
+        workers = workers or self.workers
+        variants = [OutputVariant(self)]
+        try:
+            ifc_buildings = self.model.by_type("IfcBuilding")
+        except RuntimeError:
+            ifc_buildings = []
+
+        def new_summary():
+            return {"element_count": 0, "types": {}, "representation_types": {}, "mapped_items": 0, "openings": 0, "faces": 0, "estimate": {"seconds": 0.0, "output_bytes": 0}}
+
+        def add(summary, ifc_type, signals, cost):
+            summary["element_count"] += 1
+            summary["types"][ifc_type] = summary["types"].get(ifc_type, 0) + 1
+            for rtype in signals.representation_types:
+                summary["representation_types"][rtype] = summary["representation_types"].get(rtype, 0) + 1
+            summary["mapped_items"] += signals.mapped_items
+            summary["openings"] += signals.openings
+            summary["faces"] += signals.faces
+            summary["estimate"]["seconds"] += cost[0]
+            summary["estimate"]["output_bytes"] += cost[1]
+
+        totals = new_summary()
+        buildings = []
+        job_costs = []
+        for ifc_bldg in ifc_buildings:
+            plan_summary = {}
+            jobs = [item for item in self._plan_building(variants, ifc_bldg, plan_summary) if isinstance(item, FeatureJob)]
+            if self.element_filter is not None and not jobs:
+                continue
+            building = dict(name=getattr(ifc_bldg, 'Name', None), ifc_guid=getattr(ifc_bldg, 'GlobalId', None), **new_summary())
+
+            # Storey of each element (first storey it belongs to, as for the split by storey)
+            building_elements = set(ifcopenshell.util.element.get_decomposition(ifc_bldg))
+            storeys = [s for s in self.model.by_type("IfcBuildingStorey") if s in building_elements]
+            storey_summaries = []
+            storey_of = {}
+            for storey in storeys:
+                storey_summaries.append(dict(name=getattr(storey, 'Name', None), ifc_guid=getattr(storey, 'GlobalId', None), **new_summary()))
+                for element in self._get_storey_elements(storey):
+                    storey_of.setdefault(element.id(), storey_summaries[-1])
+            storey_guids = {summary["ifc_guid"]: summary for summary in storey_summaries}
+            no_storey = dict(name=None, ifc_guid=None, **new_summary())
+
+            for job in jobs:
+                job_cost = [0.0, 0]
+                elements = [(self.model.by_id(job.step_id), job.ifc_type)] if job.step_id is not None else []
+                elements += [(self.model.by_id(dw_id), None) for dw_id in job.fillings]
+                for element, ifc_type in elements:
+                    signals = self.get_cost_signals(element)
+                    cost = signals.estimate()
+                    job_cost[0] += cost[0]
+                    job_cost[1] += cost[1]
+                    ifc_type = ifc_type or element.is_a()
+                    if job.kind == 'dummy':
+                        storey_summary = storey_guids.get(job.storey_key, no_storey)
+                    else:
+                        storey_summary = storey_of.get(element.id(), storey_of.get(job.step_id, no_storey))
+                    for summary in (totals, building, storey_summary):
+                        add(summary, ifc_type, signals, cost)
+                if job.kind == 'dummy':
+                    for summary in (totals, building):
+                        summary["estimate"]["output_bytes"] += COST_MODEL['element'][1]
+                job_costs.append((job_cost[0], job.step_id if job.step_id is not None else (job.fillings[0] if job.fillings else None)))
+
+            doors_windows = plan_summary.get('doors_windows', [])
+            unmapped = plan_summary.get('unmapped', [])
+            building["doors_windows"] = {"total": len(doors_windows), "fillings": len(doors_windows) - len(unmapped), "unmapped": len(unmapped),
+                                         "unmapped_elements": [{"ifc_guid": dw.GlobalId, "class": dw.is_a(), "name": getattr(dw, 'Name', None)} for dw in unmapped]}
+            building["storeys"] = storey_summaries + ([no_storey] if no_storey["element_count"] else [])
+            buildings.append(building)
+
+        # Runtime: start-up and reading, then the features distributed over the workers
+        # (at least as long as the most expensive feature)
+        file_size = os.path.getsize(self.input_path) if self.input_path and os.path.exists(self.input_path) else None
+        startup = COST_MODEL['startup'][0] + COST_MODEL['model_per_mb'][0] * (file_size or 0) / 1e6
+        longest = max(job_costs, default=(0.0, None), key=lambda item: item[0])
+        conversion = max(totals["estimate"]["seconds"] / workers, longest[0])
+        estimate = {"workers": workers, "seconds": round(startup + conversion, 1), "seconds_single_worker": round(startup + totals["estimate"]["seconds"], 1), "output_bytes": int(totals["estimate"]["output_bytes"])}
+        if longest[1] is not None:
+            element = self.model.by_id(longest[1])
+            estimate["most_expensive_element"] = {"ifc_guid": getattr(element, 'GlobalId', None), "class": element.is_a(), "seconds": round(longest[0], 3)}
+
+        for summary in [totals] + buildings + [storey for building in buildings for storey in building["storeys"]]:
+            summary["estimate"] = {"seconds": round(summary["estimate"]["seconds"], 2), "output_bytes": int(summary["estimate"]["output_bytes"])}
+        try:
+            total_mapped_items = len(self.model.by_type("IfcMappedItem"))
+        except RuntimeError:
+            total_mapped_items = 0
+        return {"source": self.filename, "schema": self.model.schema, "file_size": file_size, "mapped_item_instances": total_mapped_items,
+                "buildings": buildings, "totals": totals, "estimate": estimate}
+
+    def _create_building_member(self, ifc_bldg, ifc_project):
+        """Creates the core:cityObjectMember with the bldg:Building of an IfcBuilding (metadata only). Returns (member, building)."""
+        member = etree.Element(f"{{{NSMAP['core']}}}cityObjectMember", nsmap=NSMAP)
+        building = etree.SubElement(member, f"{{{NSMAP['bldg']}}}Building", attrib={f"{{{NSMAP['gml']}}}id": f"UUID_{uuid.uuid4()}"})
+
+        # Building metadata: name/description and property sets
+        b_desc = getattr(ifc_bldg, 'Description', None)
+        b_name = getattr(ifc_bldg, 'Name', None)
+        if b_desc:
+            desc_el = etree.SubElement(building, f"{{{NSMAP['gml']}}}description")
+            desc_el.text = b_desc
+        if b_name:
+            name_el = etree.SubElement(building, f"{{{NSMAP['gml']}}}name")
+            name_el.text = b_name
+
+        # External reference using IfcBuilding.GlobalId
+        ext_guid = getattr(ifc_bldg, 'GlobalId', None)
+        if not ext_guid:
+            ext_guid = getattr(ifc_project, 'GlobalId', "UNKNOWN") if ifc_project else "UNKNOWN"
+        self.create_external_reference(building, ext_guid)
+
+        # Add building properties
+        try:
+            self.add_properties(building, ifc_bldg)
+        except Exception:
+            pass
+        return member, building
+
+    def _plan_building(self, variants, ifc_bldg, summary=None):
+        """
+        Selects the elements of a building and returns the items for _run_pipeline() in output order:
+        FeatureJobs, progress messages (str) and callables (e.g. the Storey export), which are called
+        with the output variants and return a fragment per variant (or None).
+        If a summary dict is given, the doors/windows of the building ('doors_windows') and those
+        that could not be assigned to an element ('unmapped') are stored in it.
+        CityGML 3.0 requires: buildingConstructiveElement -> buildingInstallation -> buildingRoom -> buildingFurniture -> buildingSubdivision
+        """
+        items = []
+        element_filter = self.element_filter
+
+        # Get elements that belong to this building via decomposition
+        building_elements = set(ifcopenshell.util.element.get_decomposition(ifc_bldg))
+
+        # Get all IfcSpace objects that belong to this building
+        try:
+            all_spaces = self.model.by_type("IfcSpace")
+        except RuntimeError:
+            all_spaces = []
+        rooms_list = [s for s in all_spaces if s in building_elements]
+
+        def elements_of_type(ifc_type):
+            # Use exact type matching (not inheritance) to avoid duplicates
+            # and filter elements to only those belonging to this building
+            try:
+                elements = self.model.by_type(ifc_type)
+            except RuntimeError:
+                elements = []
+            return [e for e in elements if e in building_elements and e.is_a() == ifc_type]
+
+        def add_jobs(kind, ifc_type, elements, embedded_doors_windows=None):
+            if element_filter is not None:
+                if embedded_doors_windows is not None:
+                    # The doors/windows of elements that are not selected are left out (not unmapped)
+                    for elem in elements:
+                        if not element_filter.accepts(elem):
+                            deselected_doors_windows.update(self.get_doors_and_windows_in_element(elem))
+                elements = [elem for elem in elements if element_filter.accepts(elem)]
+            if elements:
+                items.append(f"{ifc_type}: ")
+            for elem in elements:
+                fillings = []
+                if embedded_doors_windows is not None:
+                    # Find doors/windows to be added as child elements using con:filling
+                    fillings = self.get_doors_and_windows_in_element(elem)
+                    if element_filter is not None:
+                        deselected_doors_windows.update(dw for dw in fillings if not element_filter.accepts_filling(dw))
+                        fillings = [dw for dw in fillings if element_filter.accepts_filling(dw)]
+                    embedded_doors_windows.update(fillings)
+                items.append(FeatureJob(kind, ifc_type, elem.id(), [dw.id() for dw in fillings]))
+            if elements:
+                items.append("\n")
+
+        # Track which doors and windows are embedded in constructive elements for THIS building
+        # (and which are left out with the filling element by the element filter)
+        embedded_doors_windows = set()
+        deselected_doors_windows = set()
+
+        # --- Walls with embedded Doors and Windows ---
+        for wall_type in ["IfcWall", "IfcWallStandardCase"]:
+            add_jobs('wall', wall_type, elements_of_type(wall_type), embedded_doors_windows)
+
+        # --- Remaining BuildingConstructiveElement types (excluding walls) ---
+        constructive_types = [
+            "IfcRoof", "IfcSlab", "IfcColumn", "IfcBeam", "IfcMember", "IfcPlate",
+            "IfcStair", "IfcStairFlight", "IfcRamp", "IfcRampFlight",
+            "IfcFooting", "IfcPile", "IfcBuildingElementProxy", "IfcCurtainWall"
+        ]
+        for ifc_type in constructive_types:
+            add_jobs('constructive', ifc_type, elements_of_type(ifc_type), embedded_doors_windows)
+
+        # --- Check for non-exported doors and windows for THIS building ---
+        building_doors_windows = [e for e in self.model.by_type("IfcDoor") if e in building_elements]
+        building_doors_windows += [e for e in self.model.by_type("IfcWindow") if e in building_elements]
+        if element_filter is not None:
+            # Doors/windows without filling element count if they are selected themselves
+            building_doors_windows = [dw for dw in building_doors_windows if dw in embedded_doors_windows
+                                      or (dw not in deselected_doors_windows and element_filter.accepts(dw))]
+        total_doors_windows = len(building_doors_windows)
+        exported_count = len(embedded_doors_windows)
+        unmapped_count = total_doors_windows - exported_count
+        if summary is not None:
+            summary['building_elements'] = building_elements
+            summary['doors_windows'] = building_doors_windows
+            summary['unmapped'] = [dw for dw in building_doors_windows if dw not in embedded_doors_windows]
+
+        if total_doors_windows > 0:
+            items.append(f"\nDoors and Windows: {exported_count} of {total_doors_windows} exported as con:filling\n")
+            if unmapped_count > 0:
+                items.append(f"  Warning: {unmapped_count} doors/windows could not be assigned to a BuildingConstructiveElement\n")
+                if not getattr(self, 'list_unmapped_doors_windows', False) and not getattr(self, 'unrelated_doors_windows_in_dummy_bce', False):
+                    items.append("  Use option '--list-unmapped-doors-and-windows' to see details, or\n"
+                                 "  use option '--unrelated-doors-and-windows-in-dummy-bce' to create empty\n"
+                                 "  BuildingConstructiveElements grouped by storey.\n")
+
+                unmapped = [dw for dw in building_doors_windows if dw not in embedded_doors_windows]
+                if getattr(self, 'list_unmapped_doors_windows', False):
+                    # List the unmapped doors and windows for this building
+                    items.append(lambda variants: self._list_unmapped_doors_windows(unmapped))
+
+                # If option is set, create dummy BuildingConstructiveElements for unmapped doors/windows
+                if getattr(self, 'unrelated_doors_windows_in_dummy_bce', False) and unmapped:
+                    items.append("\nCreating dummy BuildingConstructiveElements for unrelated doors/windows...\n")
+                    items.extend(self._plan_dummy_bces(unmapped))
+            items.append("\n")
+
+        # --- BuildingInstallation types ---
+        for ifc_type in ["IfcCovering", "IfcRailing"]:
+            add_jobs('installation', ifc_type, elements_of_type(ifc_type))
+
+        # Export IfcSpace rooms BEFORE BuildingFurniture for schema validation
+        add_jobs('room', "IfcSpace", rooms_list)
+
+        # --- BuildingFurniture types (after BuildingRoom for schema validation) ---
+        for ifc_type in ["IfcFurniture", "IfcSystemFurnitureElement", "IfcFurnishingElement"]:
+            add_jobs('furniture', ifc_type, elements_of_type(ifc_type))
+
+        # Export IfcBuildingStorey features with xlinks to rooms and constructive elements
+        # (after all other features: the xlinks need their gml:ids and export state)
+        # Skip if --no-storeys option is set (for all outputs)
+        if not all(getattr(variant.generator, 'no_storeys', False) for variant in variants):
+            items.append(lambda variants: self._create_variant_storey_fragments(variants, building_elements, rooms_list))
+
+        return items
+
+    def _plan_dummy_bces(self, unmapped):
+        """Returns the pipeline items for the dummy BuildingConstructiveElements of unmapped doors/windows (grouped by storey)."""
+        items = []
+        # Group unmapped doors/windows by storey
+        doors_windows_by_storey = {}
+        unmapped_without_storey = []
+        for dw in unmapped:
+            # Find which storey this door/window belongs to
+            storey = self._find_storey_for_element(dw)
+            if storey:
+                storey_guid = getattr(storey, 'GlobalId', None)
+                if storey_guid:
+                    if storey_guid not in doors_windows_by_storey:
+                        doors_windows_by_storey[storey_guid] = {'storey': storey, 'elements': []}
+                    doors_windows_by_storey[storey_guid]['elements'].append(dw)
+            else:
+                unmapped_without_storey.append(dw)
+
+        # Create dummy BCE for each storey with unmapped elements
+        for storey_guid, data in doors_windows_by_storey.items():
+            storey_name = getattr(data['storey'], 'Name', 'Unnamed Storey')
+            items.append(f"  Creating dummy BCE for storey '{storey_name}': ")
+            items.append(FeatureJob('dummy', "DummyBuildingConstructiveElement", fillings=[dw.id() for dw in data['elements']],
+                                    name=f"Stub Element for unrelated Doors and Windows - Storey: {storey_name}", storey_key=storey_guid))
+            items.append("\n")
+
+        # Create fallback dummy BCE for elements not associated with any storey
+        if unmapped_without_storey:
+            items.append("  Creating fallback dummy BCE for elements without storey: ")
+            items.append(FeatureJob('dummy', "DummyBuildingConstructiveElement", fillings=[dw.id() for dw in unmapped_without_storey],
+                                    name="Stub Element for unrelated Doors and Windows - No Storey Assignment", storey_key='__UNMAPPED__'))
+            items.append("\n")
+        return items
+
+    def _create_pipeline_executor(self, encoders):
+        """
+        Creates the executor that converts the FeatureJobs: worker processes (forked, so they share the
+        opened model) if more than one worker is requested, threads on platforms without fork.
+        encoders are the generators of the output variants (see _convert_job()).
+        Returns None for a single worker: the kernel calls hold the GIL, so a conversion thread
+        would not overlap with the main thread, and the jobs are converted in the main thread.
+        """
+        if self.workers == 1:
+            return None
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except ValueError:
+            return ThreadPoolExecutor(max_workers=self.workers)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_pipeline_worker, initargs=(self, encoders))
+
+    def _run_pipeline(self, variants, items, executor):
+        """
+        Runs the conversion pipeline for the items of _plan_building():
+        element selection -> [tessellation -> appearance/properties/XML fragment] (executor) -> sink (writer).
+        Each FeatureJob is converted independently to a serialized fragment by the workers (see
+        _convert_job()); jobs are submitted ahead of time (bounded by PIPELINE_JOBS_PER_WORKER per
+        worker) while earlier fragments are written, so kernel calls, encoding and I/O overlap.
+        With several workers the jobs are dispatched cost-aware: of the jobs within the look-ahead
+        window (PIPELINE_SCHEDULE_WINDOW per worker) the most expensive one is submitted first (see
+        _get_job_cost()), so a large Brep or clipped element does not end up as the tail of a building.
+        The workers take the next submitted job as soon as they are idle.
+        The calling thread only merges the bookkeeping into the contexts and yields the fragments in
+        item order as (variant index, bytes), each job is tessellated once and encoded for every
+        output variant. Messages (str) are printed in order, callables run after all preceding items
+        are done and may return a list with the bytes to be yielded per variant.
+        The measured job durations are recorded in the ScheduleStats of the first variant.
+        With a checkpoint (see Checkpoint), the results of the jobs converted by a previous run are
+        replayed from it and the results of the converted jobs are added to it.
+        """
+        encoders = [variant.generator for variant in variants]
+        schedule = variants[0].context.schedule
+        checkpoint = variants[0].context.checkpoint
+        max_in_flight = PIPELINE_JOBS_PER_WORKER * self.workers
+        window = PIPELINE_SCHEDULE_WINDOW * self.workers if executor is not None else max_in_flight
+        # Items in document order as [item, future, dispatch index]; jobs waiting for dispatch as
+        # (-cost, item index, entry) (in document order without executor)
+        pending = deque()
+        waiting = []
+        # Durations and dispatch indices of the jobs of the current segment (up to the next callable) in document order
+        segment = {'durations': [], 'dispatch': [], 'count': 0}
+        in_flight = 0
+
+        def submit(job):
+            if executor is None:
+                future = Future()
+                future.set_result(self._convert_job(job, encoders))
+                return future
+            if isinstance(executor, ProcessPoolExecutor):
+                return executor.submit(_convert_in_worker, job)
+            return executor.submit(self._convert_job, job, encoders)
+
+        def dispatch(entry):
+            nonlocal in_flight
+            entry[1] = submit(entry[0])
+            entry[2] = segment['count']
+            segment['count'] += 1
+            in_flight += 1
+
+        def dispatch_waiting():
+            while waiting and in_flight < max_in_flight:
+                entry = heapq.heappop(waiting)[2]
+                if entry[1] is None:
+                    dispatch(entry)
+
+        def finish_next():
+            nonlocal in_flight
+            entry = pending.popleft()
+            item = entry[0]
+            if not isinstance(item, FeatureJob):
+                print(item, end="", flush=True)
+                return []
+            if entry[1] is None:
+                # The next job in document order is needed before the more expensive ones are done
+                dispatch(entry)
+            results = entry[1].result()
+            if entry[2] is not None:
+                # (not replayed from the checkpoint)
+                in_flight -= 1
+                dispatch_waiting()
+                segment['durations'].append(results[0].seconds)
+                segment['dispatch'].append(entry[2])
+                if checkpoint is not None:
+                    checkpoint.add(item, results)
+            for variant, result in zip(variants, results):
+                if variant.partition is not None:
+                    variant.partition.add_feature(self, item, result)
+                    result.fragment = None
+                elif variant.generator.spatial_index and result.envelope is not None and variant.generator.output_format == 'citygml':
+                    result.fragment = AnnotatedFragment.create(result.fragment, feature=(result.gml_id, result.envelope))
+                variant.generator._merge_result(variant.context, item, result, variant.building_state)
+            schedule.timings[self._get_timing_key(item)] = round(results[0].seconds, 4)
+            print(results[0].progress, end="", flush=True)
+            return [(index, result.fragment) for index, result in enumerate(results) if result.fragment]
+
+        def finish_all():
+            dispatch_waiting()
+            while pending:
+                yield from finish_next()
+            waiting.clear()
+            if segment['durations']:
+                order = sorted(range(len(segment['dispatch'])), key=segment['dispatch'].__getitem__)
+                schedule.add_segment(segment['durations'], order, self.workers)
+            segment.update(durations=[], dispatch=[], count=0)
+
+        for item_index, item in enumerate(items):
+            if isinstance(item, FeatureJob):
+                entry = [item, None, None]
+                pending.append(entry)
+                restored = checkpoint.restore(item) if checkpoint is not None else None
+                if restored is not None:
+                    entry[1] = Future()
+                    entry[1].set_result(restored)
+                else:
+                    cost = self._get_job_cost(item) if executor is not None else 0.0
+                    heapq.heappush(waiting, (-cost, item_index, entry))
+            elif isinstance(item, str):
+                pending.append([item, None, None])
+            else:
+                yield from finish_all()
+                data = item(variants)
+                if data:
+                    yield from ((index, fragment) for index, fragment in enumerate(data) if fragment)
+            # Dispatch once the look-ahead window is full, so the expensive jobs in it go first
+            if len(pending) >= window:
+                dispatch_waiting()
+            while len(pending) > window:
+                yield from finish_next()
+        yield from finish_all()
+
+    def _get_timing_key(self, job):
+        """Returns the key of a FeatureJob in the conversion times (GlobalId of the element or of the storey of a dummy element)."""
+        if job.step_id is None:
+            return f"dummy:{job.storey_key}"
+        return getattr(self.model.by_id(job.step_id), 'GlobalId', None) or f"#{job.step_id}"
+
+    def _get_job_cost(self, job):
+        """
+        Returns the expected conversion time of a FeatureJob in seconds: the time measured in a previous
+        run (see timings_path) or the estimate of the cost model for the element and its fillings.
+        """
+        seconds = self.historical_timings.get(self._get_timing_key(job))
+        if seconds is not None:
+            return seconds
+        step_ids = ([job.step_id] if job.step_id is not None else []) + job.fillings
+        return sum(self.get_cost_signals(self.model.by_id(step_id)).estimate()[0] for step_id in step_ids)
+
+    def _convert_job(self, job, encoders):
+        """
+        Converts a FeatureJob: tessellation stage, then encoding stage for each output variant (encoders
+        are the generators of the variants). Returns the FeatureResults in the order of the encoders.
+        """
+        start = time.perf_counter()
+        records, stats = self._tessellate_job(job)
+        results = [encoder._encode_job(job, records, stats) for encoder in encoders]
+        for result in results:
+            result.seconds = time.perf_counter() - start
+        return results
+
+    def _tessellate_job(self, job):
+        """
+        Tessellation stage: creates the GeometryRecords of the element of a job and of its fillings.
+        Returns ({STEP id: GeometryRecord or None}, TessellationStats).
+        """
+        stats = TessellationStats()
+        records = {}
+        step_ids = ([job.step_id] if job.step_id is not None else []) + job.fillings
+        for step_id in step_ids:
+            records[step_id] = self.get_geometry_with_surface_ids(self.model.by_id(step_id), stats)
+        return records, stats
+
+    def _encode_job(self, job, records, stats):
+        """
+        Encoding stage: creates the CityGML feature of a job (metadata, appearance, generic attributes,
+        geometry, fillings, class) from the GeometryRecords and serializes it as XML fragment.
+        The geometries are template-encoded into the serialized fragment. Returns a FeatureResult.
+        """
+        if self.output_format in DATABASE_OUTPUT_FORMATS:
+            return self._encode_database_job(job, records, stats)
+        if self.output_format != 'citygml':
+            return self._encode_cityjson_job(job, records, stats)
+        result = FeatureResult(stats)
+        deferred_geometries = []
+        property_name, feature_name = {
+            'wall': ("buildingConstructiveElement", "BuildingConstructiveElement"),
+            'constructive': ("buildingConstructiveElement", "BuildingConstructiveElement"),
+            'dummy': ("buildingConstructiveElement", "BuildingConstructiveElement"),
+            'installation': ("buildingInstallation", "BuildingInstallation"),
+            'room': ("buildingRoom", "BuildingRoom"),
+            'furniture': ("buildingFurniture", "BuildingFurniture"),
+        }[job.kind]
+        feature_prop = etree.Element(f"{{{NSMAP['bldg']}}}{property_name}", nsmap=NSMAP)
+        gml_id = f"UUID_{uuid.uuid4()}"
+        feature = etree.SubElement(feature_prop, f"{{{NSMAP['bldg']}}}{feature_name}", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
+        result.gml_id = gml_id
+
+        if job.kind == 'dummy':
+            # Add name indicating which storey this belongs to
+            name_elem = etree.SubElement(feature, f"{{{NSMAP['gml']}}}name")
+            name_elem.text = job.name
+        else:
+            elem = self.model.by_id(job.step_id)
+
+            # Add metadata
+            if getattr(elem, 'Description', None):
+                desc_elem = etree.SubElement(feature, f"{{{NSMAP['gml']}}}description")
+                desc_elem.text = elem.Description
+            if getattr(elem, 'Name', None):
+                name_elem = etree.SubElement(feature, f"{{{NSMAP['gml']}}}name")
+                name_elem.text = elem.Name
+
+            self.create_external_reference(feature, getattr(elem, 'GlobalId', 'UNKNOWN'))
+
+            # Geometry record (surface IDs and per-face materials for multi-appearance support)
+            is_solid = self.is_intended_solid(elem)
+            record = records.get(job.step_id)
+            geometry_id = f"UUID_{uuid.uuid4()}" if record else None
+
+            # Add appearance if element has color information (before generic attributes)
+            # Pass the geometry record to enable multi-appearance targeting
+            if geometry_id:
+                success, mat_count = self.add_appearance(feature, elem, gml_id, geometry_id, record, result.shared_material_targets)
+                if success:
+                    result.material_count += mat_count
+
+            # Add generic attributes (after appearance)
+            self.add_properties(feature, elem)
+
+            # Output geometry (after generic attributes)
+            if record:
+                self._add_lod3_geometry(feature, record, geometry_id, is_solid, deferred_geometries)
+                # Mark element as successfully exported
+                result.exported = True
+                if job.kind != 'wall':
+                    result.progress += "."
+
+        # Add doors/windows as child elements using con:filling
+        # (must come before bldg:class for schema validation)
+        for dw_id in job.fillings:
+            dw = self.model.by_id(dw_id)
+            result.material_count += self._add_door_or_window_as_filling(feature, dw, records.get(dw_id), result.shared_material_targets, deferred_geometries)
+            # Output D for Door or W for Window
+            result.progress += "D" if dw.is_a("IfcDoor") else "W"
+
+        # Add class (must come after con:filling)
+        class_elem = etree.SubElement(feature, f"{{{NSMAP['bldg']}}}class")
+        class_elem.text = job.ifc_type
+
+        if job.kind == 'wall':
+            result.progress += "."
+
+        # Walls and dummy elements are kept without geometry, all other features are dropped
+        if result.exported or job.kind in ('wall', 'dummy'):
+            # Envelope of the feature incl. its fillings (from the vertex arrays of the records)
+            result.envelope = get_records_envelope(records)
+            if result.envelope is not None and self.envelopes:
+                insert_bounded_by(feature, result.envelope, self.srs_name)
+            fragment = serialize_fragment(feature_prop, FEATURE_PROPERTY_LEVEL)
+            result.fragment = expand_geometry_placeholders(fragment, deferred_geometries, self.srs_name)
+        return result
+
+    def _encode_cityjson_job(self, job, records, stats):
+        """
+        Encoding stage of the CityJSON output: creates the city object of a job (attributes, LoD 3
+        geometry, doors/windows as an additional MultiSurface with Door/Window semantic surfaces) from the
+        GeometryRecords. Returns a FeatureResult with a CityJSONObject as fragment.
+        """
+        result = FeatureResult(stats)
+        result.gml_id = f"UUID_{uuid.uuid4()}"
+        city_object = CityJSONObject(result.gml_id, CITYJSON_OBJECT_TYPES[job.kind], job.step_id, job.storey_key)
+        attributes = city_object.city_object["attributes"]
+        translate = self._get_cityjson_translate()
+        materials = None if self.no_appearances else city_object.materials
+
+        if job.kind == 'dummy':
+            attributes["name"] = job.name
+        else:
+            elem = self.model.by_id(job.step_id)
+            attributes.update(self._get_cityjson_attributes(elem))
+            record = records.get(job.step_id)
+            geometry = encode_cityjson_geometry("Solid" if self.is_intended_solid(elem) else "MultiSurface", [record], translate, materials) if record else None
+            if geometry is not None:
+                city_object.geometries.append(geometry)
+                result.exported = True
+                if job.kind != 'wall':
+                    result.progress += "."
+
+        # Doors/windows: the surfaces of all fillings in one MultiSurface, a semantic surface per door/window
+        filling_records, surfaces = [], []
+        for dw_id in job.fillings:
+            dw = self.model.by_id(dw_id)
+            if records.get(dw_id):
+                filling_records.append(records[dw_id])
+                surfaces.append({"type": "Door" if dw.is_a("IfcDoor") else "Window", **self._get_cityjson_attributes(dw, flat=True)})
+            # Output D for Door or W for Window
+            result.progress += "D" if dw.is_a("IfcDoor") else "W"
+        if filling_records:
+            geometry = encode_cityjson_geometry("MultiSurface", filling_records, translate, materials, surfaces)
+            if geometry is not None:
+                city_object.geometries.append(geometry)
+
+        attributes["class"] = job.ifc_type
+        if job.kind == 'wall':
+            result.progress += "."
+
+        # Walls and dummy elements are kept without geometry, all other objects are dropped
+        if result.exported or job.kind in ('wall', 'dummy'):
+            result.envelope = get_records_envelope(records)
+            if result.envelope is not None and self.envelopes:
+                city_object.city_object["geographicalExtent"] = [round(c, 3) for c in result.envelope]
+            result.material_count = len(city_object.materials)
+            result.fragment = city_object
+        return result
+
+    def _get_cityjson_translate(self):
+        """Returns the translation of the CityJSON transform: the origin of the georeferenced model (incl. offsets, in the target CRS), rounded to the scale."""
+        return np.round(self.transform_vertices(np.zeros((1, 3)))[0], 3)
+
+    def _get_cityjson_metadata(self):
+        """Returns the metadata of the CityJSON output: reference system (if georeferenced) and the name of the IfcProject as title."""
+        metadata = {}
+        reference_system = get_cityjson_reference_system(self.srs_name)
+        if reference_system:
+            metadata["referenceSystem"] = reference_system
+        try:
+            projects = self.model.by_type("IfcProject")
+        except RuntimeError:
+            projects = []
+        if projects and getattr(projects[0], 'Name', None):
+            metadata["title"] = projects[0].Name
+        return metadata
+
+    def _create_cityjson_building(self, ifc_bldg, ifc_project):
+        """Creates the CityJSON Building object of an IfcBuilding (attributes only, its children are added by the writer)."""
+        building = CityJSONObject(f"UUID_{uuid.uuid4()}", "Building", ifc_bldg.id())
+        attributes = building.city_object["attributes"]
+        try:
+            attributes.update(self._get_cityjson_attributes(ifc_bldg))
+        except Exception:
+            pass
+        # External reference using IfcBuilding.GlobalId (IfcProject.GlobalId if it has none)
+        if "externalReference" in attributes and not getattr(ifc_bldg, 'GlobalId', None):
+            attributes["externalReference"]["targetResource"] = getattr(ifc_project, 'GlobalId', "UNKNOWN") if ifc_project else "UNKNOWN"
+        return building
+
+    def _create_cityjson_storeys(self, building_state, show_progress=True):
+        """Returns the BuildingStorey objects of a building (their children are added by the writer from the parents of the elements)."""
+        storey_objects = []
+        if show_progress and building_state['storeys']:
+            print("IfcBuildingStorey: ", end="", flush=True)
+        for storey, object_id in building_state['storeys']:
+            storey_object = CityJSONObject(object_id, "BuildingStorey", storey.id())
+            storey_object.city_object["attributes"].update(self._get_cityjson_attributes(storey))
+            storey_object.parents = [building_state['building_id']]
+            storey_objects.append(storey_object)
+            if show_progress:
+                print(".", end="", flush=True)
+        if show_progress and building_state['storeys']:
+            print()
+        return storey_objects
+
+    def _encode_database_job(self, job, records, stats):
+        """
+        Encoding stage of the GeoPackage and Parquet outputs: creates the rows of a job (the city object and its
+        doors/windows as Door/Window objects with the city object as parent, with generic attributes,
+        appearances and geometry) from the GeometryRecords. Returns a FeatureResult with a
+        DatabaseFeature as fragment.
+        """
+        result = FeatureResult(stats)
+        result.gml_id = f"UUID_{uuid.uuid4()}"
+        feature = DatabaseFeature(result.gml_id, job.step_id, job.storey_key)
+
+        if job.kind == 'dummy':
+            feature.rows.append([result.gml_id, None, CITYJSON_OBJECT_TYPES[job.kind], job.ifc_type, None, job.name, None, None, None, None, None, 0])
+        else:
+            elem = self.model.by_id(job.step_id)
+            record = records.get(job.step_id)
+            result.material_count += self._add_database_object(feature, result.gml_id, None, CITYJSON_OBJECT_TYPES[job.kind], job.ifc_type, elem, record, self.is_intended_solid(elem))
+            if record:
+                result.exported = True
+                if job.kind != 'wall':
+                    result.progress += "."
+
+        for dw_id in job.fillings:
+            dw = self.model.by_id(dw_id)
+            feature_type = "Door" if dw.is_a("IfcDoor") else "Window"
+            result.material_count += self._add_database_object(feature, f"UUID_{uuid.uuid4()}", result.gml_id, feature_type, dw.is_a(), dw, records.get(dw_id), self.is_intended_solid(dw))
+            # Output D for Door or W for Window
+            result.progress += feature_type[0]
+
+        if job.kind == 'wall':
+            result.progress += "."
+
+        # Walls and dummy elements are kept without geometry, all other objects are dropped
+        if result.exported or job.kind in ('wall', 'dummy'):
+            result.envelope = get_records_envelope(records)
+            result.fragment = feature
+        return result
+
+    def _add_database_object(self, feature, gml_id, parent_id, feature_type, ifc_class, ifc_element, record=None, is_solid=False, guid=None):
+        """
+        Adds the row of an IFC element to a DatabaseFeature (with the geometry of the record as MultiPolygon Z
+        unless it is not written, as glTF mesh buffers for glTF), its generic attributes (as emitted by
+        add_properties(), not for glTF) and its appearance (GeoPackage only, the materials of the glTF
+        primitives). guid replaces a missing GlobalId in the external reference. Returns the number of materials.
+        """
+        guid = getattr(ifc_element, 'GlobalId', None) or guid or "UNKNOWN"
+        information_system = self.filename
+        if self.no_references and self.output_format == 'gpkg':
+            # (the GlobalId identifies the rows of the Parquet tables, it is no external reference there)
+            guid, information_system = None, None
+        if not record:
+            geometry, envelope = None, None
+        elif self.output_format == 'gpkg' or (self.output_format == 'parquet' and self.parquet_geometry):
+            geometry, envelope = encode_geopackage_geometry(record, self._get_database_srs_id())
+        else:
+            geometry, envelope = None, tuple(np.round(np.concatenate(record.envelope()), 3).tolist())
+            if self.output_format == 'glb':
+                geometry = encode_gltf_mesh(record, self._get_cityjson_translate(), not self.no_appearances)
+        feature.rows.append([gml_id, parent_id, feature_type, ifc_class, guid, getattr(ifc_element, 'Name', None), getattr(ifc_element, 'Description', None), information_system,
+                             ("Solid" if is_solid else "MultiSurface") if record else None, geometry, envelope, len(record) if record else 0])
+        if self.output_format == 'glb':
+            return sum(key is not None for key, _, _ in geometry[3]) if geometry else 0
+        feature.attributes.extend(self._get_database_attributes(gml_id, ifc_element))
+        if self.no_appearances or self.output_format != 'gpkg' or not record:
+            return 0
+        groups = record.faces_by_material()
+        feature.appearances.extend((gml_id, key, encode_json((face_indices + 1).tolist())) for key, face_indices in groups)
+        return len(groups)
+
+    def _get_database_attributes(self, gml_id, ifc_element):
+        """Returns the generic_attributes rows of an IFC element: the properties as emitted by add_properties() (set, name with optional prefix, typed value)."""
+        rows = []
+        for pset_name, valid_props in self._get_property_sets(ifc_element):
+            attribute_set = None if self.no_generic_attribute_sets else pset_name
+            for prop_name, prop_value in valid_props.items():
+                name = f"[{pset_name}]{prop_name}" if self.pset_names_as_prefixes else prop_name
+                data_type, value = get_generic_attribute_value(prop_value)
+                rows.append((gml_id, attribute_set, name, data_type, value if data_type == 'string' else None, value if data_type == 'int' else None, value if data_type == 'double' else None))
+        return rows
+
+    def _get_database_srs_id(self):
+        """Returns the srs_id of the GeoPackage output: the EPSG code of srsName, -1 (undefined cartesian) for local coordinates."""
+        code = get_epsg_code(self.srs_name)
+        return code if code is not None else -1
+
+    def _create_database_building(self, ifc_bldg, ifc_project):
+        """Creates the Building row of an IfcBuilding for the GeoPackage and Parquet outputs (without geometry, the hierarchy is stored with its children)."""
+        building = DatabaseFeature(f"UUID_{uuid.uuid4()}", ifc_bldg.id())
+        # External reference using IfcBuilding.GlobalId (IfcProject.GlobalId if it has none)
+        project_guid = getattr(ifc_project, 'GlobalId', None) if ifc_project else None
+        try:
+            self._add_database_object(building, building.object_id, None, "Building", ifc_bldg.is_a(), ifc_bldg, guid=project_guid)
+        except Exception:
+            # (the Building is kept without the properties that cannot be read, like in the CityGML output)
+            building.attributes = []
+        return building
+
+    def _create_database_storeys(self, building_state, show_progress=True):
+        """Returns the BuildingStorey rows of a building (their members are stored from the parents of the elements)."""
+        storey_features = []
+        if show_progress and building_state['storeys']:
+            print("IfcBuildingStorey: ", end="", flush=True)
+        for storey, object_id in building_state['storeys']:
+            storey_feature = DatabaseFeature(object_id, storey.id())
+            self._add_database_object(storey_feature, object_id, None, "BuildingStorey", storey.is_a(), storey)
+            storey_feature.parents = [building_state['building_id']]
+            storey_features.append(storey_feature)
+            if show_progress:
+                print(".", end="", flush=True)
+        if show_progress and building_state['storeys']:
+            print()
+        return storey_features
+
+    def _merge_result(self, context, job, result, building_state):
+        """Merges the bookkeeping of a FeatureResult into the context (called in document order)."""
+        context.stats.merge(result.stats)
+        if job.kind == 'dummy':
+            # Store reference for later use by Storey element
+            building_state['dummy_bce_per_storey'][job.storey_key] = result.gml_id
+        else:
+            elem = self.model.by_id(job.step_id)
+            context.element_gml_ids[elem] = result.gml_id
+            if result.exported:
+                context.exported_elements.add(elem)
+        building_state['appearance_count'] += result.material_count
+        building_state['envelope'] = merge_envelopes(building_state['envelope'], result.envelope)
+        for material_key, target in result.shared_material_targets:
+            context.shared_material_targets.setdefault(material_key, []).append(target)
+
+    def _create_variant_storey_fragments(self, variants, building_elements, rooms_list):
+        """Returns the serialized Storey features of a building for each output variant (None with no_storeys)."""
+        fragments = []
+        show_progress = True
+        for variant in variants:
+            if getattr(variant.generator, 'no_storeys', False):
+                fragments.append(None)
+                continue
+            if variant.generator.output_format in DATABASE_OUTPUT_FORMATS:
+                fragments.append(variant.generator._create_database_storeys(variant.building_state, show_progress))
+                show_progress = False
+                continue
+            if variant.generator.output_format != 'citygml':
+                fragments.append(variant.generator._create_cityjson_storeys(variant.building_state, show_progress))
+                show_progress = False
+                continue
+            fragments.append(variant.generator._create_storey_fragments(variant.context, building_elements, rooms_list, variant.building_state['dummy_bce_per_storey'], show_progress, variant.partition))
+            show_progress = False
+        return fragments
+
+    def _create_storey_fragments(self, context, building_elements, rooms_list, dummy_bce_per_storey, show_progress=True, partition=None):
+        """
+        Creates the bldg:buildingSubdivision/Storey features of a building with xlinks to the exported
+        constructive elements, installations, furniture and rooms. Returns the serialized fragments
+        (with a partition, the fragments are added to it and the xlinks may refer to other files).
+        """
+        storeys_list = self._get_building_storeys(building_elements)
+        if not storeys_list:
+            return b""
+
+        fragments = []
+        if show_progress:
+            print("IfcBuildingStorey: ", end="", flush=True)
+        for storey in storeys_list:
+            storey_prop = etree.Element(f"{{{NSMAP['bldg']}}}buildingSubdivision", nsmap=NSMAP)
+            storey_elem = etree.SubElement(storey_prop, f"{{{NSMAP['bldg']}}}Storey", attrib={f"{{{NSMAP['gml']}}}id": f"UUID_{uuid.uuid4()}"})
 
-        # Iterate over all IfcBuilding objects and export each one
-        for ifc_bldg in ifc_buildings:
-            # Track which doors and windows are embedded in constructive elements for THIS building
-            embedded_doors_windows = set()
-            # Reset exported elements tracking for each building
-            self.exported_elements = set()
-            # Dictionary to store dummy BCEs per storey (for xlinks from Storey elements)
-            dummy_bce_per_storey = {}
-            # Counter for appearances in this building
-            building_appearance_count = 0
-            # Create cityObjectMember and Building for this IfcBuilding
-            member = etree.SubElement(root, f"{{{NSMAP['core']}}}cityObjectMember")
-            building = etree.SubElement(member, f"{{{NSMAP['bldg']}}}Building", attrib={f"{{{NSMAP['gml']}}}id": f"UUID_{uuid.uuid4()}"})
-
-            # Building metadata: name/description and property sets
-            b_desc = getattr(ifc_bldg, 'Description', None)
-            b_name = getattr(ifc_bldg, 'Name', None)
-            if b_desc:
-                desc_el = etree.SubElement(building, f"{{{NSMAP['gml']}}}description")
-                desc_el.text = b_desc
-            if b_name:
-                name_el = etree.SubElement(building, f"{{{NSMAP['gml']}}}name")
-                name_el.text = b_name
-
-            # External reference using IfcBuilding.GlobalId
-            ext_guid = getattr(ifc_bldg, 'GlobalId', None)
-            if not ext_guid:
-                ext_guid = getattr(ifc_project, 'GlobalId', "UNKNOWN") if ifc_project else "UNKNOWN"
-            self.create_external_reference(building, ext_guid)
-
-            # Add building properties
-            try:
-                self.add_properties(building, ifc_bldg)
-            except Exception:
-                pass
+            # Add metadata
+            s_desc = getattr(storey, 'Description', None)
+            s_name = getattr(storey, 'Name', None)
+            if s_desc:
+                desc_el = etree.SubElement(storey_elem, f"{{{NSMAP['gml']}}}description")
+                desc_el.text = s_desc
+            if s_name:
+                name_el = etree.SubElement(storey_elem, f"{{{NSMAP['gml']}}}name")
+                name_el.text = s_name
 
-            # Get elements that belong to this building via decomposition
-            building_elements = set(ifcopenshell.util.element.get_decomposition(ifc_bldg))
+            # Add external reference
+            self.create_external_reference(storey_elem, getattr(storey, 'GlobalId', 'UNKNOWN'))
 
-            # Get all IfcSpace objects that belong to this building
-            try:
-                all_spaces = self.model.by_type("IfcSpace")
-            except RuntimeError:
-                all_spaces = []
-            rooms_list = [s for s in all_spaces if s in building_elements]
+            # Add properties
+            self.add_properties(storey_elem, storey)
 
-            print(f"\nConverting building: {b_name or 'Unnamed'}")
+            # Get all elements that belong to this storey
+            # Use both decomposition and ContainedInStructure relations
+            storey_elements = self._get_storey_elements(storey)
 
-            # Collect all elements by type for this building
-            # Use exact type matching (not inheritance) to avoid duplicates
-            building_ifc_elements = {}
-            for ifc_type, _ in target_elements.items():
+            # Create xlinks to constructive elements that belong to this storey
+            # (Doors and Windows are not linked separately as they are embedded in walls)
+            all_element_types = [
+                "IfcWall", "IfcWallStandardCase", "IfcRoof", "IfcSlab", "IfcColumn", "IfcBeam",
+                "IfcMember", "IfcPlate", "IfcStair", "IfcStairFlight", "IfcRamp", "IfcRampFlight",
+                "IfcFooting", "IfcPile", "IfcBuildingElementProxy",
+                "IfcCurtainWall", "IfcCovering", "IfcRailing",
+                "IfcFurniture", "IfcSystemFurnitureElement", "IfcFurnishingElement"
+            ]
+
+            for elem_type in all_element_types:
                 try:
-                    elements = self.model.by_type(ifc_type)
+                    type_elements = self.model.by_type(elem_type)
                 except RuntimeError:
-                    elements = []
-                # Filter elements to only those belonging to this building
-                # AND ensure exact type match (not subtypes) to avoid duplicates
-                building_ifc_elements[ifc_type] = [e for e in elements if e in building_elements and e.is_a() == ifc_type]
-
-            # --- Process Walls with embedded Doors and Windows ---
-            wall_types = ["IfcWall", "IfcWallStandardCase"]
-            for wall_type in wall_types:
-                walls = building_ifc_elements.get(wall_type, [])
-                if walls:
-                    print(f"{wall_type}: ", end="", flush=True)
-
-                for wall in walls:
-                    # Create BuildingConstructiveElement for the wall
-                    cons_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                    gml_id = f"UUID_{uuid.uuid4()}"
-                    cons_elem = etree.SubElement(cons_prop, f"{{{NSMAP['bldg']}}}BuildingConstructiveElement", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
-                    self.element_gml_ids[wall] = gml_id
-
-                    # Add metadata
-                    if hasattr(wall, 'Description') and wall.Description:
-                        desc_elem = etree.SubElement(cons_elem, f"{{{NSMAP['gml']}}}description")
-                        desc_elem.text = wall.Description
-                    if hasattr(wall, 'Name') and wall.Name:
-                        name_elem = etree.SubElement(cons_elem, f"{{{NSMAP['gml']}}}name")
-                        name_elem.text = wall.Name
-
-                    self.create_external_reference(cons_elem, getattr(wall, 'GlobalId', 'UNKNOWN'))
-                    
-                    # Generate geometry with surface IDs and per-face materials for multi-appearance support
-                    is_solid = self.is_intended_solid(wall)
-                    polygons, surface_ids, face_materials = self.get_geometry_with_surface_ids(wall)
-                    geometry_id = f"UUID_{uuid.uuid4()}" if polygons else None
-                    
-                    # Add appearance if element has color information (before generic attributes)
-                    # Pass surface_ids and face_materials for per-face targeting
-                    if geometry_id:
-                        success, mat_count = self.add_appearance(cons_elem, wall, gml_id, geometry_id, surface_ids, face_materials)
-                        if success:
-                            building_appearance_count += mat_count
-                    
-                    # Add generic attributes (after appearance)
-                    self.add_properties(cons_elem, wall)
-                    
-                    # Output geometry (after generic attributes)
-                    if polygons:
-                        if is_solid:
-                            lod3 = etree.SubElement(cons_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
-                            shell = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
-                            parent_for_polys = shell
-                        else:
-                            lod3 = etree.SubElement(cons_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                            ms = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            parent_for_polys = ms
-
-                        # Use the pre-generated surface_ids for each polygon
-                        for poly_coords, surface_id in zip(polygons, surface_ids):
-                            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
-                            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                            pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-
-                        # Mark wall as successfully exported
-                        self.exported_elements.add(wall)
-
-                    # Find and add doors/windows as child elements using con:filling
-                    # (must come before bldg:class for schema validation)
-                    doors_windows = self.get_doors_and_windows_in_element(wall)
-                    for dw in doors_windows:
-                        embedded_doors_windows.add(dw)
-                        mat_added = self._add_door_or_window_as_filling(cons_elem, dw, building_appearance_count)
-                        building_appearance_count += mat_added
-                        # Output D for Door or W for Window
-                        if dw.is_a("IfcDoor"):
-                            print("D", end="", flush=True)
-                        else:
-                            print("W", end="", flush=True)
-
-                    # Add class for wall (must come after con:filling)
-                    class_elem = etree.SubElement(cons_elem, f"{{{NSMAP['bldg']}}}class")
-                    class_elem.text = wall_type
-
-                    print(".", end="", flush=True)
+                    type_elements = []
 
-                if walls:
-                    print()
+                type_elements = [e for e in type_elements if e in building_elements and e in storey_elements]
 
-            # --- Process remaining BuildingConstructiveElement types (excluding walls) ---
-            constructive_types = [
-                "IfcRoof", "IfcSlab", "IfcColumn", "IfcBeam", "IfcMember", "IfcPlate",
-                "IfcStair", "IfcStairFlight", "IfcRamp", "IfcRampFlight",
-                "IfcFooting", "IfcPile", "IfcBuildingElementProxy", "IfcCurtainWall"
-            ]
+                for elem in type_elements:
+                    # Only create xlink if element was actually exported (has geometry)
+                    if elem in context.element_gml_ids and elem in context.exported_elements:
+                        elem_gml_id = context.element_gml_ids[elem]
+                        contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
+                        contains.set(f"{{{NSMAP['xlink']}}}href", f"#{elem_gml_id}")
 
-            for ifc_type in constructive_types:
-                elements = building_ifc_elements.get(ifc_type, [])
-                if elements:
-                    print(f"{ifc_type}: ", end="", flush=True)
-
-                for elem in elements:
-                    cons_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                    gml_id = f"UUID_{uuid.uuid4()}"
-                    cons_elem = etree.SubElement(cons_prop, f"{{{NSMAP['bldg']}}}BuildingConstructiveElement", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
-                    self.element_gml_ids[elem] = gml_id
-
-                    if hasattr(elem, 'Description') and elem.Description:
-                        desc_elem = etree.SubElement(cons_elem, f"{{{NSMAP['gml']}}}description")
-                        desc_elem.text = elem.Description
-                    if hasattr(elem, 'Name') and elem.Name:
-                        name_elem = etree.SubElement(cons_elem, f"{{{NSMAP['gml']}}}name")
-                        name_elem.text = elem.Name
-
-                    self.create_external_reference(cons_elem, getattr(elem, 'GlobalId', 'UNKNOWN'))
-                    
-                    # Generate geometry UUID early (needed for appearance)
-                    is_solid = self.is_intended_solid(elem)
-                    # Generate geometry with surface IDs for multi-appearance support
-                    polygons, surface_ids, face_materials = self.get_geometry_with_surface_ids(elem)
-                    geometry_id = f"UUID_{uuid.uuid4()}" if polygons else None
-                    
-                    # Add appearance if element has color information (before generic attributes)
-                    # Pass surface_ids to enable multi-appearance targeting
-                    if geometry_id:
-                        success, mat_count = self.add_appearance(cons_elem, elem, gml_id, geometry_id, surface_ids, face_materials)
-                        if success:
-                            building_appearance_count += mat_count
-                    
-                    # Add generic attributes (after appearance)
-                    self.add_properties(cons_elem, elem)
-                    
-                    # Output geometry (after generic attributes)
-                    if polygons:
-                        if is_solid:
-                            lod3 = etree.SubElement(cons_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
-                            shell = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
-                            parent_for_polys = shell
-                        else:
-                            lod3 = etree.SubElement(cons_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                            ms = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            parent_for_polys = ms
-
-                        # Use the pre-generated surface_ids for each polygon
-                        for poly_coords, surface_id in zip(polygons, surface_ids):
-                            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
-                            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                            pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-
-                        print(".", end="", flush=True)
-                        # Mark element as successfully exported
-                        self.exported_elements.add(elem)
-                    else:
-                        building.remove(cons_prop)
-
-                    # Find and add doors/windows as child elements using con:filling
-                    # (must come before bldg:class for schema validation)
-                    doors_windows = self.get_doors_and_windows_in_element(elem)
-                    for dw in doors_windows:
-                        embedded_doors_windows.add(dw)
-                        mat_added = self._add_door_or_window_as_filling(cons_elem, dw, building_appearance_count)
-                        building_appearance_count += mat_added
-                        # Output D for Door or W for Window
-                        if dw.is_a("IfcDoor"):
-                            print("D", end="", flush=True)
-                        else:
-                            print("W", end="", flush=True)
+            # Create xlink to dummy BuildingConstructiveElement if this storey has one
+            # (must come after regular BuildingConstructiveElements but before BuildingRooms)
+            storey_guid = getattr(storey, 'GlobalId', None)
+            if storey_guid and storey_guid in dummy_bce_per_storey:
+                dummy_gml_id = dummy_bce_per_storey[storey_guid]
+                contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
+                contains.set(f"{{{NSMAP['xlink']}}}href", f"#{dummy_gml_id}")
 
-                    # Add class element (must come after con:filling)
-                    class_elem = etree.SubElement(cons_elem, f"{{{NSMAP['bldg']}}}class")
-                    class_elem.text = ifc_type
+            # Create xlinks to rooms that belong to this storey
+            for room in rooms_list:
+                if room in storey_elements:
+                    # Only create xlink if room was actually exported (has geometry)
+                    if room in context.element_gml_ids and room in context.exported_elements:
+                        room_gml_id = context.element_gml_ids[room]
+                        contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingRoom")
+                        contains.set(f"{{{NSMAP['xlink']}}}href", f"#{room_gml_id}")
 
-                if elements:
-                    print()
+            if partition is not None:
+                # Split output: put the Storey into a file and refer to the features in other files by file name
+                href_attribute = f"{{{NSMAP['xlink']}}}href"
+                links = [child for child in storey_elem if child.get(href_attribute)]
+                key = partition.storey_key(storey, [link.get(href_attribute)[1:] for link in links])
+                for link in links:
+                    link.set(href_attribute, partition.href(link.get(href_attribute)[1:], key))
+                partition.add_storey(key, storey, storey_elem.get(f"{{{NSMAP['gml']}}}id"), serialize_fragment(storey_prop, FEATURE_PROPERTY_LEVEL))
+                if show_progress:
+                    print(".", end="", flush=True)
+                continue
 
-            # --- Check for non-exported doors and windows for THIS building ---
-            # Get all doors and windows that belong to this building
-            building_doors = [e for e in self.model.by_type("IfcDoor") if e in building_elements]
-            building_windows = [e for e in self.model.by_type("IfcWindow") if e in building_elements]
-            building_doors_windows = building_doors + building_windows
-            
-            total_doors_windows = len(building_doors_windows)
-            exported_count = len(embedded_doors_windows)
-            unmapped_count = total_doors_windows - exported_count
-            
-            # Track unmapped doors/windows without storey for fallback dummy BCE
-            unmapped_without_storey = []
-            
-            if total_doors_windows > 0:
-                print(f"\nDoors and Windows: {exported_count} of {total_doors_windows} exported as con:filling")
-                if unmapped_count > 0:
-                    print(f"  Warning: {unmapped_count} doors/windows could not be assigned to a BuildingConstructiveElement")
-                    if not getattr(self, 'list_unmapped_doors_windows', False) and not getattr(self, 'unrelated_doors_windows_in_dummy_bce', False):                      
-                        print("  Use option '--list-unmapped-doors-and-windows' to see details, or")
-                        print("  use option '--unrelated-doors-and-windows-in-dummy-bce' to create empty")
-                        print("  BuildingConstructiveElements grouped by storey.")
-
-                    if getattr(self, 'list_unmapped_doors_windows', False):
-                        # List the unmapped doors and windows for this building
-                        unmapped = [dw for dw in building_doors_windows if dw not in embedded_doors_windows]
-                        self._list_unmapped_doors_windows(unmapped)
-                    
-                    # If option is set, create dummy BuildingConstructiveElements for unmapped doors/windows
-                    if getattr(self, 'unrelated_doors_windows_in_dummy_bce', False):
-                        unmapped = [dw for dw in building_doors_windows if dw not in embedded_doors_windows]
-                        if unmapped:
-                            print("\nCreating dummy BuildingConstructiveElements for unrelated doors/windows...")
-                            
-                            # Group unmapped doors/windows by storey
-                            doors_windows_by_storey = {}
-                            for dw in unmapped:
-                                # Find which storey this door/window belongs to
-                                storey = self._find_storey_for_element(dw)
-                                if storey:
-                                    storey_guid = getattr(storey, 'GlobalId', None)
-                                    if storey_guid:
-                                        if storey_guid not in doors_windows_by_storey:
-                                            doors_windows_by_storey[storey_guid] = {'storey': storey, 'elements': []}
-                                        doors_windows_by_storey[storey_guid]['elements'].append(dw)
-                                else:
-                                    unmapped_without_storey.append(dw)
-                            
-                            # Create dummy BCE for each storey with unmapped elements
-                            for storey_guid, data in doors_windows_by_storey.items():
-                                storey = data['storey']
-                                elements = data['elements']
-                                storey_name = getattr(storey, 'Name', 'Unnamed Storey')
-                                
-                                print(f"  Creating dummy BCE for storey '{storey_name}': ", end="", flush=True)
-                                dummy_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                                dummy_gml_id = f"UUID_{uuid.uuid4()}"
-                                dummy_elem = etree.SubElement(dummy_prop, f"{{{NSMAP['bldg']}}}BuildingConstructiveElement", attrib={f"{{{NSMAP['gml']}}}id": dummy_gml_id})
-                                
-                                # Store reference for later use by Storey element
-                                dummy_bce_per_storey[storey_guid] = dummy_gml_id
-                                
-                                # Add name indicating which storey this belongs to
-                                name_elem = etree.SubElement(dummy_elem, f"{{{NSMAP['gml']}}}name")
-                                name_elem.text = f"Stub Element for unrelated Doors and Windows - Storey: {storey_name}"
-                                
-                                # Add all doors/windows for this storey as fillings
-                                for dw in elements:
-                                    mat_added = self._add_door_or_window_as_filling(dummy_elem, dw, building_appearance_count)
-                                    building_appearance_count += mat_added
-                                    # Output D for Door or W for Window
-                                    if dw.is_a("IfcDoor"):
-                                        print("D", end="", flush=True)
-                                    else:
-                                        print("W", end="", flush=True)
-                                
-                                # Add class (must come after con:filling for schema validation)
-                                class_elem = etree.SubElement(dummy_elem, f"{{{NSMAP['bldg']}}}class")
-                                class_elem.text = "DummyBuildingConstructiveElement"
-                                print()
-                            
-                            # Create fallback dummy BCE for elements not associated with any storey
-                            if unmapped_without_storey:
-                                print(f"  Creating fallback dummy BCE for elements without storey: ", end="", flush=True)
-                                dummy_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                                dummy_gml_id = f"UUID_{uuid.uuid4()}"
-                                dummy_elem = etree.SubElement(dummy_prop, f"{{{NSMAP['bldg']}}}BuildingConstructiveElement", attrib={f"{{{NSMAP['gml']}}}id": dummy_gml_id})
-                                
-                                # Store reference with special key for unmapped elements
-                                dummy_bce_per_storey['__UNMAPPED__'] = dummy_gml_id
-                                
-                                # Add name indicating no storey association
-                                name_elem = etree.SubElement(dummy_elem, f"{{{NSMAP['gml']}}}name")
-                                name_elem.text = "Stub Element for unrelated Doors and Windows - No Storey Assignment"
-                                
-                                # Add all unmapped doors/windows as fillings
-                                for dw in unmapped_without_storey:
-                                    mat_added = self._add_door_or_window_as_filling(dummy_elem, dw, building_appearance_count)
-                                    building_appearance_count += mat_added
-                                    # Output D for Door or W for Window
-                                    if dw.is_a("IfcDoor"):
-                                        print("D", end="", flush=True)
-                                    else:
-                                        print("W", end="", flush=True)
-                                
-                                # Add class (must come after con:filling for schema validation)
-                                class_elem = etree.SubElement(dummy_elem, f"{{{NSMAP['bldg']}}}class")
-                                class_elem.text = "DummyBuildingConstructiveElement"
-                                print()
-                print()
-
-            # --- Process BuildingInstallation types ---
-            installation_types = ["IfcCovering", "IfcRailing"]
-
-            for ifc_type in installation_types:
-                elements = building_ifc_elements.get(ifc_type, [])
-                if elements:
-                    print(f"{ifc_type}: ", end="", flush=True)
-
-                for elem in elements:
-                    inst_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingInstallation")
-                    gml_id = f"UUID_{uuid.uuid4()}"
-                    inst_elem = etree.SubElement(inst_prop, f"{{{NSMAP['bldg']}}}BuildingInstallation", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
-                    self.element_gml_ids[elem] = gml_id
-
-                    if hasattr(elem, 'Description') and elem.Description:
-                        desc_elem = etree.SubElement(inst_elem, f"{{{NSMAP['gml']}}}description")
-                        desc_elem.text = elem.Description
-                    if hasattr(elem, 'Name') and elem.Name:
-                        name_elem = etree.SubElement(inst_elem, f"{{{NSMAP['gml']}}}name")
-                        name_elem.text = elem.Name
-
-                    self.create_external_reference(inst_elem, getattr(elem, 'GlobalId', 'UNKNOWN'))
-                    
-                    # Generate geometry with surface IDs for multi-appearance support
-                    is_solid = self.is_intended_solid(elem)
-                    polygons, surface_ids, face_materials = self.get_geometry_with_surface_ids(elem)
-                    geometry_id = f"UUID_{uuid.uuid4()}" if polygons else None
-                    
-                    # Add appearance if element has color information (before generic attributes)
-                    # Pass surface_ids to enable multi-appearance targeting
-                    if geometry_id:
-                        success, mat_count = self.add_appearance(inst_elem, elem, gml_id, geometry_id, surface_ids, face_materials)
-                        if success:
-                            building_appearance_count += mat_count
-                    
-                    # Add generic attributes (after appearance)
-                    self.add_properties(inst_elem, elem)
-                    
-                    # Output geometry (after generic attributes)
-                    if polygons:
-                        if is_solid:
-                            lod3 = etree.SubElement(inst_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
-                            shell = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
-                            parent_for_polys = shell
-                        else:
-                            lod3 = etree.SubElement(inst_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                            ms = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            parent_for_polys = ms
-
-                        # Use the pre-generated surface_ids for each polygon
-                        for poly_coords, surface_id in zip(polygons, surface_ids):
-                            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
-                            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                            pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-
-                        print(".", end="", flush=True)
-                        # Mark element as successfully exported
-                        self.exported_elements.add(elem)
-                    else:
-                        building.remove(inst_prop)
-
-                    class_elem = etree.SubElement(inst_elem, f"{{{NSMAP['bldg']}}}class")
-                    class_elem.text = ifc_type
-
-                if elements:
-                    print()
-
-            # Export IfcSpace rooms BEFORE BuildingFurniture for schema validation
-            # CityGML 3.0 requires: buildingConstructiveElement -> buildingInstallation -> buildingRoom -> buildingFurniture -> buildingSubdivision
-            if rooms_list:
-                print("IfcSpace: ", end="", flush=True)
-                for elem in rooms_list:
-                    room_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingRoom")
-                    gml_id = f"UUID_{uuid.uuid4()}"
-                    room_elem = etree.SubElement(room_prop, f"{{{NSMAP['bldg']}}}BuildingRoom", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
-                    # Track the gml:id for this room so we can create xlinks from Storeys
-                    self.element_gml_ids[elem] = gml_id
-
-                    r_desc = getattr(elem, 'Description', None)
-                    r_name = getattr(elem, 'Name', None)
-                    if r_desc:
-                        desc_el = etree.SubElement(room_elem, f"{{{NSMAP['gml']}}}description")
-                        desc_el.text = r_desc
-                    if r_name:
-                        name_el = etree.SubElement(room_elem, f"{{{NSMAP['gml']}}}name")
-                        name_el.text = r_name
-
-                    self.create_external_reference(room_elem, getattr(elem, 'GlobalId', 'UNKNOWN'))
-                    
-                    # Generate geometry with surface IDs for multi-appearance support
-                    is_solid = self.is_intended_solid(elem)
-                    polygons, surface_ids, face_materials = self.get_geometry_with_surface_ids(elem)
-                    geometry_id = f"UUID_{uuid.uuid4()}" if polygons else None
-                    
-                    # Add appearance if element has color information (before generic attributes)
-                    # Pass surface_ids to enable multi-appearance targeting
-                    if geometry_id:
-                        success, mat_count = self.add_appearance(room_elem, elem, gml_id, geometry_id, surface_ids, face_materials)
-                        if success:
-                            building_appearance_count += mat_count
-                    
-                    # Add generic attributes (after appearance)
-                    self.add_properties(room_elem, elem)
-                    
-                    # Output geometry (after generic attributes)
-                    if polygons:
-                        if is_solid:
-                            lod3 = etree.SubElement(room_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
-                            shell = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
-                            parent_for_polys = shell
-                        else:
-                            lod3 = etree.SubElement(room_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                            ms = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            parent_for_polys = ms
-
-                        # Use the pre-generated surface_ids for each polygon
-                        for poly_coords, surface_id in zip(polygons, surface_ids):
-                            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
-                            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                            pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-
-                        print(".", end="", flush=True)
-                        # Mark element as successfully exported
-                        self.exported_elements.add(elem)
-                    else:
-                        building.remove(room_prop)
-
-                    class_elem = etree.SubElement(room_elem, f"{{{NSMAP['bldg']}}}class")
-                    class_elem.text = 'IfcSpace'
-                print()
-
-            # --- Process BuildingFurniture types (after BuildingRoom for schema validation) ---
-            furniture_types = ["IfcFurniture", "IfcSystemFurnitureElement", "IfcFurnishingElement"]
-
-            for ifc_type in furniture_types:
-                elements = building_ifc_elements.get(ifc_type, [])
-                if elements:
-                    print(f"{ifc_type}: ", end="", flush=True)
-
-                for elem in elements:
-                    furn_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingFurniture")
-                    gml_id = f"UUID_{uuid.uuid4()}"
-                    furn_elem = etree.SubElement(furn_prop, f"{{{NSMAP['bldg']}}}BuildingFurniture", attrib={f"{{{NSMAP['gml']}}}id": gml_id})
-                    self.element_gml_ids[elem] = gml_id
-
-                    if hasattr(elem, 'Description') and elem.Description:
-                        desc_elem = etree.SubElement(furn_elem, f"{{{NSMAP['gml']}}}description")
-                        desc_elem.text = elem.Description
-                    if hasattr(elem, 'Name') and elem.Name:
-                        name_elem = etree.SubElement(furn_elem, f"{{{NSMAP['gml']}}}name")
-                        name_elem.text = elem.Name
-
-                    self.create_external_reference(furn_elem, getattr(elem, 'GlobalId', 'UNKNOWN'))
-                    
-                    # Generate geometry with surface IDs for multi-appearance support
-                    is_solid = self.is_intended_solid(elem)
-                    polygons, surface_ids, face_materials = self.get_geometry_with_surface_ids(elem)
-                    geometry_id = f"UUID_{uuid.uuid4()}" if polygons else None
-                    
-                    # Add appearance if element has color information (before generic attributes)
-                    # Pass surface_ids to enable multi-appearance targeting
-                    if geometry_id:
-                        success, mat_count = self.add_appearance(furn_elem, elem, gml_id, geometry_id, surface_ids, face_materials)
-                        if success:
-                            building_appearance_count += mat_count
-                    
-                    # Add generic attributes (after appearance)
-                    self.add_properties(furn_elem, elem)
-                    
-                    # Output geometry (after generic attributes)
-                    if polygons:
-                        if is_solid:
-                            lod3 = etree.SubElement(furn_elem, f"{{{NSMAP['core']}}}lod3Solid")
-                            solid = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}Solid", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            exterior = etree.SubElement(solid, f"{{{NSMAP['gml']}}}exterior")
-                            shell = etree.SubElement(exterior, f"{{{NSMAP['gml']}}}Shell")
-                            parent_for_polys = shell
-                        else:
-                            lod3 = etree.SubElement(furn_elem, f"{{{NSMAP['core']}}}lod3MultiSurface")
-                            ms = etree.SubElement(lod3, f"{{{NSMAP['gml']}}}MultiSurface", attrib={f"{{{NSMAP['gml']}}}id": geometry_id, "srsName": self.srs_name, "srsDimension": "3"})
-                            parent_for_polys = ms
-
-                        # Use the pre-generated surface_ids for each polygon
-                        for poly_coords, surface_id in zip(polygons, surface_ids):
-                            sm = etree.SubElement(parent_for_polys, f"{{{NSMAP['gml']}}}surfaceMember")
-                            poly = etree.SubElement(sm, f"{{{NSMAP['gml']}}}Polygon", attrib={f"{{{NSMAP['gml']}}}id": surface_id})
-                            ext = etree.SubElement(poly, f"{{{NSMAP['gml']}}}exterior")
-                            lr = etree.SubElement(ext, f"{{{NSMAP['gml']}}}LinearRing")
-                            pos = etree.SubElement(lr, f"{{{NSMAP['gml']}}}posList")
-                            pos.text = " ".join(f"{c:.3f}" for c in poly_coords)
-
-                        print(".", end="", flush=True)
-                        # Mark element as successfully exported
-                        self.exported_elements.add(elem)
-                    else:
-                        building.remove(furn_prop)
+            fragments.append(serialize_fragment(storey_prop, FEATURE_PROPERTY_LEVEL))
+            if show_progress:
+                print(".", end="", flush=True)
+        if show_progress:
+            print()
+        return b"".join(fragments)
 
-                    class_elem = etree.SubElement(furn_elem, f"{{{NSMAP['bldg']}}}class")
-                    class_elem.text = ifc_type
+    def _get_building_storeys(self, building_elements):
+        """Returns the IfcBuildingStoreys of a building (its decomposition) that are exported (selected by the element filter)."""
+        try:
+            all_storeys = self.model.by_type("IfcBuildingStorey")
+        except RuntimeError:
+            all_storeys = []
 
-                if elements:
-                    print()
+        storeys_list = [s for s in all_storeys if s in building_elements]
+        if self.element_filter is not None:
+            storeys_list = [s for s in storeys_list if self.element_filter.accepts_storey(s)]
+        return storeys_list
 
-            # Export IfcBuildingStorey features with xlinks to rooms and constructive elements
-            # Skip if --no-storeys option is set
-            if not getattr(self, 'no_storeys', False):
-                try:
-                    all_storeys = self.model.by_type("IfcBuildingStorey")
-                except RuntimeError:
-                    all_storeys = []
-                
-                storeys_list = [s for s in all_storeys if s in building_elements]
-                
-                if storeys_list:
-                    print("IfcBuildingStorey: ", end="", flush=True)
-                    for storey in storeys_list:
-                        storey_prop = etree.SubElement(building, f"{{{NSMAP['bldg']}}}buildingSubdivision")
-                        storey_elem = etree.SubElement(storey_prop, f"{{{NSMAP['bldg']}}}Storey", attrib={f"{{{NSMAP['gml']}}}id": f"UUID_{uuid.uuid4()}"})
-                        
-                        # Add metadata
-                        s_desc = getattr(storey, 'Description', None)
-                        s_name = getattr(storey, 'Name', None)
-                        if s_desc:
-                            desc_el = etree.SubElement(storey_elem, f"{{{NSMAP['gml']}}}description")
-                            desc_el.text = s_desc
-                        if s_name:
-                            name_el = etree.SubElement(storey_elem, f"{{{NSMAP['gml']}}}name")
-                            name_el.text = s_name
-                        
-                        # Add external reference
-                        self.create_external_reference(storey_elem, getattr(storey, 'GlobalId', 'UNKNOWN'))
-                        
-                        # Add properties
-                        self.add_properties(storey_elem, storey)
-                        
-                        # Get all elements that belong to this storey
-                        # Use both decomposition and ContainedInStructure relations
-                        storey_elements = self._get_storey_elements(storey)
-                        
-                        # Create xlinks to constructive elements that belong to this storey
-                        # (Doors and Windows are not linked separately as they are embedded in walls)
-                        all_element_types = [
-                            "IfcWall", "IfcWallStandardCase", "IfcRoof", "IfcSlab", "IfcColumn", "IfcBeam",
-                            "IfcMember", "IfcPlate", "IfcStair", "IfcStairFlight", "IfcRamp", "IfcRampFlight",
-                            "IfcFooting", "IfcPile", "IfcBuildingElementProxy",
-                            "IfcCurtainWall", "IfcCovering", "IfcRailing",
-                            "IfcFurniture", "IfcSystemFurnitureElement", "IfcFurnishingElement"
-                        ]
-                        
-                        for elem_type in all_element_types:
-                            try:
-                                type_elements = self.model.by_type(elem_type)
-                            except RuntimeError:
-                                type_elements = []
-                            
-                            type_elements = [e for e in type_elements if e in building_elements and e in storey_elements]
-                            
-                            for elem in type_elements:
-                                # Only create xlink if element was actually exported (has geometry)
-                                if elem in self.element_gml_ids and elem in self.exported_elements:
-                                    elem_gml_id = self.element_gml_ids[elem]
-                                    contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                                    contains.set(f"{{{NSMAP['xlink']}}}href", f"#{elem_gml_id}")
-                        
-                        # Create xlink to dummy BuildingConstructiveElement if this storey has one
-                        # (must come after regular BuildingConstructiveElements but before BuildingRooms)
-                        if 'dummy_bce_per_storey' in locals():
-                            storey_guid = getattr(storey, 'GlobalId', None)
-                            if storey_guid and storey_guid in dummy_bce_per_storey:
-                                dummy_gml_id = dummy_bce_per_storey[storey_guid]
-                                contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingConstructiveElement")
-                                contains.set(f"{{{NSMAP['xlink']}}}href", f"#{dummy_gml_id}")
-                        
-                        # Create xlinks to rooms that belong to this storey
-                        for room in rooms_list:
-                            if room in storey_elements:
-                                # Only create xlink if room was actually exported (has geometry)
-                                if room in self.element_gml_ids and room in self.exported_elements:
-                                    room_gml_id = self.element_gml_ids[room]
-                                    contains = etree.SubElement(storey_elem, f"{{{NSMAP['bldg']}}}buildingRoom")
-                                    contains.set(f"{{{NSMAP['xlink']}}}href", f"#{room_gml_id}")
-                        
-                        print(".", end="", flush=True)
-                    print()
-                
-                # Print appearance count for this building
-                if building_appearance_count > 0:
-                    print(f"Total materials/appearances in this building: {building_appearance_count}")
-                
-        tree = etree.ElementTree(root)
-        tree.write(self.output_path, pretty_print=True, xml_declaration=True, encoding="UTF-8")
-        print(f"Successfully wrote {self.output_path}")
-        # If georeference override was requested, print the exact coordinates used
-        if getattr(self, 'georef_oktoberfest', False):
-            print(f"Georeference used (EPSG:25832): Easting={self.eastings:.3f}, Northing={self.northings:.3f}, Height={self.orthogonal_height:.3f}")
-        # Print offset information if any offset was applied
-        if self.xoffset != 0.0 or self.yoffset != 0.0 or self.zoffset != 0.0:
-            print(f"Offset applied: X={self.xoffset:.3f}, Y={self.yoffset:.3f}, Z={self.zoffset:.3f}")
+    def _print_tessellation_report(self, stats):
+        """Prints the number of triangles per IFC class and per linear deflection."""
+        print(f"Triangles: {sum(stats.triangle_counts.values())} in total")
+        for ifc_class, count in sorted(stats.triangle_counts.items()):
+            print(f"  {ifc_class}: {count}")
+        print("Triangles per linear deflection:")
+        for deflection, count in sorted(stats.deflection_triangle_counts.items(), key=lambda item: item[0] or 0.0):
+            print(f"  {deflection}: {count}")
 
     def _list_unmapped_doors_windows(self, unmapped_doors_windows):
         """
@@ -1635,14 +5339,14 @@ class CityGMLGenerator:
         
         return storey_elements
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Convert an IFC file to CityGML 3.0")
-    parser.add_argument("input_ifc", help="Path to input IFC")
-    parser.add_argument("-o", "--output", help="Output path")
+
+def add_conversion_arguments(parser):
+    """Adds the conversion options (all command line options except input, output and workers) to an ArgumentParser."""
     parser.add_argument("--no-references", action="store_true", help="Do not export CityGML external references")
     parser.add_argument("--no-properties", action="store_true", help="Do not export property sets/generic attributes")
     parser.add_argument("--reorient-shells", action="store_true", help="Ensure that all solid boundary surfaces are oriented outwards (slows down processing!)")
     parser.add_argument("--georef-oktoberfest", action="store_true", help="Georeference model to Theresienwiese in Munich (EPSG:25832) to enable viewing in a GIS")
+    parser.add_argument("--target-crs", default=None, metavar="CRS", help="Transform the georeferenced coordinates into this CRS with pyproj and use it as srsName, e.g. EPSG:25833 or EPSG:25832+7837 (with heights)")
     parser.add_argument("--list-unmapped-doors-and-windows", action="store_true", help="List all doors and windows that could not be assigned to a BuildingConstructiveElement")
     parser.add_argument("--unrelated-doors-and-windows-in-dummy-bce", action="store_true", help="Put unrelated doors and windows in a dummy BuildingConstructiveElement")
     parser.add_argument("--no-generic-attribute-sets", action="store_true", help="Output IFC properties as direct generic attributes instead of wrapped in GenericAttributeSets")
@@ -1652,11 +5356,1288 @@ if __name__ == "__main__":
     parser.add_argument("--xoffset", type=float, default=0.0, help="Offset to shift the model in X direction (applied after georeferencing)")
     parser.add_argument("--yoffset", type=float, default=0.0, help="Offset to shift the model in Y direction (applied after georeferencing)")
     parser.add_argument("--zoffset", type=float, default=0.0, help="Offset to shift the model in Z direction (applied after georeferencing)")
+    parser.add_argument("--geometry-kernel", default=DEFAULT_GEOMETRY_KERNEL, help=f"Geometry kernel, or comma separated fallback chain of kernels (e.g. cgal-simple,opencascade). Available: {', '.join(GEOMETRY_KERNELS)}")
+    parser.add_argument("--kernel-timeout", type=float, default=None, help="Fall back to the next geometry kernel if an element takes longer than this many seconds")
+    parser.add_argument("--linear-deflection", type=float, default=None, help="Linear deflection tolerance for the tessellation of curved geometry (IfcOpenShell default: 0.001)")
+    parser.add_argument("--angular-deflection", type=float, default=None, help="Angular deflection tolerance in radians for the tessellation of curved geometry (IfcOpenShell default: 0.5)")
+    parser.add_argument("--adaptive-deflection", action="store_true", help="Choose the linear deflection per element from its bounding box size and IFC class")
+    parser.add_argument("--max-triangles", type=int, default=None, help="Decimate elements with more triangles than this budget")
+    parser.add_argument("--max-triangles-per-class", default=None, help="Triangle budgets per IFC class, e.g. IfcFurniture=2000,IfcBuildingElementProxy=5000 (overrides --max-triangles)")
+    parser.add_argument("--decimation-error", type=float, default=DEFAULT_DECIMATION_ERROR, help=f"Maximum geometric error introduced by the decimation (default: {DEFAULT_DECIMATION_ERROR})")
+    parser.add_argument("--shared-materials", choices=["building", "citymodel"], default=None, help="Write one material per unique color/transparency at Building or CityModel level instead of separate materials for every feature")
+    parser.add_argument("--envelopes", action="store_true", help="Write gml:boundedBy envelopes of the features, Buildings and the CityModel")
+    parser.add_argument("--include-types", default=None, help="Only convert elements of these comma separated IFC classes (incl. subclasses), e.g. IfcWall,IfcSlab")
+    parser.add_argument("--exclude-types", default=None, help="Do not convert elements of these comma separated IFC classes (incl. subclasses), e.g. IfcFurnishingElement,IfcSpace")
+    parser.add_argument("--storeys", default=None, help="Only convert the elements of these comma separated storeys (names or GlobalIds)")
+    parser.add_argument("--bbox", default=None, help="Only convert elements whose placement lies in minx,miny,maxx,maxy (or minx,miny,minz,maxx,maxy,maxz) in the output CRS")
+
+
+def get_conversion_options(args, parser):
+    """
+    Returns the CityGMLGenerator keyword arguments for the options parsed by a parser set up with
+    add_conversion_arguments(). Invalid values are reported with parser.error().
+    """
+    max_triangles_per_class = {}
+    if args.max_triangles_per_class:
+        for entry in args.max_triangles_per_class.split(","):
+            ifc_class, _, budget = entry.partition("=")
+            try:
+                max_triangles_per_class[ifc_class.strip()] = int(budget)
+            except ValueError:
+                parser.error(f"invalid triangle budget '{entry}' (expected IfcClass=count)")
+
+    element_types = {}
+    for option in ("include_types", "exclude_types"):
+        element_types[option] = []
+        for name in (getattr(args, option) or "").split(","):
+            if not name.strip():
+                continue
+            class_name = get_ifc_class_name(name.strip())
+            if class_name is None:
+                parser.error(f"unknown IFC class '{name.strip()}' in --{option.replace('_', '-')}")
+            element_types[option].append(class_name)
+
+    storeys = [name.strip() for name in args.storeys.split(",") if name.strip()] if args.storeys else None
+
+    bbox = None
+    if args.bbox:
+        try:
+            bbox = [float(c) for c in args.bbox.split(",")]
+        except ValueError:
+            parser.error(f"invalid --bbox '{args.bbox}' (expected minx,miny,maxx,maxy or minx,miny,minz,maxx,maxy,maxz)")
+        if len(bbox) not in (4, 6) or any(low > high for low, high in zip(bbox[:len(bbox) // 2], bbox[len(bbox) // 2:])):
+            parser.error(f"invalid --bbox '{args.bbox}' (expected minx,miny,maxx,maxy or minx,miny,minz,maxx,maxy,maxz)")
+
+    if args.target_crs:
+        if pyproj is None:
+            parser.error("--target-crs needs the pyproj package (pip install pyproj)")
+        try:
+            pyproj.CRS.from_user_input(args.target_crs)
+        except pyproj.exceptions.CRSError:
+            parser.error(f"invalid --target-crs '{args.target_crs}' (expected a CRS known to PROJ, e.g. EPSG:25833)")
+
+    geometry_kernels = [k.strip() for k in args.geometry_kernel.split(",") if k.strip()]
+    for kernel in geometry_kernels:
+        if kernel not in GEOMETRY_KERNELS:
+            parser.error(f"unknown geometry kernel '{kernel}' (available: {', '.join(GEOMETRY_KERNELS)})")
+        if hasattr(ifcopenshell.geom, 'has_geometry_library') and not ifcopenshell.geom.has_geometry_library(kernel):
+            parser.error(f"geometry kernel '{kernel}' is not available in this IfcOpenShell build")
+
+    return dict(no_references=args.no_references, reorient_shells=args.reorient_shells, no_properties=args.no_properties, georef_oktoberfest=args.georef_oktoberfest, target_crs=args.target_crs, list_unmapped_doors_windows=args.list_unmapped_doors_and_windows, unrelated_doors_windows_in_dummy_bce=args.unrelated_doors_and_windows_in_dummy_bce, no_generic_attribute_sets=args.no_generic_attribute_sets, pset_names_as_prefixes=args.pset_names_as_prefixes, no_storeys=args.no_storeys, no_appearances=args.no_appearances, xoffset=args.xoffset, yoffset=args.yoffset, zoffset=args.zoffset, geometry_kernels=geometry_kernels, kernel_timeout=args.kernel_timeout, linear_deflection=args.linear_deflection, angular_deflection=args.angular_deflection, adaptive_deflection=args.adaptive_deflection, max_triangles=args.max_triangles, max_triangles_per_class=max_triangles_per_class, decimation_error=args.decimation_error, shared_materials=args.shared_materials, envelopes=args.envelopes, include_types=element_types['include_types'], exclude_types=element_types['exclude_types'], storeys=storeys, bbox=bbox)
+
+
+def get_ifc_class_name(name):
+    """Returns the IFC class name for a (case-insensitive) name, None if it is no class of IFC2X3, IFC4 or IFC4X3."""
+    for schema in ("IFC4", "IFC4X3", "IFC2X3"):
+        try:
+            return ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema).declaration_by_name(name).name()
+        except RuntimeError:
+            continue
+    return None
+
+
+def parse_variant(spec):
+    """
+    Parses an output variant of the command line (--variant OUTPUT:OPTION[,OPTION...]): the options
+    are VARIANT_OPTIONS named like the command line options, e.g. viz.gml:no-properties,no-appearances
+    or mat.gml:shared-materials=building (shared-materials=none to switch it off); the output format
+    follows from the extension (e.g. viz.city.json) or is given as output-format=cityjson (parquet-geometry adds
+    the geometry to a Parquet output). Flags are set by their name or name=true and switched off
+    with name=false (e.g. full.gml:no-properties=false with --no-properties on the main output).
+    Options that are not given are the same as for the main output. Returns (output path, options for derive()).
+    """
+    path, separator, option_list = spec.rpartition(":")
+    if not separator or not path or "/" in option_list or "\\" in option_list:
+        # No options (a colon in the path, e.g. a Windows drive letter, does not count)
+        return spec, {}
+    options = {}
+    for entry in option_list.split(","):
+        name, _, value = entry.strip().partition("=")
+        key = name.replace("-", "_")
+        if key not in VARIANT_OPTIONS:
+            raise ValueError(f"invalid option '{name}' of output variant '{spec}' (available: {', '.join(o.replace('_', '-') for o in VARIANT_OPTIONS)})")
+        if key == 'shared_materials':
+            if value not in ("building", "citymodel", "none"):
+                raise ValueError(f"invalid value '{value}' for shared-materials of output variant '{spec}' (building, citymodel or none)")
+            options[key] = None if value == "none" else value
+        elif key == 'output_format':
+            if value not in OUTPUT_FORMATS:
+                raise ValueError(f"invalid value '{value}' for output-format of output variant '{spec}' ({', '.join(OUTPUT_FORMATS)})")
+            options[key] = value
+        elif value.lower() not in ("", "true", "false"):
+            raise ValueError(f"invalid value '{value}' for {name} of output variant '{spec}' (true or false)")
+        else:
+            options[key] = value.lower() != "false"
+    return path, options
+
+
+def split_step_attributes(text):
+    """Splits the attributes of a STEP entity instance (bytes between the outer parentheses) at the top-level commas."""
+    attributes = []
+    depth = 0
+    start = 0
+    for match in STEP_ATTRIBUTE_TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token == b"(":
+            depth += 1
+        elif token == b")":
+            depth -= 1
+        elif token == b"," and depth == 0:
+            attributes.append(text[start:match.start()])
+            start = match.end()
+    attributes.append(text[start:])
+    return attributes
+
+
+def _is_subtype(declaration, name):
+    """Returns True if a schema entity declaration is the entity name or one of its subtypes."""
+    while declaration is not None:
+        if declaration.name() == name:
+            return True
+        declaration = declaration.supertype()
+    return False
+
+
+class StepIndex:
+    """
+    Index of the entity instances of an IFC (STEP) file that does not load the model: the file is
+    memory-mapped and scanned once, and per instance (in file order) the byte range, the entity type
+    and the referenced instances are kept in numpy arrays (about 80 bytes per instance instead of
+    the full model in memory). Used to split files that are too large for ifcopenshell.open() into
+    self-contained sub-models (see select() and write()).
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        data_start = self.data.find(b"DATA;")
+        if data_start < 0:
+            raise ValueError(f"{path} is not an IFC file in STEP format (no DATA section)")
+        self.header = self.data[:data_start + len(b"DATA;")] + b"\n"
+        schema_match = STEP_SCHEMA_PATTERN.search(self.header)
+        schema_name = schema_match.group(1).decode() if schema_match else "IFC4"
+        try:
+            self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema_name)
+        except Exception:
+            # e.g. IFC4X3 written with another addendum
+            self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(schema_name.split("_")[0])
+
+        ids, types, offsets, lengths, references, reference_counts = array('q'), array('H'), array('q'), array('q'), array('q'), array('q')
+        type_codes = {}
+        self.type_names = []
+        for match in STEP_INSTANCE_PATTERN.finditer(self.data, data_start):
+            type_name = match.group(2).decode().upper()
+            code = type_codes.get(type_name)
+            if code is None:
+                code = type_codes[type_name] = len(self.type_names)
+                self.type_names.append(type_name)
+            body = match.group(3)
+            if b"'" in body:
+                body = STEP_STRING_PATTERN.sub(b"''", body)
+            found = STEP_REFERENCE_PATTERN.findall(body)
+            ids.append(int(match.group(1)))
+            types.append(code)
+            offsets.append(match.start())
+            lengths.append(match.end() - match.start())
+            reference_counts.append(len(found))
+            references.extend(map(int, found))
+
+        self.count = len(ids)
+        self.ids = np.frombuffer(ids, dtype=np.int64)
+        self.id_order = np.argsort(self.ids, kind="stable")
+        self.sorted_ids = self.ids[self.id_order]
+        self.types = np.frombuffer(types, dtype=np.uint16)
+        self.offsets = np.frombuffer(offsets, dtype=np.int64)
+        self.lengths = np.frombuffer(lengths, dtype=np.int64)
+        self.reference_starts = np.zeros(self.count + 1, dtype=np.int64)
+        np.cumsum(np.frombuffer(reference_counts, dtype=np.int64), out=self.reference_starts[1:])
+        # References as instance indices (-1 for references to missing instances)
+        self.references = self.indices(np.frombuffer(references, dtype=np.int64))
+
+        # Flags per entity type
+        declarations = [self._declaration(name) for name in self.type_names]
+        def flags(name):
+            return np.array([declaration is not None and _is_subtype(declaration, name) for declaration in declarations], dtype=bool)
+        self.rooted = flags("IfcRoot")[self.types]
+        self.products = flags("IfcProduct")[self.types]
+        self.spatial = (flags("IfcSpatialStructureElement") | flags("IfcSpatialElement") | flags("IfcProject"))[self.types]
+        self.relationships = flags("IfcRelationship")[self.types]
+        self.declarations = declarations
+        # Attribute index of the relating and related objects of the decomposition relationships and
+        # of the owner of the attached entities per entity type
+        self.decomposition = {}
+        self.attached = {}
+        for code, declaration in enumerate(declarations):
+            if declaration is None:
+                continue
+            names = [attribute.name() for attribute in declaration.all_attributes()]
+            if declaration.name() in STEP_DECOMPOSITION_RELATIONSHIPS:
+                relating, related = STEP_DECOMPOSITION_RELATIONSHIPS[declaration.name()]
+                self.decomposition[code] = (names.index(relating), names.index(related))
+            for name, attribute in STEP_ATTACHED_ENTITIES.items():
+                if _is_subtype(declaration, name):
+                    self.attached[code] = names.index(attribute)
+
+        # Inverse index: instance -> relationships (by their references to rooted instances) and
+        # attached entities (by their owner) that refer to it, as CSR arrays
+        relationship_indices = np.flatnonzero(self.relationships)
+        sources, targets = self._gather(relationship_indices)
+        valid = targets >= 0
+        valid[valid] = self.rooted[targets[valid]]
+        attached_sources, attached_targets = array('q'), array('q')
+        for index in np.flatnonzero(np.isin(self.types, np.array(list(self.attached), dtype=np.uint16))).tolist():
+            owner = self.attribute_references(index, self.attached[int(self.types[index])])
+            if owner and owner[0] >= 0:
+                attached_sources.append(index)
+                attached_targets.append(owner[0])
+        sources = np.concatenate([sources[valid], np.frombuffer(attached_sources, dtype=np.int64)])
+        targets = np.concatenate([targets[valid], np.frombuffer(attached_targets, dtype=np.int64)])
+        order = np.argsort(targets, kind="stable")
+        self.inverse = sources[order]
+        self.inverse_starts = np.searchsorted(targets[order], np.arange(self.count + 1))
+
+    def _declaration(self, name):
+        try:
+            return self.schema.declaration_by_name(name).as_entity()
+        except Exception:
+            return None
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def indices(self, ids):
+        """Returns the instance indices of STEP ids (-1 for missing instances)."""
+        if not self.count:
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), self.count - 1)
+        return np.where(self.sorted_ids[positions] == ids, self.id_order[positions], -1)
+
+    def is_a(self, name):
+        """Returns the indices of the instances of an entity type (including subtypes) in file order."""
+        codes = [code for code, declaration in enumerate(self.declarations) if declaration is not None and _is_subtype(declaration, name)]
+        return np.flatnonzero(np.isin(self.types, np.array(codes, dtype=np.uint16)))
+
+    def text(self, index):
+        """Returns the bytes of an instance ('#id=TYPE(...);')."""
+        offset = int(self.offsets[index])
+        return self.data[offset:offset + int(self.lengths[index])]
+
+    def attributes(self, index):
+        """Returns the attributes of an instance as bytes."""
+        text = self.text(index)
+        return split_step_attributes(text[text.index(b"(") + 1:text.rindex(b")")])
+
+    def attribute_references(self, index, position, attributes=None):
+        """Returns the instance indices referenced by an attribute of an instance."""
+        attribute = (attributes or self.attributes(index))[position]
+        if b"'" in attribute:
+            attribute = STEP_STRING_PATTERN.sub(b"''", attribute)
+        return self.indices(np.array([int(found) for found in STEP_REFERENCE_PATTERN.findall(attribute)], dtype=np.int64)).tolist()
+
+    def _gather(self, indices):
+        """Returns (source, target) arrays of the references of the given instances."""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.reference_starts[indices]
+        counts = self.reference_starts[indices + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        return np.repeat(indices, counts), self.references[positions]
+
+    def _referring(self, indices):
+        """Returns the relationships and attached entities that refer to the given instances (see the inverse index)."""
+        starts = self.inverse_starts[indices]
+        counts = self.inverse_starts[indices + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(self.inverse[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)])
+
+    def _close(self, included, seeds):
+        """Adds the instances and all instances they reference (recursively) to the included mask. Returns the added indices."""
+        frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+        frontier = frontier[frontier >= 0]
+        frontier = frontier[~included[frontier]]
+        added = []
+        while len(frontier):
+            included[frontier] = True
+            added.append(frontier)
+            targets = np.unique(self._gather(frontier)[1])
+            targets = targets[targets >= 0]
+            frontier = targets[~included[targets]]
+        return np.concatenate(added) if added else np.zeros(0, dtype=np.int64)
+
+    def spatial_children(self):
+        """Returns a dict: instance index of a spatial element -> indices of the spatial elements aggregated into it."""
+        children = {}
+        for index in self.is_a("IfcRelAggregates").tolist():
+            relating, related = self.decomposition[int(self.types[index])]
+            attributes = self.attributes(index)
+            parents = self.attribute_references(index, relating, attributes)
+            if parents and self.spatial[parents[0]]:
+                children.setdefault(parents[0], []).extend(child for child in self.attribute_references(index, related, attributes) if child >= 0 and self.spatial[child])
+        return children
+
+    def select(self, seeds, owned, blocked=()):
+        """
+        Selects a self-contained sub-model: the seed instances (the spatial structure down to the
+        building or storey) with everything they reference, the objects taken in by the decomposition
+        relationships (STEP_DECOMPOSITION_RELATIONSHIPS) of owned spatial elements and of the
+        selected elements, recursively, and the relationships, property sets, types, materials,
+        styles and representations of the selected objects. Relationships to objects outside the
+        sub-model are left out or reduced to the selected objects (see write()).
+        blocked spatial elements (e.g. the other storeys of a building) are not taken in.
+        Returns (mask of the selected instances, set of the selected relationships).
+        """
+        included = np.zeros(self.count, dtype=bool)
+        owners = np.zeros(self.count, dtype=bool)
+        owners[np.asarray(list(owned), dtype=np.int64)] = True
+        excluded = np.zeros(self.count, dtype=bool)
+        excluded[np.asarray(list(blocked), dtype=np.int64)] = True
+        relationships = set()
+        added = self._close(included, seeds)
+        while len(added):
+            owners[added[self.products[added] & ~self.spatial[added]]] = True
+            pulled = []
+            for index in self._referring(added).tolist():
+                if index in relationships:
+                    continue
+                code = int(self.types[index])
+                if code in self.attached:
+                    if not included[index]:
+                        pulled.append(index)
+                    continue
+                taken = self._select_relationship(index, code, included, owners, excluded)
+                if taken is not None:
+                    relationships.add(index)
+                    included[index] = True
+                    pulled.extend(taken)
+            added = self._close(included, pulled)
+        return included, relationships
+
+    def _select_relationship(self, index, code, included, owners, excluded):
+        """
+        Returns the instances a relationship takes into the sub-model (its resource references, the
+        related objects of decompositions of owned objects, other rooted objects except products)
+        or None if it refers to a product outside the sub-model.
+        """
+        attributes = self.attributes(index)
+        decomposition = self.decomposition.get(code)
+        takes_related = False
+        if decomposition is not None:
+            relating = self.attribute_references(index, decomposition[0], attributes)
+            takes_related = bool(relating) and relating[0] >= 0 and owners[relating[0]]
+        taken = []
+        for position, attribute in enumerate(attributes):
+            if b"#" not in attribute:
+                continue
+            is_list = attribute.lstrip().startswith(b"(")
+            related = decomposition is not None and position == decomposition[1]
+            for target in self.attribute_references(index, position, attributes):
+                if target < 0 or included[target]:
+                    continue
+                if not self.rooted[target]:
+                    taken.append(target)
+                elif related and takes_related:
+                    if not excluded[target]:
+                        taken.append(target)
+                        if self.spatial[target]:
+                            owners[target] = True
+                elif is_list:
+                    # Related objects outside the sub-model are left out of the list
+                    continue
+                elif self.products[target]:
+                    return None
+                else:
+                    taken.append(target)
+        return taken
+
+    def write(self, path, included, relationships):
+        """
+        Writes the selected instances (see select()) in file order as IFC file with the header of the
+        source file. The object lists of the relationships are reduced to the selected objects, a
+        relationship that keeps no related object is left out.
+        """
+        selected = np.flatnonzero(included)
+        special = np.zeros(len(selected), dtype=bool)
+        if relationships:
+            special = np.isin(selected, np.fromiter(relationships, dtype=np.int64, count=len(relationships)))
+        with open(path, "wb") as stream:
+            stream.write(self.header)
+            # Runs of consecutive instances are copied as one block of the source file
+            breaks = np.flatnonzero((np.diff(selected) != 1) | special[1:] | special[:-1]) + 1
+            for run in np.split(np.arange(len(selected)), breaks):
+                if not len(run):
+                    continue
+                first, last = int(selected[run[0]]), int(selected[run[-1]])
+                if special[run[0]]:
+                    text = self._reduce_relationship(first, included)
+                    if text is not None:
+                        stream.write(text + b"\n")
+                    continue
+                start, end = int(self.offsets[first]), int(self.offsets[last] + self.lengths[last])
+                for offset in range(start, end, STEP_COPY_CHUNK_SIZE):
+                    stream.write(self.data[offset:min(offset + STEP_COPY_CHUNK_SIZE, end)])
+                stream.write(b"\n")
+            stream.write(b"ENDSEC;\nEND-ISO-10303-21;\n")
+
+    def _reduce_relationship(self, index, included):
+        """Returns the text of a relationship with its object lists reduced to the selected objects (None if a list becomes empty)."""
+        attributes = self.attributes(index)
+        changed = False
+        for position, attribute in enumerate(attributes):
+            if not attribute.lstrip().startswith(b"(") or b"#" not in attribute:
+                continue
+            items = split_step_attributes(attribute.strip()[1:-1])
+            kept = []
+            for item in items:
+                targets = self.indices(np.array([int(found) for found in STEP_REFERENCE_PATTERN.findall(item)], dtype=np.int64))
+                if len(targets) == 1 and targets[0] >= 0 and self.rooted[targets[0]] and not included[targets[0]]:
+                    continue
+                kept.append(item.strip())
+            if len(kept) != len(items):
+                if not kept:
+                    return None
+                attributes[position] = b"(" + b",".join(kept) + b")"
+                changed = True
+        if not changed:
+            return self.text(index)
+        text = self.text(index)
+        return text[:text.index(b"(") + 1] + b",".join(attributes) + b");"
+
+
+def split_ifc_file(input_path, mode, directory):
+    """
+    Splits an IFC file into self-contained sub-models (see StepIndex.select()) without loading it:
+    one per IfcBuilding (mode 'building') or per IfcBuildingStorey (mode 'storey', plus one for the
+    elements of a building that are not in a storey, if there are any), written to directory.
+    Returns a list of dicts with the path, the building (GlobalId, part number) and the storey
+    (GlobalId or None) of each sub-model, in the order of the buildings and storeys in the file.
+    """
+    if mode not in OUT_OF_CORE_MODES:
+        raise ValueError(f"unknown out-of-core mode '{mode}' (available: {', '.join(OUT_OF_CORE_MODES)})")
+    if is_compressed_ifc(input_path):
+        raise ValueError("the out-of-core conversion needs an uncompressed IFC file (it is memory-mapped)")
+    index = StepIndex(input_path)
+    try:
+        children = index.spatial_children()
+        parents = {child: parent for parent, kids in children.items() for child in kids}
+
+        def chain(element):
+            # The spatial structure from the project down to the element
+            elements = [element]
+            while elements[-1] in parents:
+                elements.append(parents[elements[-1]])
+            return elements
+
+        def descendants(element):
+            found = []
+            for child in children.get(element, []):
+                found.append(child)
+                found.extend(descendants(child))
+            return found
+
+        def global_id(element):
+            return index.attributes(element)[0].strip(b"'").decode()
+
+        storeys = index.is_a("IfcBuildingStorey").tolist()
+        parts = []
+        for number, building in enumerate(index.is_a("IfcBuilding").tolist(), 1):
+            building_id = global_id(building)
+            building_elements = set(descendants(building))
+            building_storeys = [storey for storey in storeys if storey in building_elements]
+            if mode == 'building':
+                selections = [(None, chain(building), [building], [])]
+            else:
+                selections = [(storey, chain(storey), [storey], [other for other in building_storeys if other != storey]) for storey in building_storeys]
+                # Elements of the building that are not in one of its storeys
+                selections.append((None, chain(building), [building], building_storeys))
+            for storey, seeds, owned, blocked in selections:
+                included, relationships = index.select(seeds, owned, blocked)
+                if storey is None and mode == 'storey':
+                    owned_products = index.products & ~index.spatial & included
+                    if not owned_products.any():
+                        continue
+                name = f"building{number}" + (f"_storey{building_storeys.index(storey) + 1}" if storey is not None else ("_nostorey" if mode == 'storey' else ""))
+                path = os.path.join(directory, f"{name}.ifc")
+                index.write(path, included, relationships)
+                parts.append({"path": path, "name": name, "building": building_id, "building_number": number,
+                              "storey": global_id(storey) if storey is not None else None})
+        return parts
+    finally:
+        index.close()
+
+
+def read_envelope(feature):
+    """
+    Returns the envelope of a parsed feature element from its gml:boundedBy or, without one, from
+    the coordinates of its posLists (None if it has no coordinates).
+    """
+    corners = feature.find(f"{{{NSMAP['gml']}}}boundedBy/{{{NSMAP['gml']}}}Envelope")
+    if corners is not None and len(corners) == 2 and corners[0].text and corners[0].text.strip():
+        return tuple(float(c) for c in corners[0].text.split()) + tuple(float(c) for c in corners[1].text.split())
+    texts = [pos_list.text for pos_list in feature.iter(f"{{{NSMAP['gml']}}}posList") if pos_list.text]
+    if not texts:
+        return None
+    coordinates = np.array(" ".join(texts).split(), dtype=np.float64).reshape(-1, 3)
+    return tuple(float(c) for c in np.concatenate([coordinates.min(axis=0), coordinates.max(axis=0)]))
+
+
+def make_gml_ids_unique(element, seen, suffix):
+    """
+    Makes the gml:ids of an element and its descendants that are not derived from a UUID
+    (appearances and materials named after their owner, e.g. APP_CITYMODEL) unique among the ids in seen by appending
+    _<suffix> to the ids that are already taken, and adds them to seen. Such ids are not referred
+    to by xlinks or appearance targets, so they can be renamed.
+    """
+    id_attribute = f"{{{NSMAP['gml']}}}id"
+    for node in element.iter():
+        gml_id = node.get(id_attribute)
+        if gml_id is None or "UUID_" in gml_id:
+            continue
+        if gml_id in seen:
+            renamed = f"{gml_id}_{suffix}"
+            number = 1
+            while renamed in seen:
+                number += 1
+                renamed = f"{gml_id}_{suffix}_{number}"
+            node.set(id_attribute, renamed)
+            gml_id = renamed
+        seen.add(gml_id)
+
+
+def merge_citygml_documents(groups, stream, envelopes=False):
+    """
+    Merges CityGML documents (of sub-models, see convert_out_of_core(), or of several IFC files, see
+    convert_multiple()) into one CityModel written to a binary stream (with envelopes, a stream that
+    is not seekable gets the document from a temporary file). groups is a list of
+    lists of document paths: the n-th Buildings of the documents of a group (e.g. one document per
+    storey of a building) are merged into one Building with the gml:id and attributes of the first
+    one, the appearances of all and their features in schema order (BUILDING_FEATURE_PROPERTIES).
+    The project name/description of the CityModel are taken from the first document.
+    UUID gml:ids are unique across the documents and xlinks only refer to features of the same
+    building, so they stay valid; the other gml:ids are made unique (see make_gml_ids_unique()).
+    The documents are parsed feature by feature, so memory is bounded by the largest feature. With
+    envelopes the envelopes of the merged Buildings and the CityModel are recomputed.
+    Returns the positions of the features as (gml:id, envelope, offset, length) for write_spatial_index().
+    """
+    seekable = getattr(stream, 'seekable', None)
+    if envelopes and not (seekable and seekable()):
+        # The envelopes are filled in when the document is complete
+        with tempfile.TemporaryFile() as spool:
+            feature_offsets = merge_citygml_documents(groups, spool, envelopes)
+            spool.seek(0)
+            shutil.copyfileobj(spool, stream, 1 << 20)
+        return feature_offsets
+    base = stream.tell() if envelopes else 0
+    position = 0
+    feature_offsets = []
+    model_envelope = None
+    root = None
+    root_written = False
+    root_placeholders = ()
+    srs_name = None
+    seen_ids = set()
+    document_number = 0
+    appearance_members = tempfile.TemporaryFile()
+    building_tag = f"{{{NSMAP['bldg']}}}Building"
+
+    def write(data):
+        nonlocal position
+        stream.write(data)
+        position += len(data)
+
+    for paths in groups:
+        # Features of the buildings of the group by category: (offset, length, gml:id, envelope) in the spool
+        spool = tempfile.TemporaryFile()
+        buildings = []
+        for path in paths:
+            document_number += 1
+            depth = -1
+            building_number = -1
+            for event, element in etree.iterparse(path, events=("start", "end"), huge_tree=True):
+                if event == "start":
+                    depth += 1
+                    if depth == 0 and root is None:
+                        root = element
+                    elif depth == 1 and etree.QName(element).localname == "cityObjectMember":
+                        building_number += 1
+                        if building_number == len(buildings):
+                            buildings.append({"member": None, "envelope": None, "features": {name: [] for name in BUILDING_FEATURE_PROPERTIES}})
+                    continue
+                if depth == FEATURE_PROPERTY_LEVEL and element.getparent().tag == building_tag:
+                    name = etree.QName(element).localname
+                    if name in BUILDING_FEATURE_PROPERTIES:
+                        building = buildings[building_number]
+                        feature = element[0] if len(element) else element
+                        envelope = read_envelope(feature)
+                        if srs_name is None:
+                            srs_name = next((child.get("srsName") for child in feature.iter() if child.get("srsName")), None)
+                        make_gml_ids_unique(element, seen_ids, document_number)
+                        fragment = serialize_fragment(element, FEATURE_PROPERTY_LEVEL)
+                        building["features"][name].append((spool.tell(), len(fragment), feature.get(f"{{{NSMAP['gml']}}}id"), envelope))
+                        spool.write(fragment)
+                        building["envelope"] = merge_envelopes(building["envelope"], envelope)
+                        element.getparent().remove(element)
+                elif depth == 1:
+                    name = etree.QName(element).localname
+                    if name == "cityObjectMember":
+                        building = buildings[building_number]
+                        bounded_by = element[0].find(f"{{{NSMAP['gml']}}}boundedBy")
+                        if bounded_by is not None:
+                            element[0].remove(bounded_by)
+                        make_gml_ids_unique(element, seen_ids, document_number)
+                        if building["member"] is None:
+                            building["member"] = copy.deepcopy(element)
+                        else:
+                            # Further parts of the building: only their appearances are kept
+                            for appearance in element[0].findall(f"{{{NSMAP['core']}}}appearance"):
+                                insert_appearance_property(building["member"][0], appearance)
+                    elif name == "appearanceMember":
+                        make_gml_ids_unique(element, seen_ids, document_number)
+                        appearance_members.write(serialize_fragment(element, 1))
+                    # (the project name/description of the first document stay for the CityModel start tag)
+                    if name not in ("description", "name") or element.getparent() is not root:
+                        element.getparent().remove(element)
+                depth -= 1
+
+        if not root_written and root is not None:
+            # CityModel start tag with the project name/description of the first document
+            city_model = etree.Element(root.tag, nsmap=root.nsmap, attrib=dict(root.attrib))
+            for child in root:
+                if etree.QName(child).localname in ("description", "name"):
+                    city_model.append(copy.deepcopy(child))
+            if envelopes:
+                insert_bounded_by(city_model, CITY_MODEL_ENVELOPE_KEY, srs_name or "")
+            root_start, root_end = serialize_open_close(city_model, 0, keep_namespaces=True)
+            root_start = extract_envelope_placeholders(XML_DECLARATION + root_start)
+            root_placeholders = root_start.placeholders
+            write(root_start)
+            root_written = True
+
+        # Merged Buildings: header of the first part, the features of all parts by category
+        for building in buildings:
+            member = building["member"]
+            if envelopes and building["envelope"] is not None:
+                insert_bounded_by(member[0], building["envelope"], srs_name or "")
+            model_envelope = merge_envelopes(model_envelope, building["envelope"])
+            member_start, member_end = serialize_open_close(member, 1, container=member[0])
+            write(member_start)
+            for name in BUILDING_FEATURE_PROPERTIES:
+                for offset, length, gml_id, envelope in building["features"][name]:
+                    if envelope is not None:
+                        feature_offsets.append((gml_id, envelope, position, length))
+                    spool.seek(offset)
+                    write(spool.read(length))
+            write(member_end)
+        spool.close()
+
+    if not root_written:
+        # No document
+        write(XML_DECLARATION + etree.tostring(etree.Element(f"{{{NSMAP['core']}}}CityModel", nsmap=NSMAP), pretty_print=True, encoding="UTF-8"))
+    else:
+        appearance_members.seek(0)
+        shutil.copyfileobj(appearance_members, stream)
+        position += appearance_members.tell()
+        write(root_end)
+        if envelopes:
+            fill_envelope_placeholders(stream, root_placeholders, {CITY_MODEL_ENVELOPE_KEY: model_envelope}, base)
+    appearance_members.close()
+    return feature_offsets
+
+
+def _convert_submodel(input_path, output_path, options):
+    """
+    Converts a sub-model or an input file in a worker process (see convert_out_of_core() and
+    convert_multiple()). Returns the conversion messages and the CRS of the output as
+    (srsName, georeferenced).
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        converter = CityGMLGenerator(input_path, output_path, **options)
+        converter.generate()
+    return log.getvalue(), (converter.srs_name, converter.georeferenced)
+
+
+def convert_out_of_core(input_path, output_path, mode, workers=1, spatial_index=False, **options):
+    """
+    Converts an IFC file that is too large to be opened as a whole: the file is split into
+    self-contained sub-models per building or storey (see split_ifc_file(), next to the output),
+    which are converted in up to workers separate processes (one process per sub-model, so the
+    memory is returned after each one) and merged into one CityModel (see merge_citygml_documents()).
+    options are keyword arguments of CityGMLGenerator (except split, variants and workers).
+    The merged output is CityGML (raises ValueError for a CityJSON, GeoPackage or Parquet output).
+    """
+    if get_output_format(output_path) != 'citygml' or options.get('output_format', 'citygml') != 'citygml':
+        raise ValueError("out-of-core conversion merges CityGML documents (no CityJSON, GeoPackage or Parquet output)")
+    options = dict(options, source_name=options.get('source_name') or os.path.basename(input_path))
+    directory = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(prefix="ifc2citygml_", dir=directory) as temporary:
+        start = time.perf_counter()
+        parts = split_ifc_file(input_path, mode, temporary)
+        print(f"Split {input_path} into {len(parts)} sub-models ({time.perf_counter() - start:.1f} s)")
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=max(1, min(workers, len(parts))) if parts else 1, maxtasksperchild=1) as pool:
+            pending = [pool.apply_async(_convert_submodel, (part["path"], part["path"][:-4] + ".gml", options)) for part in parts]
+            for part, result in zip(parts, pending):
+                for line in result.get()[0].splitlines():
+                    if line.strip():
+                        print(f"[{part['name']}] {line}")
+
+        groups = []
+        for part in parts:
+            if not groups or groups[-1][0] != part["building_number"]:
+                groups.append((part["building_number"], []))
+            groups[-1][1].append(part["path"][:-4] + ".gml")
+        with open_output(output_path) as stream:
+            feature_offsets = merge_citygml_documents([paths for _, paths in groups], stream, options.get('envelopes', False))
+    print(f"Successfully wrote {output_path}")
+    if spatial_index:
+        write_spatial_index(f"{output_path}.idx", feature_offsets)
+        print(f"Successfully wrote {output_path}.idx ({len(feature_offsets)} features)")
+
+
+def convert_multiple(input_paths, output_path, workers=1, spatial_index=False, **options):
+    """
+    Converts several IFC files (e.g. the buildings of a site or the discipline models of a project)
+    into one CityModel: the files are converted in up to workers separate processes, each with its
+    own georeferencing (see _setup_georeferencing()), and the Buildings of all files are merged
+    into one document (see merge_citygml_documents()) in the order of the files.
+    Raises ValueError if the files are not in the same CRS (srsName, or georeferenced and local
+    coordinates mixed); the remaining conversions are stopped then.
+    options are keyword arguments of CityGMLGenerator (except split, variants and workers).
+    The merged output is CityGML (raises ValueError for a CityJSON, GeoPackage or Parquet output).
+    """
+    if get_output_format(output_path) != 'citygml' or options.get('output_format', 'citygml') != 'citygml':
+        raise ValueError("several input files are merged as CityGML documents (no CityJSON, GeoPackage or Parquet output)")
+    directory = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(prefix="ifc2citygml_", dir=directory) as temporary:
+        documents = [os.path.join(temporary, f"input{number}.gml") for number in range(1, len(input_paths) + 1)]
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=max(1, min(workers, len(input_paths))), maxtasksperchild=1) as pool:
+            pending = [pool.apply_async(_convert_submodel, (input_path, document, dict(options, source_name=os.path.basename(input_path))))
+                       for input_path, document in zip(input_paths, documents)]
+            crs = None
+            for input_path, result in zip(input_paths, pending):
+                log, file_crs = result.get()
+                for line in log.splitlines():
+                    if line.strip():
+                        print(f"[{os.path.basename(input_path)}] {line}")
+                if crs is None:
+                    crs = (input_path, file_crs)
+                elif file_crs != crs[1]:
+                    describe = lambda value: value[0] if value[1] else f"local coordinates ({value[0]})"
+                    # (leaving the with block terminates the remaining conversions)
+                    raise ValueError(f"{input_path} is in {describe(file_crs)}, but {crs[0]} is in {describe(crs[1])}; the files cannot be merged into one CityModel")
+
+        with open_output(output_path) as stream:
+            feature_offsets = merge_citygml_documents([[document] for document in documents], stream, options.get('envelopes', False))
+    print(f"Successfully wrote {output_path} ({len(input_paths)} input files)")
+    if spatial_index:
+        write_spatial_index(f"{output_path}.idx", feature_offsets)
+        print(f"Successfully wrote {output_path}.idx ({len(feature_offsets)} features)")
+
+
+class ServiceError(Exception):
+    """Error of a conversion request of the service, reported to the client with an HTTP status code."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RequestOptionParser(argparse.ArgumentParser):
+    """ArgumentParser for the conversion options of service requests: raises ServiceError instead of exiting."""
+    def error(self, message):
+        raise ServiceError(400, message)
+
+
+class ConnectionStream:
+    """
+    Binary output stream of a service worker: collects the written fragments and sends them to the
+    service in 'data' messages of about SERVICE_MESSAGE_SIZE bytes.
+    """
+    def __init__(self, connection, message_size=SERVICE_MESSAGE_SIZE):
+        self.connection = connection
+        self.message_size = message_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.message_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.connection.send(("data", b"".join(self.buffer)))
+            self.buffer = []
+            self.size = 0
+
+
+def _preload_schemas():
+    """Loads all IFC schemas of IfcOpenShell (otherwise each one is loaded when first used)."""
+    wrapper = ifcopenshell.ifcopenshell_wrapper
+    if hasattr(wrapper, 'schema_names'):
+        for name in wrapper.schema_names():
+            wrapper.schema_by_name(name)
+
+
+def _serve_worker(connection):
+    """
+    Main loop of a service worker process: receives jobs (conversion options and source name,
+    followed by the IFC data) from the service and converts them. The output is sent back in
+    'data' messages, followed by ('done', log) or ('error', message, log); log holds the messages
+    printed during the conversion.
+    """
+    # Ctrl+C in the terminal of the service is handled by the service (which stops the workers)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _preload_schemas()
+    while True:
+        try:
+            options, source_name = connection.recv()
+            data = connection.recv_bytes()
+        except EOFError:
+            # The service was stopped
+            return
+        log = io.StringIO()
+        stream = ConnectionStream(connection)
+        try:
+            with contextlib.redirect_stdout(log):
+                converter = CityGMLGenerator(data, None, source_name=source_name, **options)
+                context = converter.write(stream)
+                if context.building_count > 0:
+                    converter._print_summary(context)
+            stream.flush()
+            connection.send(("done", log.getvalue()))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}", log.getvalue()))
+
+
+class ServiceWorker:
+    """A worker process of the conversion service and the connection to it."""
+    def __init__(self, ctx):
+        self.connection, worker_connection = ctx.Pipe()
+        self.process = ctx.Process(target=_serve_worker, args=(worker_connection,))
+        self.process.start()
+        worker_connection.close()
+
+    def stop(self):
+        """Terminates the worker process."""
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+def summarize_latencies(latencies):
+    """Returns the number, mean, median, 95th percentile and maximum of a sequence of latencies (seconds)."""
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies, dtype=np.float64)
+    return {"count": len(values), "mean": round(float(values.mean()), 4), "p50": round(float(np.percentile(values, 50)), 4), "p95": round(float(np.percentile(values, 95)), 4), "max": round(float(values.max()), 4)}
+
+
+class ConversionService:
+    """
+    Local conversion service: a pool of warm worker processes (IfcOpenShell imported and the IFC
+    schemas loaded) that convert one job at a time each. Jobs wait for a free worker in a queue;
+    the queue depth, job counts and latencies are kept for the metrics.
+    The workers are forked from a fork server process that has imported this module, so starting
+    (or replacing) a worker is cheap and the workers do not inherit the sockets of the service.
+    """
+    def __init__(self, workers=1, max_queue=None):
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.ctx = multiprocessing.get_context('forkserver')
+            self.ctx.set_forkserver_preload([__name__])
+        else:
+            self.ctx = multiprocessing.get_context()
+        self.worker_count = max(1, int(workers or 1))
+        # Maximum number of waiting jobs (None = unlimited); further jobs are rejected
+        self.max_queue = max_queue
+        self.closed = False
+        self.lock = threading.Lock()
+        self.workers = set()
+        self.idle_workers = queue.Queue()
+        for _ in range(self.worker_count):
+            self.idle_workers.put(self._start_worker())
+
+        # Metrics
+        self.started = time.time()
+        self.job_count = 0
+        self.queued_jobs = 0
+        self.active_jobs = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.rejected_jobs = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # Time spent waiting for a worker and total time of the last SERVICE_LATENCY_WINDOW completed jobs
+        self.queue_waits = deque(maxlen=SERVICE_LATENCY_WINDOW)
+        self.latencies = deque(maxlen=SERVICE_LATENCY_WINDOW)
+
+        self.option_parser = RequestOptionParser(add_help=False, allow_abbrev=False)
+        add_conversion_arguments(self.option_parser)
+
+    def _start_worker(self):
+        worker = ServiceWorker(self.ctx)
+        with self.lock:
+            self.workers.add(worker)
+        return worker
+
+    def _replace_worker(self, worker):
+        """Stops a worker (crashed, or its job was abandoned) and returns a new one (None after close())."""
+        with self.lock:
+            self.workers.discard(worker)
+        worker.stop()
+        return None if self.closed else self._start_worker()
+
+    def parse_options(self, query):
+        """
+        Returns the conversion options (CityGMLGenerator keyword arguments) and the source name of a
+        request. The options are query parameters named like the command line options, e.g.
+        ?no-storeys&geometry-kernel=cgal-simple,opencascade&name=house.ifc
+        """
+        argv = []
+        source_name = None
+        for key, value in parse_qsl(query, keep_blank_values=True):
+            if key == "name":
+                source_name = value or None
+            else:
+                argv.append(f"--{key}={value}" if value else f"--{key}")
+        args = self.option_parser.parse_args(argv)
+        return get_conversion_options(args, self.option_parser), source_name
+
+    def convert(self, data, options, source_name=None):
+        """
+        Converts the content of an IFC file in a worker and yields the CityGML document in fragments.
+        Raises ServiceError if the queue is full or the conversion fails. If the iteration is stopped
+        early (e.g. the client disconnected), the worker is replaced by a new one.
+        """
+        received = time.monotonic()
+        with self.lock:
+            if self.max_queue is not None and self.queued_jobs >= self.max_queue:
+                self.rejected_jobs += 1
+                raise ServiceError(503, "conversion queue is full")
+            self.job_count += 1
+            job_id = self.job_count
+            self.queued_jobs += 1
+            self.bytes_received += len(data)
+
+        worker = self.idle_workers.get()
+        if not worker.process.is_alive():
+            # The worker died while idle (e.g. killed): convert with a new one
+            worker = self._replace_worker(worker)
+        started = time.monotonic()
+        with self.lock:
+            self.queued_jobs -= 1
+            self.active_jobs += 1
+        finished = False
+        succeeded = False
+        try:
+            worker.connection.send((options, source_name))
+            worker.connection.send_bytes(data)
+            while True:
+                message = worker.connection.recv()
+                if message[0] == "data":
+                    with self.lock:
+                        self.bytes_sent += len(message[1])
+                    yield message[1]
+                elif message[0] == "done":
+                    finished = succeeded = True
+                    self._print_job_log(job_id, message[1])
+                    break
+                else:
+                    finished = True
+                    self._print_job_log(job_id, message[2])
+                    raise ServiceError(422, message[1])
+        except (EOFError, OSError):
+            raise ServiceError(500, "worker process terminated unexpectedly")
+        finally:
+            if not finished:
+                worker = self._replace_worker(worker)
+            if worker is not None:
+                self.idle_workers.put(worker)
+            finished_at = time.monotonic()
+            with self.lock:
+                self.active_jobs -= 1
+                if succeeded:
+                    self.completed_jobs += 1
+                    self.queue_waits.append(started - received)
+                    self.latencies.append(finished_at - received)
+                else:
+                    self.failed_jobs += 1
+
+    def _print_job_log(self, job_id, log):
+        """Prints the messages of a conversion, prefixed with the job number."""
+        lines = [f"[job {job_id}] {line}" for line in log.splitlines() if line.strip()]
+        if lines:
+            print("\n".join(lines), flush=True)
+
+    def metrics(self):
+        """Returns the metrics of the service (queue depth, job counts, latencies in seconds) as dict."""
+        with self.lock:
+            return {
+                "workers": self.worker_count,
+                "uptime": round(time.time() - self.started, 1),
+                "queue_depth": self.queued_jobs,
+                "active_jobs": self.active_jobs,
+                "completed_jobs": self.completed_jobs,
+                "failed_jobs": self.failed_jobs,
+                "rejected_jobs": self.rejected_jobs,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+                "queue_wait": summarize_latencies(self.queue_waits),
+                "latency": summarize_latencies(self.latencies),
+            }
+
+    def close(self):
+        """Stops all worker processes (running jobs fail)."""
+        self.closed = True
+        with self.lock:
+            workers = list(self.workers)
+            self.workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the conversion service:
+    - POST /convert with the IFC file as request body and the options as query parameters: returns
+      the CityGML document, streamed with chunked transfer encoding while it is converted
+    - GET /metrics: queue depth, job counts and latencies as JSON
+    - GET /health: 200 while the service is running
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "ifc2citygml"
+
+    def address_string(self):
+        # Clients connected via a Unix domain socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/metrics":
+            self._send_json(200, self.server.service.metrics())
+        elif path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        service = self.server.service
+        try:
+            length = self.headers.get("Content-Length")
+            if length is None or not length.isdigit():
+                self.close_connection = True
+                raise ServiceError(411, "the IFC file must be sent as request body with Content-Length")
+            data = self.rfile.read(int(length))
+            if url.path != "/convert":
+                raise ServiceError(404, f"unknown path {url.path}")
+            options, source_name = service.parse_options(url.query)
+            fragments = service.convert(data, options, source_name)
+            # Errors before the first output (unreadable IFC data, full queue) are returned as error response
+            first = next(fragments, b"")
+        except ServiceError as e:
+            self._send_json(e.status, {"error": str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/gml+xml")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._write_chunk(first)
+            for fragment in fragments:
+                self._write_chunk(fragment)
+            self.wfile.write(b"0\r\n\r\n")
+        except ServiceError as e:
+            # The response is already started: abort it, the client receives an incomplete response
+            self.log_error("conversion failed: %s", e)
+            self.close_connection = True
+        except OSError:
+            # Client disconnected
+            self.close_connection = True
+        finally:
+            fragments.close()
+
+    def _write_chunk(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _send_json(self, status, content):
+        body = json.dumps(content, indent=2).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_service(argv):
+    """Runs the conversion service (python ifc2citygml.py serve [options]) until it is interrupted."""
+    parser = argparse.ArgumentParser(prog="ifc2citygml.py serve", description="Run a local IFC to CityGML 3.0 conversion service")
+    parser.add_argument("--host", default=SERVICE_DEFAULT_HOST, help=f"Address to listen on (default: {SERVICE_DEFAULT_HOST}, local connections only)")
+    parser.add_argument("--port", type=int, default=SERVICE_DEFAULT_PORT, help=f"TCP port to listen on (default: {SERVICE_DEFAULT_PORT})")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix domain socket instead of a TCP port")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes, i.e. of concurrent conversions (default: number of CPUs)")
+    parser.add_argument("--max-queue", type=int, default=None, help="Reject jobs (HTTP 503) while this many jobs are waiting for a worker")
+    args = parser.parse_args(argv)
+
+    if args.socket:
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            parser.error("Unix domain sockets are not supported on this platform")
+        # Remove the socket of a previous run
+        if os.path.exists(args.socket) and stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            os.unlink(args.socket)
+        server = socketserver.ThreadingUnixStreamServer(args.socket, ConversionRequestHandler)
+        server.daemon_threads = True
+        address = args.socket
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ConversionRequestHandler)
+        address = f"http://{args.host}:{args.port}"
+
+    server.service = ConversionService(args.workers, args.max_queue)
+    # Stop cleanly (including the workers) on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Conversion service with {server.service.worker_count} workers listening on {address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        print("Conversion service stopped")
+
+
+if __name__ == "__main__":
+    # "serve" runs the conversion service instead of converting a file
+    if sys.argv[1:2] == ["serve"]:
+        run_service(sys.argv[2:])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Convert an IFC file to CityGML 3.0 (or run a conversion service: %(prog)s serve --help)")
+    parser.add_argument("input_ifc", nargs="+", help="Path to input IFC (several files are converted in parallel and merged into one CityModel)")
+    parser.add_argument("-o", "--output", help="Output path (CityJSON if it ends with .json, CityJSONSeq with .jsonl, GeoPackage with .gpkg, Parquet with .parquet, compressed if it ends with .gz or .zst)")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None, help="Format of the output: citygml, cityjson (CityJSON 2.0), cityjsonseq (one CityJSONFeature per building and line), gpkg (GeoPackage database), parquet (Parquet tables of the features and properties) or glb (binary glTF); default: by the extension of the output")
+    parser.add_argument("--parquet-geometry", action="store_true", help="Add the geometry as WKB column (GeoParquet) to a Parquet output")
+    parser.add_argument("--glb", action="store_true", help="Also write a binary glTF of the model for web viewers next to the output (<name>.glb, from the same tessellation)")
+    parser.add_argument("--compress", choices=OUTPUT_COMPRESSIONS, default=None, help="Compress the output while it is written (gzip, or zstd with the zstandard package); the extension (.gz, .zst) is appended to the output paths")
+    parser.add_argument("--variant", action="append", default=[], metavar="OUTPUT:OPTION[,OPTION...]", help="Write a further output that differs in serialization options in the same run (tessellated once), e.g. viz.gml:no-properties,no-appearances; can be repeated")
+    parser.add_argument("--split", choices=SPLIT_MODES, default=None, help="Write one file per building, storey or XY tile (named <output>_building1.gml, ...) and a manifest <output>_manifest.json")
+    parser.add_argument("--tile-size", type=float, default=DEFAULT_TILE_SIZE, help=f"Edge length of the XY tiles for --split tile in units of the output CRS (default: {DEFAULT_TILE_SIZE})")
+    parser.add_argument("--guids-file", default=None, help="Only convert the elements whose GlobalIds are listed in this file (one per line, # for comments)")
+    parser.add_argument("--spatial-index", action="store_true", help="Write a spatial index sidecar <output>.idx (packed Hilbert R-tree: feature envelope -> gml:id -> byte range in the output)")
+    parser.add_argument("--out-of-core", choices=OUT_OF_CORE_MODES, default=None, help="Split the IFC file into sub-models per building or storey without loading it, convert them in separate processes (--workers at a time) and merge the results into one CityModel (for files too large for memory)")
+    parser.add_argument("--inventory", nargs="?", const="-", default=None, metavar="FILE", help="Do not convert; write an inventory of the elements per building and storey (types, representation types, mapped items, openings, unmapped doors/windows) with an estimate of runtime and output size as JSON to FILE (default: stdout)")
+    add_conversion_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for the tessellation and encoding of the features (default: 1)")
+    parser.add_argument("--kernel-report", default=None, metavar="FILE", help="Write the geometry kernel that produced each element (JSON, by GlobalId; 'failed' if no kernel could tessellate it)")
+    parser.add_argument("--timings", default=None, metavar="FILE", help="Schedule the elements by the conversion times measured in a previous run (JSON file, by GlobalId) instead of the estimate of the cost model, and update the file with the times of this run")
+    parser.add_argument("--checkpoint-dir", default=None, metavar="DIR", help=f"Keep a checkpoint of the converted features in the work directory DIR (committed every {CHECKPOINT_INTERVAL:g} s, removed when the output is complete)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted conversion from the checkpoint in --checkpoint-dir (the output is the same as that of an uninterrupted run)")
     args = parser.parse_args()
+    options = get_conversion_options(args, parser)
+    if args.split and args.variant:
+        parser.error("--variant cannot be combined with --split")
+    if args.tile_size <= 0:
+        parser.error("--tile-size must be positive")
+    if args.resume and not args.checkpoint_dir:
+        parser.error("--resume requires --checkpoint-dir")
+    variants = []
+    for spec in args.variant:
+        try:
+            variants.append(parse_variant(spec))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.guids_file:
+        try:
+            with open(args.guids_file, encoding="utf-8") as stream:
+                options["guids"] = [line.split("#", 1)[0].strip() for line in stream if line.split("#", 1)[0].strip()]
+        except OSError as e:
+            parser.error(f"cannot read --guids-file: {e}")
+
+    input_path = args.input_ifc[0]
+    if args.output:
+        output_path = args.output
+    else:
+        # (without the compression extension of the input, e.g. house.ifc.gz -> house.gml)
+        stem = os.path.splitext(input_path)[0]
+        output_path = (os.path.splitext(stem)[0] if stem.lower().endswith(".ifc") else stem) + OUTPUT_FORMATS[args.output_format or 'citygml']
+    if args.glb:
+        if args.split:
+            parser.error("--glb cannot be combined with --split")
+        # (written as variant, e.g. model.gml -> model.glb)
+        variants.append((strip_output_extension(output_path) + OUTPUT_FORMATS['glb'], {'output_format': 'glb'}))
+    if args.compress:
+        # All outputs are compressed: append the extension where it is missing
+        extension = OUTPUT_COMPRESSIONS[args.compress]
+        paths = [output_path] + [path for path, _ in variants]
+        if any(get_output_compression(path) not in (None, args.compress) for path in paths):
+            parser.error(f"--compress {args.compress} does not match the extension of an output path")
+        output_path, *variant_paths = [path if get_output_compression(path) else path + extension for path in paths]
+        variants = [(path, options) for path, (_, options) in zip(variant_paths, variants)]
+    compressions = {get_output_compression(path) for path in [output_path] + [path for path, _ in variants]} - {None}
+    if 'zstd' in compressions and zstandard is None:
+        parser.error("zstd compression needs the zstandard package (pip install zstandard)")
+    if compressions and args.spatial_index:
+        parser.error("--spatial-index needs an uncompressed output (its byte ranges refer to the file)")
+    output_format = args.output_format or get_output_format(output_path)
+    if output_format != 'citygml':
+        if args.split or args.spatial_index:
+            parser.error("--split and --spatial-index need CityGML output")
+        if len(args.input_ifc) > 1 or args.out_of_core:
+            parser.error("several input files and --out-of-core are merged as CityGML (no CityJSON, GeoPackage, Parquet or glTF output)")
+    formats = [output_format] + [options.get('output_format') or get_output_format(path) for path, options in variants]
+    if any(path_format in PATH_OUTPUT_FORMATS and get_output_compression(path) for path_format, path in zip(formats, [output_path] + [path for path, _ in variants])):
+        parser.error("GeoPackage and Parquet outputs cannot be compressed")
+    if 'parquet' in formats and pyarrow is None:
+        parser.error("Parquet output needs the pyarrow package (pip install pyarrow)")
 
-    input_path = args.input_ifc
-    output_path = args.output if args.output else os.path.splitext(input_path)[0] + ".gml"
+    if len(args.input_ifc) > 1:
+        if not args.output:
+            parser.error("-o/--output is required with several input files")
+        if args.split or variants or args.out_of_core or args.inventory is not None or args.timings or args.kernel_report or args.checkpoint_dir:
+            parser.error("several input files cannot be combined with --split, --variant, --out-of-core, --inventory, --timings, --kernel-report or --checkpoint-dir")
+        try:
+            convert_multiple(args.input_ifc, output_path, workers=args.workers, spatial_index=args.spatial_index, **options)
+        except ValueError as e:
+            parser.error(str(e))
+        sys.exit(0)
+
+    if args.out_of_core:
+        if is_compressed_ifc(input_path):
+            parser.error("--out-of-core needs an uncompressed IFC file (it is memory-mapped)")
+        if args.split or variants or args.inventory is not None or args.timings or args.kernel_report or args.checkpoint_dir:
+            parser.error("--out-of-core cannot be combined with --split, --variant, --inventory, --timings, --kernel-report or --checkpoint-dir")
+        convert_out_of_core(input_path, output_path, args.out_of_core, workers=args.workers, spatial_index=args.spatial_index, **options)
+        sys.exit(0)
+
+    if args.inventory is not None:
+        # Keep stdout for the JSON document
+        with contextlib.redirect_stdout(sys.stderr):
+            converter = CityGMLGenerator(input_path, output_path, workers=args.workers, **options)
+            inventory = converter.inventory()
+        document = json.dumps(inventory, indent=2)
+        if args.inventory == "-":
+            print(document)
+        else:
+            with open(args.inventory, "w", encoding="utf-8") as stream:
+                stream.write(document + "\n")
+            print(f"Successfully wrote {args.inventory}")
+        sys.exit(0)
 
-    converter = CityGMLGenerator(input_path, output_path, no_references=args.no_references, reorient_shells=args.reorient_shells, no_properties=args.no_properties, georef_oktoberfest=args.georef_oktoberfest, list_unmapped_doors_windows=args.list_unmapped_doors_and_windows, unrelated_doors_windows_in_dummy_bce=args.unrelated_doors_and_windows_in_dummy_bce, no_generic_attribute_sets=args.no_generic_attribute_sets, pset_names_as_prefixes=args.pset_names_as_prefixes, no_storeys=args.no_storeys, no_appearances=args.no_appearances, xoffset=args.xoffset, yoffset=args.yoffset, zoffset=args.zoffset)
-    converter.generate()
-    
+    try:
+        converter = CityGMLGenerator(input_path, output_path, workers=args.workers, split=args.split, tile_size=args.tile_size, spatial_index=args.spatial_index, timings_path=args.timings, kernel_report_path=args.kernel_report,
+                                     checkpoint_dir=args.checkpoint_dir, resume=args.resume, output_format=output_format, parquet_geometry=args.parquet_geometry, **options)
+    except ValueError as e:
+        parser.error(str(e))
+    converter.generate(variants)
@@ -0,0 +1,27 @@
+"""
+Tests of ifc2citygml on the FZK Haus sample (input/AC20-FZK-Haus.ifc). The gml:ids of a conversion
+are random UUIDs, so outputs are compared in canonical form with the ids renamed in order of
+appearance (see canonicalize()).
+"""
+import os
+import re
+
+from lxml import etree
+
+SAMPLE_IFC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input", "AC20-FZK-Haus.ifc")
+
+# gml:ids (and their references) written by the converter: UUID_..., with a suffix where merged
+# documents made them unique, and DW_... of the dummy elements of unrelated doors and windows
+GML_ID_PATTERN = re.compile(r"UUID_[0-9a-f-]+(?:_\d+)?|DW_\d+")
+
+
+def rename_gml_ids(text):
+    """Replaces the gml:ids in text by ID0, ID1, ... in order of their first appearance."""
+    ids = {}
+    return GML_ID_PATTERN.sub(lambda match: ids.setdefault(match.group(), f"ID{len(ids)}"), text)
+
+
+def canonicalize(path):
+    """Returns the canonical XML (C14N, without indentation) of a CityGML file with renamed gml:ids."""
+    tree = etree.parse(path, etree.XMLParser(remove_blank_text=True))
+    return rename_gml_ids(etree.tostring(tree, method="c14n").decode())
@@ -0,0 +1,12 @@
+import pytest
+
+from ifc2citygml import CityGMLGenerator
+from tests import SAMPLE_IFC
+
+
+@pytest.fixture(scope="session")
+def reference_citygml(tmp_path_factory):
+    """Path of the CityGML of an uninterrupted conversion of the sample with the default options."""
+    path = tmp_path_factory.mktemp("reference") / "reference.gml"
+    CityGMLGenerator(SAMPLE_IFC, str(path)).generate()
+    return path
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+import ifc2citygml
+from ifc2citygml import CityGMLGenerator
+from tests import SAMPLE_IFC, canonicalize
+
+# Number of features converted before the simulated interruption
+INTERRUPT_AFTER = 20
+
+
+def interrupt_conversion(monkeypatch, output_path, checkpoint_dir):
+    """Runs a checkpointed conversion that is interrupted after INTERRUPT_AFTER features (each one committed)."""
+    add = ifc2citygml.Checkpoint.add
+
+    def add_and_interrupt(checkpoint, job, results):
+        add(checkpoint, job, results)
+        checkpoint.commit()
+        if checkpoint.count == INTERRUPT_AFTER:
+            raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ifc2citygml.Checkpoint, "add", add_and_interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            CityGMLGenerator(SAMPLE_IFC, str(output_path), checkpoint_dir=str(checkpoint_dir)).generate()
+
+
+def test_resume_matches_uninterrupted_run(tmp_path, monkeypatch, capsys, reference_citygml):
+    output_path = tmp_path / "resumed.gml"
+    checkpoint_dir = tmp_path / "checkpoint"
+    interrupt_conversion(monkeypatch, output_path, checkpoint_dir)
+    assert (checkpoint_dir / ifc2citygml.CHECKPOINT_STATE).exists()
+
+    CityGMLGenerator(SAMPLE_IFC, str(output_path), checkpoint_dir=str(checkpoint_dir), resume=True).generate()
+    assert f"{INTERRUPT_AFTER} features converted before" in capsys.readouterr().out
+    assert canonicalize(output_path) == canonicalize(reference_citygml)
+    # The checkpoint is removed once the output is complete
+    assert not os.path.exists(checkpoint_dir)
+
+
+def test_resume_with_other_options_is_refused(tmp_path, monkeypatch):
+    output_path = tmp_path / "resumed.gml"
+    checkpoint_dir = tmp_path / "checkpoint"
+    interrupt_conversion(monkeypatch, output_path, checkpoint_dir)
+
+    with pytest.raises(ValueError, match="other options"):
+        CityGMLGenerator(SAMPLE_IFC, str(output_path), checkpoint_dir=str(checkpoint_dir), resume=True, no_properties=True).generate()
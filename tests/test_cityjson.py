@@ -0,0 +1,76 @@
+import json
+import re
+
+import numpy as np
+import pytest
+
+from ifc2citygml import CityGMLGenerator
+from tests import SAMPLE_IFC
+
+POS_LIST_PATTERN = re.compile(r"<gml:posList>([^<]*)</gml:posList>")
+# Nesting depth of the boundaries down to the rings of vertex indices
+RING_DEPTHS = {'MultiSurface': 2, 'CompositeSurface': 2, 'Solid': 3}
+
+
+def iter_rings(boundaries, depth):
+    if depth == 0:
+        yield boundaries
+    else:
+        for boundary in boundaries:
+            yield from iter_rings(boundary, depth - 1)
+
+
+def get_rings(city_objects):
+    """Returns the rings (lists of vertex indices) of the geometries of CityJSON city objects."""
+    return [ring for city_object in city_objects.values() for geometry in city_object.get('geometry', [])
+            for ring in iter_rings(geometry['boundaries'], RING_DEPTHS[geometry['type']])]
+
+
+def check_hierarchy(city_objects):
+    for object_id, city_object in city_objects.items():
+        for child_id in city_object.get('children', []):
+            assert object_id in city_objects[child_id]['parents']
+        for parent_id in city_object.get('parents', []):
+            assert object_id in city_objects[parent_id]['children']
+
+
+@pytest.fixture(scope="module")
+def cityjson_paths(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("cityjson")
+    for name in ("sample.city.json", "sample.city.jsonl"):
+        CityGMLGenerator(SAMPLE_IFC, str(directory / name)).generate()
+    return directory / "sample.city.json", directory / "sample.city.jsonl"
+
+
+def test_cityjson(cityjson_paths, reference_citygml):
+    with open(cityjson_paths[0], encoding="utf-8") as stream:
+        document = json.load(stream)
+    assert document['type'] == "CityJSON"
+    vertices = np.array(document['vertices'], dtype=np.int64) * document['transform']['scale'] + document['transform']['translate']
+    rings = get_rings(document['CityObjects'])
+    assert all(0 <= index < len(vertices) for ring in rings for index in ring)
+    check_hierarchy(document['CityObjects'])
+
+    # Same triangles as the CityGML output, except those that collapse by the quantization (1 mm)
+    pos_lists = np.array([pos_list.split()[:9] for pos_list in POS_LIST_PATTERN.findall(reference_citygml.read_text(encoding="utf-8"))], dtype=np.float64)
+    quantized = np.rint(pos_lists * 1000).astype(np.int64).reshape(-1, 3, 3)
+    collapsed = (quantized[:, 0] == quantized[:, 1]).all(axis=1) | (quantized[:, 1] == quantized[:, 2]).all(axis=1) | (quantized[:, 0] == quantized[:, 2]).all(axis=1)
+    assert all(len(ring) == 3 for ring in rings)
+    assert len(rings) == (~collapsed).sum()
+    coordinates = pos_lists.reshape(-1, 3)
+    assert np.allclose(vertices.min(axis=0), coordinates.min(axis=0), atol=1e-3)
+    assert np.allclose(vertices.max(axis=0), coordinates.max(axis=0), atol=1e-3)
+
+
+def test_cityjson_sequence(cityjson_paths):
+    with open(cityjson_paths[1], encoding="utf-8") as stream:
+        header, *features = [json.loads(line) for line in stream]
+    assert header['type'] == "CityJSON" and header['vertices'] == [] and header['CityObjects'] == {}
+    assert features
+    for feature in features:
+        # Each feature has its own vertex list, its indices start at 0
+        assert feature['type'] == "CityJSONFeature" and feature['id'] in feature['CityObjects']
+        rings = get_rings(feature['CityObjects'])
+        indices = {index for ring in rings for index in ring}
+        assert indices and min(indices) == 0 and max(indices) < len(feature['vertices'])
+        check_hierarchy(feature['CityObjects'])
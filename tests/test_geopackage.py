@@ -0,0 +1,85 @@
+import sqlite3
+import struct
+
+import pytest
+
+from ifc2citygml import GEOPACKAGE_APPLICATION_ID, CityGMLGenerator
+from tests import SAMPLE_IFC
+
+
+def parse_geopackage_geometry(blob):
+    """
+    Parses a GeoPackage geometry blob with a 3D envelope and a WKB MultiPolygon Z.
+    Returns (srs_id, envelope as (minx, maxx, miny, maxy, minz, maxz), WKB, list of polygons as lists of rings of points).
+    """
+    magic, version, flags, srs_id = struct.unpack_from("<2sBBi", blob)
+    assert (magic, version) == (b"GP", 0)
+    # Little endian, XYZ envelope (indicator 2), not empty, standard GeoPackage binary
+    assert flags & 0b1 == 1 and (flags >> 1) & 0b111 == 2 and flags >> 4 == 0
+    envelope = struct.unpack_from("<6d", blob, 8)
+    wkb = blob[56:]
+    byte_order, geometry_type, count = struct.unpack_from("<BII", wkb)
+    assert (byte_order, geometry_type) == (1, 1006)
+    position = 9
+    polygons = []
+    for _ in range(count):
+        byte_order, polygon_type, ring_count = struct.unpack_from("<BII", wkb, position)
+        assert (byte_order, polygon_type) == (1, 1003)
+        position += 9
+        rings = []
+        for _ in range(ring_count):
+            (point_count,) = struct.unpack_from("<I", wkb, position)
+            coordinates = struct.unpack_from(f"<{3 * point_count}d", wkb, position + 4)
+            rings.append([coordinates[i:i + 3] for i in range(0, len(coordinates), 3)])
+            position += 4 + 24 * point_count
+        polygons.append(rings)
+    assert position == len(wkb)
+    return srs_id, envelope, wkb, polygons
+
+
+def encode_wkb(polygons):
+    """Encodes polygons (lists of rings of XYZ points) as little-endian ISO WKB MultiPolygon Z."""
+    data = struct.pack("<BII", 1, 1006, len(polygons))
+    for rings in polygons:
+        data += struct.pack("<BII", 1, 1003, len(rings))
+        for ring in rings:
+            data += struct.pack("<I", len(ring)) + b"".join(struct.pack("<3d", *point) for point in ring)
+    return data
+
+
+@pytest.fixture(scope="module")
+def geopackage(tmp_path_factory):
+    path = tmp_path_factory.mktemp("geopackage") / "sample.gpkg"
+    CityGMLGenerator(SAMPLE_IFC, str(path)).generate()
+    connection = sqlite3.connect(str(path))
+    yield connection
+    connection.close()
+
+
+def test_geometry_blobs(geopackage):
+    assert geopackage.execute("PRAGMA application_id").fetchone()[0] == GEOPACKAGE_APPLICATION_ID
+    table, column, geometry_type, srs_id, z, m = geopackage.execute("SELECT table_name, column_name, geometry_type_name, srs_id, z, m FROM gpkg_geometry_columns").fetchone()
+    assert (table, column, geometry_type, z, m) == ("city_objects", "geom", "MULTIPOLYGON", 1, 0)
+
+    triangles = 0
+    for (blob,) in geopackage.execute("SELECT geom FROM city_objects WHERE geom IS NOT NULL"):
+        blob_srs_id, envelope, wkb, polygons = parse_geopackage_geometry(blob)
+        assert blob_srs_id == srs_id
+        assert encode_wkb(polygons) == wkb
+        points = [point for rings in polygons for ring in rings for point in ring]
+        assert envelope == tuple(value for axis in range(3) for value in (min(p[axis] for p in points), max(p[axis] for p in points)))
+        # One closed triangle per polygon
+        assert all(len(rings) == 1 and len(rings[0]) == 4 and rings[0][0] == rings[0][-1] for rings in polygons)
+        triangles += len(polygons)
+    assert triangles == 21740
+
+
+def test_rtree_matches_envelopes(geopackage):
+    envelopes = {fid: parse_geopackage_geometry(blob)[1] for fid, blob in geopackage.execute("SELECT fid, geom FROM city_objects WHERE geom IS NOT NULL")}
+    rows = geopackage.execute("SELECT id, minx, maxx, miny, maxy FROM rtree_city_objects_geom").fetchall()
+    assert sorted(row[0] for row in rows) == sorted(envelopes)
+    for fid, *bounds in rows:
+        # The R-tree stores 32-bit floats rounded outwards
+        assert bounds == pytest.approx(envelopes[fid][:4], rel=1e-6, abs=1e-6)
+        assert bounds[0] <= envelopes[fid][0] and bounds[1] >= envelopes[fid][1]
+        assert bounds[2] <= envelopes[fid][2] and bounds[3] >= envelopes[fid][3]
@@ -0,0 +1,66 @@
+import json
+import re
+import struct
+
+import numpy as np
+import pytest
+
+from ifc2citygml import CityGMLGenerator
+from tests import SAMPLE_IFC
+
+GLB_MAGIC = b"glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+POS_LIST_PATTERN = re.compile(r"<gml:posList>([^<]*)</gml:posList>")
+
+
+@pytest.fixture(scope="module")
+def glb(tmp_path_factory):
+    """Returns the glTF JSON and the BIN chunk of the sample converted to .glb (after checking the chunk layout)."""
+    path = tmp_path_factory.mktemp("gltf") / "sample.glb"
+    CityGMLGenerator(SAMPLE_IFC, str(path)).generate()
+    data = path.read_bytes()
+    magic, version, length = struct.unpack_from("<4sII", data)
+    assert (magic, version, length) == (GLB_MAGIC, 2, len(data))
+    json_length, json_type = struct.unpack_from("<II", data, 12)
+    assert json_type == CHUNK_JSON and json_length % 4 == 0
+    bin_position = 20 + json_length
+    bin_length, bin_type = struct.unpack_from("<II", data, bin_position)
+    assert bin_type == CHUNK_BIN and bin_position % 4 == 0 and bin_length % 4 == 0
+    assert bin_position + 8 + bin_length == len(data)
+    gltf = json.loads(data[20:20 + json_length])
+    assert gltf["buffers"] == [{"byteLength": bin_length}]
+    return gltf, data[bin_position + 8:]
+
+
+def read_accessor(gltf, binary, index, dtype, width):
+    accessor = gltf["accessors"][index]
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    assert view["byteOffset"] % 4 == 0
+    assert view["byteLength"] == accessor["count"] * width * np.dtype(dtype).itemsize
+    return np.frombuffer(binary, dtype=dtype, count=accessor["count"] * width, offset=view["byteOffset"]).reshape(-1, width)
+
+
+def test_accessors(glb):
+    gltf, binary = glb
+    for mesh in gltf["meshes"]:
+        for primitive in mesh["primitives"]:
+            position_index = primitive["attributes"]["POSITION"]
+            positions = read_accessor(gltf, binary, position_index, "<f4", 3)
+            assert gltf["accessors"][position_index]["min"] == positions.min(axis=0).tolist()
+            assert gltf["accessors"][position_index]["max"] == positions.max(axis=0).tolist()
+            indices = read_accessor(gltf, binary, primitive["indices"], "<u4", 1)
+            assert len(indices) % 3 == 0
+            assert indices.max() < len(positions)
+
+
+def test_positions_are_y_up(glb, reference_citygml):
+    # The positions relative to the origin are (x, z, -y) of the CityGML coordinates
+    gltf, binary = glb
+    accessors = [gltf["accessors"][index] for index in {primitive["attributes"]["POSITION"] for mesh in gltf["meshes"] for primitive in mesh["primitives"]}]
+    lower = np.min([accessor["min"] for accessor in accessors], axis=0)
+    upper = np.max([accessor["max"] for accessor in accessors], axis=0)
+    origin = np.array(gltf["scenes"][0]["extras"]["origin"])
+    coordinates = np.array(" ".join(POS_LIST_PATTERN.findall(reference_citygml.read_text(encoding="utf-8"))).split(), dtype=np.float64).reshape(-1, 3)
+    assert np.allclose(origin + [lower[0], -upper[2], lower[1]], coordinates.min(axis=0), atol=1e-3)
+    assert np.allclose(origin + [upper[0], -lower[2], upper[1]], coordinates.max(axis=0), atol=1e-3)
@@ -0,0 +1,20 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import ifc2citygml
+from ifc2citygml import CityGMLGenerator
+from tests import SAMPLE_IFC, canonicalize
+
+
+def test_kernel_timeout_does_not_fork_in_threads(tmp_path, monkeypatch, reference_citygml):
+    def fork(*args):
+        raise AssertionError("forked a kernel process outside the main thread")
+
+    monkeypatch.setattr(ifc2citygml.CityGMLGenerator, "_create_shape_with_timeout", fork)
+    converter = CityGMLGenerator(SAMPLE_IFC, None, kernel_timeout=30)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        buffer = io.BytesIO()
+        pool.submit(converter.write, buffer).result()
+    output_path = tmp_path / "threaded.gml"
+    output_path.write_bytes(buffer.getvalue())
+    assert canonicalize(output_path) == canonicalize(reference_citygml)
@@ -0,0 +1,24 @@
+from lxml import etree
+
+from ifc2citygml import NSMAP, convert_out_of_core
+from tests import SAMPLE_IFC, canonicalize, rename_gml_ids
+
+
+def converted_elements(path):
+    """Returns the canonical XML of the features converted from IFC elements below the buildings, sorted."""
+    tree = etree.parse(str(path), etree.XMLParser(remove_blank_text=True))
+    features = (reference.getparent() for reference in tree.iterfind(f".//{{{NSMAP['core']}}}externalReference"))
+    return sorted(rename_gml_ids(etree.tostring(feature, method="c14n").decode()) for feature in features if feature.tag != f"{{{NSMAP['bldg']}}}Building")
+
+
+def test_building_merge_matches_normal_run(tmp_path, reference_citygml):
+    output_path = tmp_path / "merged.gml"
+    convert_out_of_core(SAMPLE_IFC, str(output_path), "building")
+    assert canonicalize(output_path) == canonicalize(reference_citygml)
+
+
+def test_storey_merge_converts_the_same_elements(tmp_path, reference_citygml):
+    # Per storey the features of a building are merged storey by storey, so only their order differs
+    output_path = tmp_path / "merged.gml"
+    convert_out_of_core(SAMPLE_IFC, str(output_path), "storey", workers=2)
+    assert converted_elements(output_path) == converted_elements(reference_citygml)
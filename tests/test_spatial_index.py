@@ -0,0 +1,47 @@
+import re
+
+import numpy as np
+import pytest
+
+from ifc2citygml import CityGMLGenerator, query_spatial_index
+from tests import SAMPLE_IFC
+
+# Start of an indexed fragment: the feature property and the feature with its gml:id
+FEATURE_START_PATTERN = re.compile(rb'\s*<(\w+:\w+)>\s*<\w+:\w+ gml:id="([^"]+)"')
+POS_LIST_PATTERN = re.compile(rb"<gml:posList>([^<]*)</gml:posList>")
+
+
+def get_fragment_envelope(fragment):
+    """Returns the (minx, miny, minz, maxx, maxy, maxz) of the posLists of a fragment."""
+    coordinates = np.array(b" ".join(POS_LIST_PATTERN.findall(fragment)).split(), dtype=np.float64).reshape(-1, 3)
+    return np.concatenate([coordinates.min(axis=0), coordinates.max(axis=0)])
+
+
+@pytest.mark.parametrize("split", [None, "storey"])
+def test_index_byte_ranges_match_gml_ids(tmp_path, split):
+    CityGMLGenerator(SAMPLE_IFC, str(tmp_path / "indexed.gml"), split=split, spatial_index=True).generate()
+    index_paths = sorted(tmp_path.glob("*.gml.idx"))
+    assert len(index_paths) == (1 if split is None else 2)
+    for index_path in index_paths:
+        data = index_path.with_suffix("").read_bytes()
+        features = query_spatial_index(str(index_path), (-1e9, -1e9, 1e9, 1e9))
+        assert features
+        for gml_id, offset, length in features:
+            fragment = data[offset:offset + length]
+            property_name, feature_id = FEATURE_START_PATTERN.match(fragment).groups()
+            assert feature_id.decode() == gml_id
+            assert fragment.rstrip().endswith(b"</" + property_name + b">")
+
+
+def test_query_returns_the_intersecting_features(tmp_path):
+    output_path = tmp_path / "indexed.gml"
+    CityGMLGenerator(SAMPLE_IFC, str(output_path), spatial_index=True).generate()
+    data = output_path.read_bytes()
+    features = query_spatial_index(f"{output_path}.idx", (-1e9, -1e9, 1e9, 1e9))
+    envelopes = {gml_id: get_fragment_envelope(data[offset:offset + length]) for gml_id, offset, length in features}
+
+    for query in [(2.0, 2.0, 4.0, 4.0), (10.5, -1.0, 20.0, 1.5), (0.0, 0.0, 6.0, 5.0, 10.0, 8.0), (100.0, 100.0, 101.0, 101.0)]:
+        dimensions = len(query) // 2
+        lower, upper = np.array(query[:dimensions]), np.array(query[dimensions:])
+        expected = {gml_id for gml_id, envelope in envelopes.items() if (envelope[:dimensions] <= upper).all() and (envelope[3:3 + dimensions] >= lower).all()}
+        assert {gml_id for gml_id, _, _ in query_spatial_index(f"{output_path}.idx", query)} == expected
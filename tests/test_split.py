@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from lxml import etree
+
+from ifc2citygml import NSMAP, CityGMLGenerator, OutputPartition
+from tests import SAMPLE_IFC
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+GML_ID = f"{{{NSMAP['gml']}}}id"
+
+
+@pytest.mark.parametrize("mode, tile_size", [("building", None), ("storey", None), ("tile", 4.0)])
+def test_split_xlinks_resolve(tmp_path, mode, tile_size):
+    CityGMLGenerator(SAMPLE_IFC, str(tmp_path / "split.gml"), split=mode, tile_size=tile_size).generate()
+    with open(tmp_path / "split_manifest.json", encoding="utf-8") as stream:
+        files = [entry["file"] for entry in json.load(stream)["files"]]
+    trees = {name: etree.parse(str(tmp_path / name)) for name in files}
+    ids = {name: {element.get(GML_ID) for element in tree.iter() if element.get(GML_ID)} for name, tree in trees.items()}
+
+    references = 0
+    for name, tree in trees.items():
+        for element in tree.iter():
+            href = element.get(XLINK_HREF, element.text if element.tag == f"{{{NSMAP['app']}}}target" else None)
+            if href is None:
+                continue
+            target_file, _, target_id = href.partition("#")
+            assert target_id in ids[target_file or name], f"{href} in {name} does not resolve"
+            references += target_file != ""
+    # Small tiles cut the buildings apart, so some features refer to features in other files
+    assert references > 0 if mode == "tile" else references == 0
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_split_parts_are_written_by_at_most_workers_threads(tmp_path, monkeypatch, workers):
+    lock = threading.Lock()
+    active = []
+    concurrency = []
+    write_part = OutputPartition._write_part
+
+    def record_write_part(partition, generator, part, root):
+        with lock:
+            active.append(part)
+            concurrency.append(len(active))
+        # Give the other threads the chance to start their parts meanwhile
+        time.sleep(0.05)
+        try:
+            return write_part(partition, generator, part, root)
+        finally:
+            with lock:
+                active.remove(part)
+
+    monkeypatch.setattr(OutputPartition, "_write_part", record_write_part)
+    # More CPUs than workers: the thread count follows workers, not the machine
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    CityGMLGenerator(SAMPLE_IFC, str(tmp_path / "split.gml"), split="tile", tile_size=4.0, workers=workers).generate()
+    assert len(concurrency) > workers
+    assert max(concurrency) == workers
@@ -0,0 +1,41 @@
+import pytest
+
+from ifc2citygml import CityGMLGenerator, parse_variant
+from tests import SAMPLE_IFC, canonicalize
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("viz.gml", ("viz.gml", {})),
+    ("viz.gml:no-properties,no-appearances", ("viz.gml", {'no_properties': True, 'no_appearances': True})),
+    ("full.gml:no-properties=false,envelopes=TRUE", ("full.gml", {'no_properties': False, 'envelopes': True})),
+    ("mat.gml:shared-materials=building", ("mat.gml", {'shared_materials': 'building'})),
+    ("mat.gml:shared-materials=none", ("mat.gml", {'shared_materials': None})),
+    ("out.json:output-format=cityjson", ("out.json", {'output_format': 'cityjson'})),
+    (r"C:\data\viz.gml", (r"C:\data\viz.gml", {})),
+    (r"C:\data\viz.gml:no-storeys", (r"C:\data\viz.gml", {'no_storeys': True})),
+])
+def test_parse_variant(spec, expected):
+    assert parse_variant(spec) == expected
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("viz.gml:no-colors", "invalid option 'no-colors'"),
+    ("viz.gml:no-properties=yes", "invalid value 'yes' for no-properties"),
+    ("mat.gml:shared-materials=storey", "invalid value 'storey' for shared-materials"),
+    ("out.json:output-format=json", "invalid value 'json' for output-format"),
+])
+def test_parse_variant_rejects_invalid_options(spec, message):
+    with pytest.raises(ValueError, match=message):
+        parse_variant(spec)
+
+
+def test_variants_match_separate_runs(tmp_path, reference_citygml):
+    # One run writing the main output and the variants of --variant full.gml --variant viz.gml:no-properties,no-appearances
+    variants = [parse_variant(str(tmp_path / spec)) for spec in ("full.gml", "viz.gml:no-properties,no-appearances")]
+    CityGMLGenerator(SAMPLE_IFC, str(tmp_path / "main.gml")).generate(variants)
+
+    separate_path = tmp_path / "separate_viz.gml"
+    CityGMLGenerator(SAMPLE_IFC, str(separate_path), no_properties=True, no_appearances=True).generate()
+    assert canonicalize(tmp_path / "main.gml") == canonicalize(reference_citygml)
+    assert canonicalize(tmp_path / "full.gml") == canonicalize(reference_citygml)
+    assert canonicalize(tmp_path / "viz.gml") == canonicalize(separate_path)